@@ -615,6 +615,32 @@ def new_page_from_text(text, format='wiki'):
 
 
 
+def dump_index_db(db):
+	'''Returns a SQL script to re-create an index database
+	Like C{db.iterdump()}, but also works for the full text table,
+	which can not be restored from the dump of its data tables.
+	@param db: a C{sqlite3.Connection}
+	@returns: a string with SQL statements
+	'''
+	from zim.notebook.index.content import FULLTEXT_TABLE, has_fulltext_table
+
+	lines = []
+	for line in db.iterdump():
+		if line.startswith('CREATE TABLE \'%s_' % FULLTEXT_TABLE) \
+		or line.startswith('INSERT INTO "%s' % FULLTEXT_TABLE):
+			continue # skip data tables, recreated by virtual table
+		elif line == 'COMMIT;' and has_fulltext_table(db):
+			for row in db.execute(
+				'SELECT \'INSERT INTO %s(docid, content) VALUES(\' '
+				'|| docid || \',\' || quote(content) || \');\' FROM %s'
+				% (FULLTEXT_TABLE, FULLTEXT_TABLE)
+			):
+				lines.append(row[0])
+		lines.append(line)
+
+	return '\n'.join(lines)
+
+
 _notebook_data = None
 
 def new_notebook(fakedir=None):
@@ -653,8 +679,7 @@ def new_notebook(fakedir=None):
 
 		index = Index(':memory:', layout)
 		index.check_and_update()
-		lines = list(index._db.iterdump())
-		sql = '\n'.join(lines)
+		sql = dump_index_db(index._db)
 
 		_notebook_data = (templfolder, sql, manifest)
 
@@ -673,10 +698,11 @@ def new_notebook(fakedir=None):
 	index = Index(':memory:', layout)
 	tables = [r[0] for r in index._db.execute(
 		'SELECT name FROM sqlite_master '
-		'WHERE type="table" and name NOT LIKE "sqlite%"'
+		'WHERE type="table" and name NOT LIKE "sqlite%" '
+		'ORDER BY sql LIKE "CREATE VIRTUAL%" DESC'
 	)]
 	for table in tables:
-		index._db.execute('DROP TABLE %s' % table)
+		index._db.execute('DROP TABLE IF EXISTS %s' % table)
 	index._db.executescript(sql)
 	index._db.commit()
 
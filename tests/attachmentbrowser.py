@@ -128,8 +128,73 @@ class TestThumbnailManager(tests.TestCase):
 		self.assertTrue(thumbfile.exists())
 		self.assertIsInstance(pixbuf, gtk.gdk.Pixbuf)
 
-		# Test remove
+		# Thumbnail is in the index now
+		thumbfile, pixbuf = manager.get_indexed_thumbnail(file, 64)
+		self.assertTrue(thumbfile.exists())
+		self.assertIsInstance(pixbuf, gtk.gdk.Pixbuf)
+
+		thumbfile, pixbuf = manager.get_indexed_thumbnail(file, THUMB_SIZE_LARGE)
+		self.assertEqual((thumbfile, pixbuf), (None, None))
+
 		self.removeThumbnail(manager, file)
+		thumbfile, pixbuf = manager.get_indexed_thumbnail(file, 64)
+		self.assertEqual((thumbfile, pixbuf), (None, None))
+
+
+class TestThumbnailIndex(tests.TestCase):
+
+	def runTest(self):
+		dbpath = self.get_tmp_name('index.db')
+		index = ThumbnailIndex(dbpath)
+		file = LocalFile('/foo/bar.png')
+		self.assertFalse(index.is_valid(file, 64, 1234))
+
+		index.add(file, 64, 1234.5)
+		self.assertTrue(index.is_valid(file, 64, 1234))
+		self.assertTrue(index.is_valid(file, THUMB_SIZE_NORMAL, 1234))
+		self.assertFalse(index.is_valid(file, THUMB_SIZE_LARGE, 1234))
+		self.assertFalse(index.is_valid(file, 64, 1235))
+		index.add(file, THUMB_SIZE_LARGE, 1234)
+
+		# Reload from disk
+		index = ThumbnailIndex(dbpath)
+		self.assertTrue(index.is_valid(file, 64, 1234))
+		self.assertTrue(index.is_valid(file, THUMB_SIZE_LARGE, 1234))
+
+		index.remove(file)
+		self.assertFalse(index.is_valid(file, 64, 1234))
+		index = ThumbnailIndex(dbpath)
+		self.assertFalse(index.is_valid(file, 64, 1234))
+		self.assertFalse(index.is_valid(file, THUMB_SIZE_LARGE, 1234))
+
+
+class TestProcessThumbnailCreatorTimeout(tests.TestCase):
+
+	def runTest(self):
+		import multiprocessing
+		import zim.plugins.attachmentbrowser.thumbnailer as thumbnailer
+
+		class MockResult(object):
+
+			def get(self, timeout):
+				assert timeout == THUMB_PROCESS_TIMEOUT
+				raise multiprocessing.TimeoutError
+
+		class MockPool(object):
+
+			def apply_async(self, func, args):
+				return MockResult()
+
+		get_process_pool = thumbnailer._get_process_pool
+		thumbnailer._get_process_pool = MockPool
+		try:
+			file = LocalFile('/foo/bar.png')
+			thumbfile = LocalFile('/foo/thumb.png')
+			with tests.LoggingFilter('zim.plugins.attachmentbrowser', 'Timeout'):
+				self.assertRaises(ThumbnailCreatorFailure,
+					processThumbnailCreator, file, thumbfile, THUMB_SIZE_NORMAL)
+		finally:
+			thumbnailer._get_process_pool = get_process_pool
 
 
 @tests.slowTest
@@ -179,6 +244,28 @@ class TestThumbnailQueue(tests.TestCase):
 		queue.clear_queue()
 		self.assertTrue(queue.queue_empty())
 
+	def testWorkers(self):
+		# Custom creator runs in threads, check all workers stop
+		def creator(file, thumbfile, thumbsize):
+			return pixbufThumbnailCreator(file, thumbfile, thumbsize)
+
+		queue = ThumbnailQueue(creator, workers=3)
+		dir = self.SRC_DIR.folder('data/pixmaps')
+		files = [dir.file(n) for n in dir.list_names() if not n.endswith('.svg')]
+		for file in files:
+			queue.queue_thumbnail_request(file, 64)
+
+		queue.start()
+		seen = set()
+		while not queue.queue_empty():
+			file, size, thumbfile, pixbuf, mtime = queue.get_ready_thumbnail(block=True)
+			seen.add(file)
+		self.assertEqual(seen, set(files))
+
+		for thread in list(queue._threads):
+			thread.join()
+		self.assertEqual(queue._threads, [])
+
 	def testError(self):
 
 		def creator_with_failure(*a):
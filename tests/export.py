@@ -334,9 +334,9 @@ class TestPageSelections(tests.TestCase):
 		self.assertIsNotNone(selection.notebook)
 		for p in selection:
 			self.assertIsInstance(p, Page)
+		self.assertEqual(len(selection), len(list(selection)))
 
 	# TODO add alternative method to walk names for ToC
-	# TODO add __len__ that gives total pages for progress
 	# TODO Use collections subclass to make interface complete ?
 
 	def testAllPages(self):
@@ -379,6 +379,91 @@ class TestMultiFileExporter(tests.TestCase):
 		self.assertIn('<li><a href="./roundtrip.html" title="roundtrip" class="page">roundtrip</a></li>', text)
 
 
+@tests.skipUnless(MultiFileExporter.parallel_export_supported(), 'Parallel export not supported')
+class TestMultiFileExporterParallel(tests.TestCase):
+
+	def runTest(self):
+		notebook = tests.new_notebook(fakedir='/foo')
+		pages = AllPages(notebook)
+
+		serialdir = Dir(self.create_tmp_dir('serial'))
+		exporter = build_notebook_exporter(serialdir, 'html', 'Default', index_page='Index')
+		exporter.export(pages)
+
+		paralleldir = Dir(self.create_tmp_dir('parallel'))
+		exporter = build_notebook_exporter(paralleldir, 'html', 'Default', index_page='Index', jobs=2)
+		self.assertEqual(exporter.jobs, 2)
+		exporter.export(pages)
+
+		files = list(serialdir.walk())
+		self.assertTrue(len(files) > 10)
+		self.assertEqual(
+			[f.relpath(paralleldir) for f in paralleldir.walk()],
+			[f.relpath(serialdir) for f in files]
+		)
+		for file in files:
+			if isinstance(file, File):
+				other = paralleldir.file(file.relpath(serialdir))
+				self.assertEqual(other.raw(), file.raw(), 'Differs: %s' % other)
+
+
+class TestMultiFileExporterIncremental(tests.TestCase):
+
+	def runTest(self):
+		dir = Dir(self.create_tmp_dir())
+		notebook = tests.new_notebook(fakedir='/foo')
+		pages = AllPages(notebook)
+
+		def export():
+			exporter = build_notebook_exporter(dir, 'html', 'Default', index_page='Index', incremental=True)
+			exporter.export(pages)
+			return exporter
+
+		exporter = export()
+		self.assertTrue(exporter.layout.manifest_file().exists())
+		self.assertIsNone(exporter._manifest)
+
+		def mark():
+			for p in pages:
+				exporter.layout.page_file(p).write('DUMMY')
+
+		def changed():
+			return [
+				p.name for p in pages
+					if exporter.layout.page_file(p).read() != 'DUMMY'
+			]
+
+		# Nothing changed, nothing exported
+		total = len(list(pages))
+		mark()
+		export()
+		self.assertEqual(changed(), [])
+
+		# Change one page, export only that one and related pages
+		page = notebook.get_page(Path('roundtrip'))
+		page.get_parsetree()
+		page.parse('wiki', 'test 123\n')
+		notebook.store_page(page)
+		export()
+		self.assertIn('roundtrip', changed())
+		self.assertIn('test 123', exporter.layout.page_file(page).read())
+		self.assertTrue(len(changed()) < total / 2)
+		mark()
+
+		# Remove a page, also removes the output
+		file = exporter.layout.page_file(page)
+		notebook.delete_page(page)
+		export()
+		self.assertFalse(file.exists())
+		self.assertTrue(0 < len(changed()) < total / 2)
+
+		# Different settings, export all
+		mark()
+		exporter = build_notebook_exporter(dir, 'html', 'Default', incremental=True)
+		exporter.export(pages)
+		self.assertEqual(len(changed()), len(list(pages)))
+
+
 class TestSingleFileExporter(tests.TestCase):
 
 	def runTest(self):
@@ -395,6 +480,16 @@ class TestSingleFileExporter(tests.TestCase):
 		text = file.read()
 		self.assertIn('Lorem ipsum dolor sit amet', text)
 
+		# Error in template keeps the previous export
+		def process(output, context):
+			output.append('Partial output')
+			raise AssertionError('Error in template')
+
+		exporter.template.process = process
+		self.assertRaises(AssertionError, exporter.export, pages)
+		self.assertEqual(file.read(), text)
+		self.assertFalse(os.path.exists(file.encodedpath + '.zim-new~'))
+
 
 @tests.slowTest # Slow because it uses a tmp file internally
 class TestMHTMLExporter(tests.TestCase):
@@ -582,6 +677,27 @@ class TestExportCommand(tests.TestCase):
 		self.assertIsNotNone(exp.format)
 		self.assertIsNotNone(exp.index_page)
 
+		## Full notebook, parallel and incremental
+		cmd = ExportCommand('export')
+		cmd.parse_options(self.notebook.path,
+			'--output', self.tmpdir.subdir('output').path,
+			'--overwrite',
+			'--jobs', '4',
+			'--incremental',
+		)
+		exp = cmd.get_exporter(None)
+		self.assertIsInstance(exp, MultiFileExporter)
+		self.assertEqual(exp.jobs, 4)
+		self.assertTrue(exp.incremental)
+
+		cmd = ExportCommand('export')
+		cmd.parse_options(self.notebook.path,
+			'--output', self.tmpdir.subdir('output').path,
+			'--overwrite',
+			'--jobs', 'foo',
+		)
+		self.assertRaises(UsageError, cmd.get_exporter, None)
+
 
 		## Full notebook, single page
 		cmd = ExportCommand('export')
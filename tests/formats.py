@@ -10,6 +10,7 @@ from __future__ import with_statement
 import tests
 
 from zim.formats import *
+from zim.tokenparser import TEXT as TOKEN_TEXT, END as TOKEN_END
 from zim.fs import File
 from zim.notebook import Path
 from zim.parsing import link_type
@@ -327,6 +328,164 @@ Head 3
 		self.assertEqual(text, wanted)
 
 
+class TestTokenParseTree(tests.TestCase):
+
+	def setUp(self):
+		xml = File('tests/data/formats/parsetree.xml').read().rstrip('\n')
+		self.reftree = ParseTree().fromstring(xml)
+		self.xml = self.reftree.tostring()
+
+	def testTokens(self):
+		tree = TokenParseTree(self.reftree.totokens())
+		self.assertIsNotNone(tree._tokens)
+
+		# Methods used by indexers work without converting
+		for method in (
+			lambda t: [h.names for h in t.iter_href()],
+			lambda t: list(t.iter_tag_names()),
+			lambda t: list(t.iter_text()),
+			lambda t: t.iter_tokens(),
+			lambda t: (t.hascontent, t.ispartial, t.israw),
+			lambda t: (t.count('foo'), t.countre(re.compile(r'\w+'))),
+			lambda t: (t.get_heading(), t.get_heading(2), t.get_heading_level()),
+		):
+			self.assertEqual(method(tree), method(self.reftree))
+		self.assertIsNotNone(tree._tokens)
+
+		copy = tree.copy()
+		self.assertIsInstance(copy, TokenParseTree)
+		self.assertEqual(copy.tostring(), self.xml)
+
+		# Other methods convert to ElementTree
+		self.assertEqual(tree.tostring(), self.xml)
+		self.assertIsNone(tree._tokens)
+		self.assertEqual(list(tree.iter_tag_names()), list(self.reftree.iter_tag_names()))
+
+	def testHeading(self):
+		parser = get_format('wiki').Parser()
+		for text in (
+			'====== Head ======\nfoo\n',
+			'\n\n===== Head 2 =====\nfoo\n',
+			'foo\n====== Head ======\n',
+			'====== ======\nfoo\n',
+			'foo\n',
+			'',
+		):
+			reftree = parser.parse(text)
+			tree = TokenParseTree(reftree.totokens())
+			for level in (1, 2):
+				self.assertEqual(tree.get_heading(level), reftree.get_heading(level))
+			self.assertEqual(tree.get_heading_level(), reftree.get_heading_level())
+			self.assertIsNotNone(tree._tokens)
+
+	def testThreads(self):
+		# Converting to an ElementTree in one thread should not break
+		# methods using the tokens in other threads
+		import threading
+
+		errors = []
+		def read(tree, start):
+			start.wait()
+			try:
+				for i in range(20):
+					tree.copy()
+					tree.hascontent
+					tree.get_heading()
+					list(tree.iter_text())
+					tree.tostring()
+			except Exception as error:
+				errors.append(error)
+
+		for i in range(10):
+			tree = TokenParseTree(self.reftree.totokens())
+			start = threading.Event()
+			threads = [threading.Thread(target=read, args=(tree, start)) for j in range(4)]
+			for thread in threads:
+				thread.start()
+			start.set()
+			for thread in threads:
+				thread.join()
+			self.assertEqual(errors, [])
+			self.assertEqual(tree.tostring(), self.xml)
+
+		# Same race without threads, converting while iterating
+		tree = TokenParseTree(self.reftree.totokens())
+		hrefs = []
+		for href in tree.iter_href():
+			tree.tostring()
+			hrefs.append(href.names)
+		self.assertEqual(hrefs, [h.names for h in self.reftree.iter_href()])
+
+	def testVisit(self):
+		class MyVisitor(object):
+
+			def __init__(self):
+				self.calls = []
+
+			def start(self, tag, attrib=None):
+				self.calls.append(('start', tag, attrib))
+				if tag == STRONG:
+					raise VisitorSkip
+
+			def text(self, text):
+				self.calls.append(('text', text))
+				if 'bar' in text:
+					raise VisitorSkip
+
+			def end(self, tag):
+				self.calls.append(('end', tag))
+
+			def append(self, tag, attrib=None, text=None):
+				self.calls.append(('append', tag, attrib, text))
+				if tag == LINK:
+					raise VisitorSkip
+
+		tree = TokenParseTree(self.reftree.totokens())
+		visitor = MyVisitor()
+		tree.visit(visitor)
+		wanted = MyVisitor()
+		self.reftree.visit(wanted)
+		self.assertTrue(len(wanted.calls) > 10)
+		self.assertEqual(visitor.calls, wanted.calls)
+
+		# Empty text is skipped, like for the etree
+		tokens = [
+			FORMATTEDTEXT, None,
+			HEADING, {'level': 1}, TOKEN_TEXT, 'Head', TOKEN_END, HEADING,
+			TOKEN_TEXT, '',
+			TOKEN_END, FORMATTEDTEXT
+		]
+		tree = TokenParseTree(tokens)
+		visitor = MyVisitor()
+		tree.visit(visitor)
+		wanted = MyVisitor()
+		ParseTree().fromstring(tree.tostring()).visit(wanted)
+		self.assertEqual(visitor.calls, wanted.calls)
+
+	def testBuilder(self):
+		builder = TokenParseTreeBuilder(partial=True)
+		builder.start(FORMATTEDTEXT)
+		builder.append(HEADING, {'level': 1}, 'Head')
+		builder.start(PARAGRAPH)
+		builder.text('foo ')
+		builder.text('bar')
+		builder.append(TAG, {'name': 'tag'}, '@tag')
+		builder.end(PARAGRAPH)
+		builder.end(FORMATTEDTEXT)
+		tree = builder.get_parsetree()
+		self.assertEqual(tree.totokens(), [
+			FORMATTEDTEXT, {'partial': True},
+			HEADING, {'level': 1}, TOKEN_TEXT, 'Head', TOKEN_END, HEADING,
+			TOKEN_TEXT, '\n',
+			PARAGRAPH, None, TOKEN_TEXT, 'foo bar',
+			TAG, {'name': 'tag'}, TOKEN_TEXT, '@tag', TOKEN_END, TAG,
+			TOKEN_END, PARAGRAPH,
+			TOKEN_END, FORMATTEDTEXT
+		])
+		self.assertTrue(tree.ispartial)
+		self.assertEqual(list(tree.iter_tag_names()), ['tag'])
+
+
 class TestTextFormat(tests.TestCase, TestFormatMixin):
 
 	def setUp(self):
@@ -559,6 +718,27 @@ dus ja.
 		check(text, xml)
 
 
+	def testAnchoredParsing(self):
+		# Anchors and inline shortcuts should not change parse results
+		from zim.formats.wiki import wikiparser
+		text = File('tests/data/formats/wiki.txt').read()
+		wanted = self.format.Parser().parse(text).tostring()
+
+		block, inter = wikiparser.block_parser, wikiparser.list_and_indent_parser
+		anchors = (block.anchor, inter.anchor, block._anchor_re, inter._anchor_re)
+		try:
+			block.anchor = inter.anchor = None
+			block._anchor_re = inter._anchor_re = None
+			wikiparser.parse_inline = wikiparser.inline_parser
+			inter.process_unmatched = wikiparser.inline_parser
+			tree = self.format.Parser().parse(text)
+		finally:
+			block.anchor, inter.anchor, block._anchor_re, inter._anchor_re = anchors
+			del wikiparser.parse_inline
+			inter.process_unmatched = wikiparser.parse_inline
+
+		self.assertEqual(tree.tostring(), wanted)
+
 	def testIndent(self):
 		# Test some odditied pageview can give us
 		xml = '''\
@@ -186,6 +186,13 @@ class TestFS(tests.TestCase):
 		self.assertEqual(file.readlines(), ['c\n', 'd\n'])
 		self.assertTrue(os.path.isfile(file.encodedpath + '.zim-new~'))
 
+		# discard write
+		fh = file.open('w')
+		fh.write('foo')
+		fh.discard()
+		self.assertEqual(file.readlines(), ['c\n', 'd\n'])
+		self.assertFalse(os.path.isfile(file.encodedpath + '.zim-new~'))
+
 		# test recovery on windows
 		if os.name == 'nt':
 			new = file.encodedpath + '.zim-new~'
@@ -236,8 +236,19 @@ class TestDialogs(tests.TestCase):
 		dialog = SearchDialog(mainwindow)
 		dialog.query_entry.set_text('Foo')
 		dialog.query_entry.activate()
+		self.assertTrue(dialog.results_treeview.searching)
+		while dialog.results_treeview.searching:
+			tests.gtk_process_events()
 		model = dialog.results_treeview.get_model()
 		self.assertTrue(len(model) > 3)
+		self.assertFalse(dialog.results_treeview.cancelled)
+
+		# Typing cancels the running search
+		dialog.query_entry.activate()
+		dialog.query_entry.set_text('Bar')
+		self.assertTrue(dialog.results_treeview.cancelled)
+		while dialog.results_treeview.searching:
+			tests.gtk_process_events()
 
 		col = dialog.results_treeview.get_column(0)
 		dialog.results_treeview.row_activated((0,), col)
@@ -18,7 +18,8 @@ from zim.newfs import LocalFolder, File
 from zim.newfs.mock import os_native_path
 
 from zim.notebook import Path
-from zim.notebook.index.files import FilesIndexer, TestFilesDBTable, FilesIndexChecker
+from zim.notebook.index.files import FilesIndexer, TestFilesDBTable, FilesIndexChecker, \
+	STATUS_NEED_UPDATE
 from zim.notebook.index.pages import PagesIndexer, TestPagesDBTable
 from zim.notebook.index.links import LinksIndexer
 from zim.notebook.index.tags import TagsIndexer
@@ -157,6 +158,68 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 				self.root.child(name).remove()
 
 
+class TestFilesIndexerBulkMode(TestFilesIndexer):
+
+	def runTest(self):
+		self.root = self.setUpFolder(mock=tests.MOCK_ALWAYS_MOCK)
+		db = sqlite3.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		indexer = FilesIndexer(db, self.root)
+		self.assertTrue(indexer.is_empty())
+
+		commits = tests.Counter()
+		indexer.db = tests.MaskedObject(db, 'execute', 'executemany')
+		indexer.db.commit = commits
+
+		signals = tests.SignalLogger(indexer, lambda n, o, a: a[0]['path'] if a else ())
+
+		self.create_files(self.FILES)
+		for i in indexer.update_iter(bulk=True):
+			pass
+
+		files = set(f for f in self.FILES if not is_dir(f))
+		self.assertEqual(set(signals['file-row-inserted']), files)
+		self.assertEqual(set(signals['file-row-changed']), files)
+		self.assertEqual(signals['file-row-deleted'], [])
+		self.assertEqual(commits.count, 1) # below batch size
+
+		self.assertFalse(indexer.is_empty())
+		self.assertFilesDBConsistent(db)
+		self.assertFilesDBEquals(db, self.FILES)
+
+		# Rows updated or deleted by their parent folder are skipped
+		# later in the same pass, without a query per row
+		self.create_files(self.FILES_UPDATE)
+		db.execute('UPDATE files SET index_status = ?', (STATUS_NEED_UPDATE,))
+		for i in indexer.update_iter(bulk=True):
+			pass
+		self.assertFilesDBEquals(db, self.FILES + self.FILES_UPDATE)
+		self.remove_files(self.FILES_UPDATE)
+		db.execute('UPDATE files SET index_status = ?', (STATUS_NEED_UPDATE,))
+
+		statements = []
+		def execute(sql, *args):
+			statements.append(sql)
+			return db.execute(sql, *args)
+		indexer.db.execute = execute
+
+		signals.clear()
+		for i in indexer.update_iter(bulk=True):
+			pass
+
+		# Files in "foo/" and "argh/" are updated because their folder
+		# was found up to date, so was not updated in this pass
+		files = set(f for f in self.FILES_UPDATE if not is_dir(f))
+		self.assertEqual(signals['file-row-inserted'], [])
+		self.assertEqual(set(signals['file-row-changed']), set(map(os_native_path, (
+			'foo/test.png', 'foo/sub1.txt', 'foo/sub2.txt', 'argh/somefile.pdf'))))
+		self.assertEqual(set(signals['file-row-deleted']), files)
+		self.assertFalse([sql for sql in statements if 'WHERE id = ?' in sql and sql.startswith('SELECT')])
+
+		self.assertFilesDBConsistent(db)
+		self.assertFilesDBEquals(db, self.FILES)
+
+
 class TestFilesIndexerWithCaseInsensitiveFilesytem(tests.TestCase, TestFilesDBTable):
 
 	def runTest(self):
@@ -442,6 +505,54 @@ class TestTagsIndexer(tests.TestCase):
 		self.assertEqual(tagsources, wantedsources)
 
 
+from zim.notebook.index.content import ContentIndexer, ContentView
+
+
+class TestContentIndexer(tests.TestCase):
+
+	PAGES = (
+		(2, 'foo', 'Some **bold** text about foo_bar\n'),
+		(3, 'bar', u'Öffnungszeiten foo\n'),
+	)
+
+	def runTest(self):
+		db = sqlite3.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		PagesIndexer(db, None, tests.MockObject())
+		for i, name, text in self.PAGES:
+			db.execute(
+				'INSERT INTO pages(id, name, sortkey, parent, source_file) VALUES (?, ?, ?, 1, 1)',
+				(i, name, natural_sort_key(name))
+			)
+
+		indexer = ContentIndexer(db, tests.MockObject())
+		view = ContentView(db)
+		self.assertTrue(view.available)
+
+		for i, name, text in self.PAGES:
+			tree = WikiParser().parse(text)
+			row = {'id': i, 'name': name, 'source_file': 1}
+			indexer.on_page_changed(None, row, tree)
+
+		self.assertEqual([p.name for p in view.list_pages()], ['bar', 'foo'])
+
+		def match(query):
+			return [(p.name, n) for p, n in view.match(query)]
+
+		self.assertEqual(match('"bold"'), [('foo', 1)])
+		self.assertEqual(match('"foo"'), [('bar', 1)])
+		self.assertEqual(match('"FOO_BAR"'), [('foo', 1)])
+		self.assertEqual(match(u'"öffnungszeiten"'), [('bar', 1)])
+		self.assertEqual(match('"some bold"'), [('foo', 2)])
+		self.assertEqual(match('"foo*"'), [('bar', 1), ('foo', 1)])
+
+		for i, name, content in self.PAGES:
+			row = {'id': i, 'name': name}
+			indexer.on_page_row_deleted(None, row)
+
+		self.assertEqual(match('"foo*"'), [])
+
+
 from zim.notebook.index import IndexUpdateIter
 
 
@@ -483,3 +594,149 @@ class TestFullIndexer(TestFilesIndexer):
 		# 3. Check and update after files disappear
 		self.remove_files(self.FILES_UPDATE)
 		update_iter.check_and_update()
+
+
+from zim.notebook.index.parsepool import ParserPool, MIN_PAGES_FOR_POOL, \
+	prefetch_parsetrees
+
+
+@tests.skipUnless(ParserPool.is_supported(), 'Parallel parsing not supported')
+class TestParserPool(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder()
+		for i in range(MIN_PAGES_FOR_POOL + 5):
+			folder.file('page%i.txt' % i).write(
+				'test %i\n[[page%i]]\n@tag%i\n' % (i, i + 1, i % 3))
+		folder.file('attachment.png').write('not a page')
+
+		def dump_tables(update_iter):
+			return [
+				sorted(tuple(r) for r in update_iter.db.execute(sql))
+					for sql in (
+						'SELECT name, n_children, is_link_placeholder FROM pages',
+						'SELECT source, target, names FROM links',
+						'SELECT source, tag FROM tagsources',
+						'SELECT docid, content FROM fulltext',
+					)
+			]
+
+		update_iter = buildUpdateIter(folder)
+		stats = []
+		def record_stats(o):
+			pool = update_iter.pages.parser_pool
+			stats.append((pool.hits, pool.misses))
+		update_iter.files.connect('finish-update', record_stats)
+		update_iter.update(bulk=True)
+		self.assertIsNone(update_iter.pages.parser_pool)
+		self.assertEqual(stats, [(MIN_PAGES_FOR_POOL + 5, 0)]) # no fallback parsing
+		wanted = dump_tables(update_iter)
+
+		update_iter = buildUpdateIter(folder)
+		for i in update_iter.files.update_iter(bulk=False):
+			pass
+		self.assertEqual(dump_tables(update_iter), wanted)
+
+		# Check pool directly
+		layout = update_iter.layout
+		update_iter.db.execute('UPDATE files SET index_status = 2')
+		pool = ParserPool(update_iter.db, layout)
+		try:
+			for i in range(MIN_PAGES_FOR_POOL + 5):
+				file = folder.file('page%i.txt' % i)
+				tree = pool.get_parsetree(file)
+				self.assertIsNotNone(tree)
+				wanted = WikiParser().parse(file.read())
+				self.assertEqual(tree.tostring(), wanted.tostring())
+
+			self.assertIsNone(pool.get_parsetree(folder.file('attachment.png')))
+			self.assertEqual((pool.hits, pool.misses), (MIN_PAGES_FOR_POOL + 5, 1))
+		finally:
+			pool.close()
+
+
+from zim.notebook.cache import ParseTreeCache
+
+
+@tests.skipUnless(ParserPool.is_supported(), 'Parallel parsing not supported')
+class TestPrefetchParseTrees(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder()
+		for i in range(MIN_PAGES_FOR_POOL + 5):
+			folder.file('page%i.txt' % i).write(
+				'Content-Type: text/x-zim-wiki\n\ntest %i\n[[page%i]]\n' % (i, i + 1))
+
+		layout = FilesLayout(folder)
+		cache = ParseTreeCache(':memory:')
+		pages = [Path('page%i' % i) for i in range(MIN_PAGES_FOR_POOL + 5)]
+		pages.append(Path('NonExisting'))
+
+		self.assertEqual(prefetch_parsetrees(layout, pages[:2], cache), 0)
+		self.assertEqual(prefetch_parsetrees(layout, pages, cache), len(pages) - 1)
+		for path in pages[:-1]:
+			file, folder = layout.map_page(path)
+			text, etag = file.read_with_etag()
+			tree = cache.get(path.name, etag[1])
+			self.assertIsNotNone(tree)
+			wanted = WikiParser().parse(text)
+			self.assertEqual(tree.tostring(), wanted.tostring())
+			self.assertEqual(tree.meta, wanted.meta)
+
+
+import threading
+
+from zim.notebook.index import ThreadLocalConnection
+
+
+class TestThreadLocalConnection(tests.TestCase):
+
+	def runTest(self):
+		dbpath = os.path.join(self.create_tmp_dir(), 'test.db')
+		db = ThreadLocalConnection(dbpath)
+		db.execute('CREATE TABLE test (value TEXT)')
+		db.execute('INSERT INTO test VALUES ("foo")')
+		db.commit()
+
+		results = []
+		def read():
+			connection = db.connection
+			row = db.execute('SELECT value FROM test').fetchone()
+			results.append((connection, row['value']))
+
+		thread = threading.Thread(target=read)
+		thread.start()
+		thread.join()
+		connection, value = results.pop()
+		self.assertIsNot(connection, db.connection)
+		self.assertEqual(value, 'foo')
+
+		# Thread connections are closed, main connection stays open
+		db.close_thread_connections()
+		self.assertRaises(sqlite3.ProgrammingError, connection.execute, 'SELECT value FROM test')
+		self.assertEqual(db.execute('SELECT value FROM test').fetchone()['value'], 'foo')
+
+		thread = threading.Thread(target=read)
+		thread.start()
+		thread.join()
+		newconnection, value = results.pop()
+		self.assertIsNot(newconnection, connection)
+		self.assertEqual(value, 'foo')
+
+		# New main connection after fork
+		main = db.connection
+		db.reopen_after_fork()
+		self.assertIsNot(db.connection, main)
+		self.assertEqual(db.execute('SELECT value FROM test').fetchone()['value'], 'foo')
+
+		# Memory database is shared
+		db = ThreadLocalConnection(':memory:')
+		db.execute('CREATE TABLE test (value TEXT)')
+		db.execute('INSERT INTO test VALUES ("foo")')
+
+		thread = threading.Thread(target=read)
+		thread.start()
+		thread.join()
+		connection, value = results.pop()
+		self.assertIs(connection, db.connection)
+		self.assertEqual(value, 'foo')
@@ -93,9 +93,9 @@ def _get_sql(files):
 	for path, text in files:
 		folder.file(path).write(text)
 	indexer.check_and_update()
-	lines = list(indexer.db.iterdump())
+	sql = tests.dump_index_db(indexer.db)
 	indexer.db.close()
-	return '\n'.join(lines)
+	return sql
 
 
 #class TestMemoryIndex(tests.TestCase):
@@ -440,3 +440,236 @@ class TestLinksView(tests.TestCase):
 		uclinks = [(l.source, l.target) for l in linksview.list_floating_links('FOO')]
 		self.assertGreater(len(lclinks), 0)
 		self.assertEqual(lclinks, uclinks)
+
+
+class TestLinksSection(tests.TestCase):
+
+	def runTest(self):
+		import zim.notebook.index.links
+		recursive = zim.notebook.index.links._HAS_RECURSIVE_WITH
+		db = new_test_database()
+		linksview = LinksView(db)
+		names = [name for name, links, backlinks in LINKS]
+
+		def dump():
+			result = []
+			for name in names:
+				for direction in (LINK_DIR_FORWARD, LINK_DIR_BACKWARD, LINK_DIR_BOTH):
+					links = sorted((l.source.name, l.target.name)
+						for l in linksview.list_links_section(Path(name), direction))
+					n_links = linksview.n_list_links_section(Path(name), direction)
+					self.assertEqual(n_links, len(links))
+					result.append((name, direction, links))
+			return result
+
+		try:
+			zim.notebook.index.links._HAS_RECURSIVE_WITH = False
+			wanted = dump()
+			zim.notebook.index.links._HAS_RECURSIVE_WITH = True
+			self.assertEqual(dump(), wanted) # Test query against fallback
+		finally:
+			zim.notebook.index.links._HAS_RECURSIVE_WITH = recursive
+
+		self.assertTrue(any(links for name, direction, links in wanted))
+
+
+class TestLinksNeighbourhood(tests.TestCase):
+
+	FILES = (
+		('A.txt', '[[B]]\n'),
+		('B.txt', '[[C]]\n'),
+		('C.txt', '[[D]]\n'),
+		('D.txt', TEXT),
+		('E.txt', '[[B]]\n'),
+	)
+
+	def runTest(self):
+		import zim.notebook.index.links
+		recursive = zim.notebook.index.links._HAS_RECURSIVE_WITH
+		try:
+			for flag in (True, False): # Test fallback as well
+				zim.notebook.index.links._HAS_RECURSIVE_WITH = flag
+				self.checkNeighbourhood()
+		finally:
+			zim.notebook.index.links._HAS_RECURSIVE_WITH = recursive
+
+	def checkNeighbourhood(self):
+		db = new_test_database(self.FILES)
+		linksview = LinksView(db)
+		a, c = Path('A'), Path('C')
+
+		def nodes(*args, **kwargs):
+			return [(p.name, d) for p, d in linksview.list_neighbourhood(*args, **kwargs)]
+
+		def links(*args, **kwargs):
+			return sorted((l.source.name, l.target.name)
+				for l in linksview.list_links_neighbourhood(*args, **kwargs))
+
+		self.assertEqual(nodes(a, 0), [('A', 0)])
+		self.assertEqual(nodes(a, 1), [('A', 0), ('B', 1)])
+		self.assertEqual(nodes(a, 2), [('A', 0), ('B', 1), ('C', 2), ('E', 2)])
+		self.assertEqual(nodes(a, 2, LINK_DIR_FORWARD), [('A', 0), ('B', 1), ('C', 2)])
+		self.assertEqual(nodes(a, 2, LINK_DIR_BACKWARD), [('A', 0)])
+		self.assertEqual(nodes(c, 2, LINK_DIR_BACKWARD), [('C', 0), ('B', 1), ('A', 2), ('E', 2)])
+		self.assertEqual(nodes(a, 2, max_pages=3), [('A', 0), ('B', 1), ('C', 2)])
+		self.assertEqual(nodes(a, 10), [('A', 0), ('B', 1), ('C', 2), ('E', 2), ('D', 3)])
+
+		self.assertEqual(links(a, 0), [])
+		self.assertEqual(links(a, 1), [('A', 'B')])
+		self.assertEqual(links(a, 2), [('A', 'B'), ('B', 'C'), ('E', 'B')])
+		self.assertEqual(links(a, 2, max_pages=3), [('A', 'B'), ('B', 'C')])
+		self.assertEqual(links(c, 1, LINK_DIR_FORWARD), [('C', 'D')])
+		self.assertEqual(links(c, 2, LINK_DIR_BACKWARD), [('A', 'B'), ('B', 'C'), ('E', 'B')])
+
+		self.assertRaises(IndexNotFoundError, linksview.list_neighbourhood, Path('NonExisting'))
+
+
+class TestLinkGraph(tests.TestCase):
+
+	FILES = TestLinksNeighbourhood.FILES + (
+		('F.txt', TEXT),
+	)
+
+	def runTest(self):
+		from zim.signals import SignalEmitter
+		from zim.notebook.index.links import LinkGraph
+
+		class MockIndex(SignalEmitter):
+
+			__signals__ = {'changed': (None, None, ())}
+
+			def __init__(self, db):
+				self._db = db
+
+		db = new_test_database(self.FILES)
+		index = MockIndex(db)
+		graph = LinkGraph.new_from_index(index)
+		a, b, c, d, e, f = map(Path, ('A', 'B', 'C', 'D', 'E', 'F'))
+
+		self.assertEqual(graph.n_pages(), 6)
+		self.assertEqual(graph.n_links(), 4)
+		self.assertEqual(graph.out_degree(a), 1)
+		self.assertEqual(graph.in_degree(a), 0)
+		self.assertEqual(graph.in_degree(b), 2)
+		self.assertRaises(IndexNotFoundError, graph.in_degree, Path('NonExisting'))
+
+		self.assertEqual(
+			[(p.name, n) for p, n in graph.walk(a)],
+			[('A', 0), ('B', 1), ('C', 2), ('D', 3)]
+		)
+		self.assertEqual(
+			[(p.name, n) for p, n in graph.walk(a, LINK_DIR_BOTH, depth=2)],
+			[('A', 0), ('B', 1), ('C', 2), ('E', 2)]
+		)
+		self.assertTrue(graph.is_reachable(a, d))
+		self.assertFalse(graph.is_reachable(d, a))
+		self.assertTrue(graph.is_reachable(d, a, LINK_DIR_BACKWARD))
+		self.assertFalse(graph.is_reachable(a, e))
+		self.assertTrue(graph.is_reachable(a, e, LINK_DIR_BOTH))
+
+		self.assertEqual(
+			[[p.name for p in c] for c in graph.connected_components()],
+			[['A', 'B', 'C', 'D', 'E'], ['F']]
+		)
+
+		db.execute('DELETE FROM links WHERE target = (SELECT id FROM pages WHERE name = "B")')
+		self.assertEqual(graph.n_links(), 4) # snapshot
+		index.emit('changed')
+		self.assertEqual(graph.n_links(), 2)
+		self.assertEqual(len(graph.connected_components()), 4)
+
+		graph.teardown()
+		self.assertEqual(graph.n_links(), 2)
+		db.execute('DELETE FROM links')
+		index.emit('changed')
+		self.assertEqual(graph.n_links(), 2) # not connected
+
+
+import re
+
+class QueryPlanChecker(object):
+	'''Wrapper for the database connection that runs "EXPLAIN QUERY
+	PLAN" for each query executed by the views and records the tables
+	that are scanned in full
+	'''
+
+	_scan_re = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+	def __init__(self, db):
+		self._db = db
+		self._tables = set(r[0] for r in db.execute(
+			'SELECT name FROM sqlite_master WHERE type="table"'))
+		self.scans = []
+
+	def execute(self, sql, params=()):
+		for row in self._db.execute('EXPLAIN QUERY PLAN ' + sql, params):
+			m = self._scan_re.match(row[-1])
+			if m and m.group(1) in self._tables:
+				self.scans.append((m.group(1), sql))
+		return self._db.execute(sql, params)
+
+
+class TestQueryPlans(tests.TestCase):
+
+	def assertNoFullTableScan(self, db, func, *args):
+		checker = QueryPlanChecker(db)
+		view = func.im_class(checker)
+		result = getattr(view, func.__name__)(*args)
+		if hasattr(result, 'next'):
+			list(result)
+		self.assertEqual(checker.scans, [],
+			'Full table scan in %s()' % func.__name__)
+
+	def runTest(self):
+		db = new_test_database()
+		foo = Path('Foo')
+		child = Path('Foo:Child1')
+		tags = TagsView(db)
+		tag1, tag2 = tags.lookup_by_tagname('tag1'), tags.lookup_by_tagname('tag2')
+
+		for args in (
+			(PagesView.lookup_by_pagename, foo),
+			(PagesView.list_pages, None),
+			(PagesView.list_pages, foo),
+			(PagesView.n_list_pages, foo),
+			(PagesView.walk, None),
+			(PagesView.walk_bottomup, foo),
+			(PagesView.get_previous, child),
+			(PagesView.get_next, child),
+			(PagesView.get_next, Path('Foo:Child2')),
+			(PagesView.lookup_from_user_input, 'Child1', foo),
+			(PagesView.lookup_from_user_input, 'child1:grandchild1', foo),
+			(PagesView.resolve_link, child, HRef.new_from_wiki_link('Child2')),
+			(PagesView.resolve_link, child, HRef.new_from_wiki_link('+GrandChild1')),
+			(PagesView.resolve_link, child, HRef.new_from_wiki_link(':Bar')),
+			(PagesView.create_link, child, Path('Foo:Child2')),
+			(LinksView.list_links, foo, LINK_DIR_FORWARD),
+			(LinksView.list_links, foo, LINK_DIR_BACKWARD),
+			(LinksView.list_links, foo, LINK_DIR_BOTH),
+			(LinksView.n_list_links, foo, LINK_DIR_FORWARD),
+			(LinksView.n_list_links, foo, LINK_DIR_BACKWARD),
+			(LinksView.n_list_links, foo, LINK_DIR_BOTH),
+			(LinksView.list_links_section, foo, LINK_DIR_FORWARD),
+			(LinksView.list_links_section, foo, LINK_DIR_BACKWARD),
+			(LinksView.list_links_section, foo, LINK_DIR_BOTH),
+			(LinksView.n_list_links_section, foo, LINK_DIR_FORWARD),
+			(LinksView.n_list_links_section, foo, LINK_DIR_BACKWARD),
+			(LinksView.n_list_links_section, foo, LINK_DIR_BOTH),
+			(LinksView.list_floating_links, 'Foo'),
+			(LinksView.list_neighbourhood, foo, 2, LINK_DIR_FORWARD),
+			(LinksView.list_neighbourhood, foo, 2, LINK_DIR_BACKWARD),
+			(LinksView.list_neighbourhood, foo, 2, LINK_DIR_BOTH),
+			(LinksView.list_links_neighbourhood, foo, 2, LINK_DIR_BOTH, 10),
+			(TagsView.lookup_by_tagname, 'tag1'),
+			(TagsView.list_intersecting_tags, [tag1, tag2]),
+			(TagsView.list_tags, child),
+			(TagsView.n_list_tags, child),
+			(TagsView.list_pages, 'tag2'),
+			(TagsView.n_list_pages, 'tag2'),
+		):
+			self.assertNoFullTableScan(db, *args)
+
+		# These list all records, a full table scan is expected:
+		# PagesView.n_all_pages, PagesView.list_recent_changes,
+		# TagsView.list_all_tags, TagsView.list_all_tags_by_n_pages,
+		# TagsView.n_list_all_tags
@@ -79,6 +79,69 @@ class TestHelp(tests.TestCase):
 		self.assertTrue(output.getvalue().startswith('usage:'))
 
 
+class TestSearchCommand(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(
+			mock=tests.MOCK_ALWAYS_REAL,
+			content={'Foo': 'foo foo foo\n', 'Bar': 'foo\n', 'Baz': 'bar\n'}
+		)
+
+	def runSearch(self, *args):
+		cmd = SearchCommand('search')
+		cmd.parse_options(self.notebook.folder.path, *args)
+		with capture_stdout() as output:
+			cmd.run()
+		return output.getvalue()
+
+	def runTest(self):
+		from zim.config import json
+
+		output = self.runSearch('foo')
+		self.assertEqual(output, 'Bar\nFoo\n') # sorted by name
+
+		output = self.runSearch('foo', '--limit', '1')
+		self.assertEqual(output, 'Foo\n') # best score
+
+		output = self.runSearch('foo', '--json')
+		results = json.loads(output)
+		self.assertEqual([r['name'] for r in results], ['Foo', 'Bar'])
+		self.assertTrue(results[0]['score'] > results[1]['score'])
+
+		self.assertRaises(UsageError, self.runSearch, 'foo', '--limit', '0')
+		self.assertRaises(UsageError, self.runSearch, 'foo', '--limit', 'foo')
+
+
+class TestProfileStartup(tests.TestCase):
+
+	def runTest(self):
+		import zim.profiler
+
+		cmd = build_command(['--version', '--profile-startup'])
+		self.assertTrue(cmd.opts.get('profile-startup'))
+
+		profiler = zim.profiler.start_profiler()
+		self.assertIs(zim.profiler.get_profiler(), profiler)
+		with zim.profiler.profile_section('test'):
+			sys.modules.pop('colorsys', None)
+			import colorsys
+		self.assertIn('test', profiler.sections)
+		self.assertIn('colorsys', profiler.modules)
+
+		real_stderr = sys.stderr
+		sys.stderr = StringIO.StringIO()
+		try:
+			with capture_stdout():
+				ZimApplication()._run_cmd(cmd, ())
+			output = sys.stderr.getvalue()
+		finally:
+			sys.stderr = real_stderr
+
+		self.assertIsNone(zim.profiler.get_profiler())
+		self.assertTrue(output.startswith('Startup profile'))
+		self.assertIn('colorsys', output)
+
+
 class TestNotebookCommand(tests.TestCase):
 
 
@@ -975,3 +975,50 @@ class TestTrash(tests.TestCase):
 		self.assertFalse(helper.trash(dir))
 
 		# How can we cause gio to give an error and test that case ??
+
+
+from zim.newfs.helpers import FolderTreeMonitor
+
+@tests.slowTest
+@tests.skipUnless(gio, 'File monitor not supported, \'gio\' is missing')
+class TestFolderTreeMonitor(tests.TestCase):
+
+	def runTest(self):
+		root = LocalFolder(self.create_tmp_dir())
+		root.folder('foo').touch()
+		monitor = FolderTreeMonitor(root)
+		signals = tests.SignalLogger(monitor)
+		self.assertTrue(monitor.start())
+
+		def wait_for(signal, obj):
+			for i in range(100):
+				if (obj,) in signals[signal]:
+					return
+				tests.gtk_process_events()
+				time.sleep(0.05)
+			self.fail('No "%s" signal for %s' % (signal, obj))
+
+		# file in existing sub folder
+		file = root.file('foo/bar.txt')
+		file.write('test 123\n')
+		wait_for('changed', file)
+
+		# new folder is monitored as well
+		folder = root.folder('new')
+		folder.touch()
+		wait_for('changed', folder)
+		file = folder.file('baz.txt')
+		file.write('test 123\n')
+		wait_for('changed', file)
+
+		file.remove()
+		wait_for('removed', file)
+
+		# hidden files are ignored
+		root.file('.hidden').write('test 123\n')
+		root.file('foo/bar.txt').remove()
+		wait_for('removed', root.file('foo/bar.txt'))
+		self.assertNotIn((root.file('.hidden'),), signals['changed'])
+
+		monitor.stop()
+		self.assertFalse(monitor.running)
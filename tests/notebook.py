@@ -10,6 +10,7 @@ import tests
 
 import os
 import time
+import marshal
 
 from zim.fs import File, Dir
 from zim.newfs.mock import os_native_path
@@ -753,6 +754,85 @@ class TestUpdateLinksOnMovePage(tests.TestCase):
 		self.assertEqual(B.dump('wiki'), '[[C]]\n[[:C]]\n[[D]]\n[[C:A1]]\n'.splitlines(True))
 		self.assertNoDeadLinks(notebook)
 
+	def testManyLinkingPages(self):
+		from zim.notebook.cache import ParseTreeCache
+		from zim.notebook.index.parsepool import MIN_PAGES_FOR_POOL
+		names = ['B%i' % i for i in range(MIN_PAGES_FOR_POOL + 5)]
+		content = dict((name, '[[A]]\n[[A:A1]]\n') for name in names)
+		content.update({'A': '[[B0]]\n', 'A:A1': 'test 123\n'})
+		notebook = self.setUpNotebook(content=content)
+		notebook.parsetree_cache = ParseTreeCache(':memory:')
+
+		signals = []
+		notebook.connect('moved-page', lambda *a: signals.append('moved-page'))
+		notebook.index.connect('changed', lambda o: signals.append('changed'))
+		notebook.connect('stored-page', lambda o, p: signals.append(p.name))
+
+		notebook.move_page(Path('A'), Path('C'))
+		for name in names:
+			page = notebook.get_page(Path(name))
+			self.assertEqual(page.dump('wiki'), ['[[C]]\n', '[[C:A1]]\n', '\n'])
+			self.assertDoesLink(notebook, name, 'C')
+		self.assertNoDeadLinks(notebook)
+
+		# Index is updated once for each batch of pages, before
+		# "stored-page" is emitted for these pages
+		signals = signals[signals.index('moved-page') + 1:]
+		self.assertEqual(signals[:2], ['changed', 'C'])
+		self.assertEqual(signals[2], 'changed')
+		self.assertEqual(sorted(signals[3:]), sorted(names))
+
+	def testManyLinkingPagesStoredInBatches(self):
+		import zim.notebook.notebook
+		names = ['B%i' % i for i in range(25)]
+		content = dict((name, '[[A]]\n') for name in names)
+		content['A'] = 'test 123\n'
+		notebook = self.setUpNotebook(content=content)
+
+		signals = []
+		notebook.connect('moved-page', lambda *a: signals.append('moved-page'))
+		notebook.index.connect('changed', lambda o: signals.append('changed'))
+
+		batchsize = zim.notebook.notebook.STORE_BATCH_SIZE
+		try:
+			zim.notebook.notebook.STORE_BATCH_SIZE = 10
+			notebook.move_page(Path('A'), Path('C'))
+		finally:
+			zim.notebook.notebook.STORE_BATCH_SIZE = batchsize
+
+		signals = signals[signals.index('moved-page') + 1:]
+		self.assertEqual(signals, ['changed'] * 3)
+		for name in names:
+			self.assertDoesLink(notebook, name, 'C')
+		self.assertNoDeadLinks(notebook)
+
+	def testMovePageIterStopped(self):
+		names = ['B%i' % i for i in range(10)]
+		content = dict((name, '[[A]]\n') for name in names)
+		content['A'] = 'test 123\n'
+		notebook = self.setUpNotebook(content=content)
+
+		updated = []
+		iter = notebook.move_page_iter(Path('A'), Path('C'))
+		for p in iter:
+			updated.append(p.name)
+			if len(updated) == 4:
+				break
+		iter.close()
+
+		# Pages that were updated before stopping are stored, the
+		# 4th page is yielded but not yet updated
+		for name in names:
+			page = notebook.get_page(Path(name))
+			self.assertFalse(page.modified)
+			if name in updated[:3]:
+				self.assertEqual(page.dump('wiki'), ['[[C]]\n', '\n'])
+				self.assertDoesLink(notebook, name, 'C')
+			else:
+				self.assertEqual(page.dump('wiki'), ['[[A]]\n', '\n'])
+
+		notebook.flush_page_cache(Path(names[0])) # asserts on unsaved pages
+
 
 class TestPath(tests.TestCase):
 	'''Test path object'''
@@ -879,6 +959,25 @@ class TestPage(TestPath):
 		page.set_parsetree(tree)
 		self.assertFalse(page.hascontent)
 
+	def testCopy(self):
+		notebook = self.setUpNotebook(content={'Foo': 'test 123\n'})
+		page = notebook.get_page(Path('Foo'))
+		tree = page.get_parsetree()
+
+		copy = notebook.get_page_copy(Path('Foo'))
+		self.assertIsNot(copy, page)
+		self.assertEqual(copy.name, page.name)
+		self.assertIs(copy.get_parsetree(), tree)
+		self.assertTrue(copy.readonly)
+		self.assertRaises(PageReadOnlyError, copy.set_parsetree, tree)
+		self.assertIs(notebook.get_page(Path('Foo')), page)
+
+		# Copy is not reset when the page changes on disk
+		page.source_file.write('Changed\n')
+		page = notebook.get_page(Path('Foo'))
+		self.assertEqual(page.dump('wiki'), ['Changed\n'])
+		self.assertIs(copy.get_parsetree(), tree)
+
 	def testShouldAutochangeHeading(self):
 		from zim.newfs.mock import MockFile, MockFolder
 		file = MockFile('/mock/test/page.txt')
@@ -1100,6 +1199,150 @@ class TestPageChangeFile(tests.TestCase):
 		self.assertEqual(page3.dump('wiki'), ['Test 5 6 7 8\n'])
 
 
+from zim.notebook.cache import ParseTreeCache, PageLRUCache
+
+class TestParseTreeCache(tests.TestCase):
+
+	def testCache(self):
+		cache = ParseTreeCache(':memory:')
+		tree = WikiParser().parse(u'Content-Type: text/x-zim-wiki\n\n'
+			u'test 123 [[L\xfcnk]] @t\xe4g\n')
+		self.assertIsNone(cache.get('Foo', 'md5'))
+		cache.set('Foo', 'md5', tree)
+
+		mytree = cache.get('Foo', 'md5')
+		self.assertEqual(mytree.tostring(), tree.tostring())
+		self.assertEqual(mytree.meta, tree.meta)
+		self.assertIsNone(cache.get('Foo', 'other md5'))
+		self.assertIsNone(cache.get('Bar', 'md5'))
+
+		cache.clear()
+		self.assertIsNone(cache.get('Foo', 'md5'))
+
+	def testReadOnly(self):
+		cache = ParseTreeCache(':memory:')
+		tree = WikiParser().parse('test 123\n')
+		cache.set('Foo', 'md5', tree)
+		atime = cache._db.execute('SELECT atime FROM parsetrees').fetchone()
+
+		cache.readonly = True
+		self.assertIsNotNone(cache.get('Foo', 'md5'))
+		cache.set('Bar', 'md5', tree)
+		self.assertIsNone(cache.get('Bar', 'md5'))
+		self.assertEqual(cache._db.execute('SELECT atime FROM parsetrees').fetchall(), [atime])
+
+	def testSizeLimit(self):
+		tree = WikiParser().parse('test 123\n')
+		size = len(marshal.dumps(tree.totokens())) + len('[]')
+		cache = ParseTreeCache(':memory:', max_size=5 * size)
+		for name in ('Page1', 'Page2', 'Page3', 'Page4', 'Page5'):
+			cache.set(name, 'md5', tree)
+		self.assertIsNotNone(cache.get('Page1', 'md5')) # now most recent
+
+		cache.set('Page6', 'md5', tree) # drops 2 least recently used
+		self.assertIsNone(cache.get('Page2', 'md5'))
+		self.assertIsNone(cache.get('Page3', 'md5'))
+		for name in ('Page1', 'Page4', 'Page5', 'Page6'):
+			self.assertIsNotNone(cache.get(name, 'md5'))
+
+	def testPersistent(self):
+		dbpath = self.create_tmp_dir() + '/parsetrees.db'
+		tree = WikiParser().parse('test 123\n')
+		cache = ParseTreeCache(dbpath)
+		cache.set('Foo', 'md5', tree)
+		cache.close()
+
+		cache = ParseTreeCache(dbpath)
+		self.assertIsNotNone(cache.get('Foo', 'md5'))
+		cache.close()
+
+		with open(dbpath, 'w') as fh:
+			fh.write('Not a database')
+		with tests.LoggingFilter('zim.notebook', 'Overwriting'):
+			cache = ParseTreeCache(dbpath)
+		self.assertIsNone(cache.get('Foo', 'md5'))
+		cache.set('Foo', 'md5', tree)
+		self.assertIsNotNone(cache.get('Foo', 'md5'))
+
+	def testPage(self):
+		notebook = self.setUpNotebook(content={'Foo': 'test 123\n'})
+		notebook.parsetree_cache = ParseTreeCache(':memory:')
+		page = notebook.get_page(Path('Foo'))
+		tree = page.get_parsetree()
+		text = page.dump('wiki')
+
+		# New page object does not parse again
+		page = Page(Path('Foo'), False,
+			page.source_file, page.attachments_folder, notebook.parsetree_cache)
+		page.format = None # would fail if used
+		self.assertEqual(page.get_parsetree().tostring(), tree.tostring())
+
+		# Changed content is parsed again
+		page.source_file.write('Changed\n')
+		page = notebook.get_page(Path('Foo'))
+		self.assertEqual(page.dump('wiki'), ['Changed\n'])
+
+
+class TestPageLRUCache(tests.TestCase):
+
+	def testLimits(self):
+		notebook = self.setUpNotebook(content=dict(
+			('Page%i' % i, 'test 123\n') for i in range(5)))
+		cache = PageLRUCache(max_pages=3, max_memory=1000)
+		pages = [notebook.get_page(Path('Page%i' % i)) for i in range(5)]
+		for page in pages:
+			cache.add(page)
+		self.assertEqual(len(cache), 3)
+		self.assertEqual(
+			[p.name for p in pages if p.name in cache],
+			['Page2', 'Page3', 'Page4']
+		)
+
+		cache.add(pages[2]) # move to end
+		for page in pages[3:]:
+			page.get_parsetree()
+		self.assertEqual(cache.memory, 2 * pages[3]._source_size)
+		cache.max_memory = pages[3]._source_size
+		cache.add(pages[4])
+		self.assertEqual(
+			[p.name for p in pages if p.name in cache],
+			['Page2', 'Page4']
+		)
+
+		cache.discard('Page2')
+		self.assertNotIn('Page2', cache)
+		cache.clear()
+		self.assertEqual(len(cache), 0)
+
+	def testNotebook(self):
+		import gc
+		notebook = self.setUpNotebook(content={'Foo': 'test 123\n'})
+		page = notebook.get_page(Path('Foo'))
+		tree = page.get_parsetree()
+		myid = id(page)
+		del page, tree
+		gc.collect()
+
+		# page is kept by the cache, no weak reference left
+		page = notebook.get_page(Path('Foo'))
+		self.assertEqual(id(page), myid)
+		self.assertEqual(notebook.page_cache.misses, 1)
+		self.assertEqual(notebook.page_cache.hits, 1)
+		self.assertIsNotNone(page._parsetree)
+
+		# changes on disk are detected
+		page.source_file.write('Changed\n')
+		page = notebook.get_page(Path('Foo'))
+		self.assertEqual(id(page), myid)
+		self.assertEqual(page.dump('wiki'), ['Changed\n'])
+
+		# flush also removes from cache
+		notebook.flush_page_cache(Path('Foo'))
+		self.assertNotIn('Foo', notebook.page_cache)
+		page = notebook.get_page(Path('Foo'))
+		self.assertNotEqual(id(page), myid)
+
+
 try:
 	import gio
 except ImportError:
@@ -1136,6 +1379,50 @@ class TestIndexBackgroundCheck(tests.TestCase):
 		notebook.index.stop_background_check()
 
 
+class TestIndexFileMonitor(tests.TestCase):
+
+	def runTest(self):
+		# Feed events directly, the monitor itself is tested in
+		# tests/newfs.py and needs a mainloop
+		notebook = self.setUpNotebook(
+			mock=tests.MOCK_ALWAYS_REAL, content={'Foo': 'test 123\n'})
+		index = notebook.index
+		index.check_and_update()
+		folder = notebook.layout.root
+		self.assertTrue(notebook.pages.lookup_by_pagename(Path('Foo')))
+
+		# created and changed: new file, new folder with content
+		file = folder.file('Bar.txt')
+		file.write('test 123\n')
+		subfolder = folder.folder('Foo')
+		subfolder.file('Child.txt').write('test 123\n')
+		for obj in (file, file, subfolder):
+			index._on_file_monitor_event(None, obj)
+		index._flush_monitor_queue()
+		self.assertEqual(
+			[p.name for p in notebook.pages.walk()],
+			['Bar', 'Foo', 'Foo:Child']
+		)
+
+		# up-to-date files are not updated again
+		counter = tests.Counter()
+		index.update_file = counter
+		index._on_file_monitor_event(None, file)
+		index._flush_monitor_queue()
+		self.assertEqual(counter.count, 0)
+		del index.update_file
+
+		# removed: folder with content
+		subfolder.remove_children()
+		subfolder.remove()
+		index._on_file_monitor_event(None, subfolder)
+		index._flush_monitor_queue()
+		self.assertEqual(
+			[p.name for p in notebook.pages.walk()],
+			['Bar', 'Foo']
+		)
+
+
 class TestBackgroundSave(tests.TestCase):
 
 	def runTest(self):
@@ -252,4 +252,20 @@ class TestParser(tests.TestCase):
 			line = get_line_count(text, offset)
 			self.assertEqual(line, wanted)
 
+	def testAnchor(self):
+		# Results with anchor should be the same as without anchor
+		parser = Rule('X', r'^(==+\ \S.*)\n') | Rule('Y', r'(?<=\n)(-{5,})(?=\n)')
+		text = '== foo\nbar == baz\n== dus\n-----\nx -----\n'
+
+		builder = SimpleTreeBuilder()
+		parser(builder, text)
+		wanted = builder.get_root()
+		self.assertEqual([e.tag for e in wanted if not isinstance(e, basestring)], ['X', 'X', 'Y'])
+
+		parser = Rule('X', r'^(==+\ \S.*)\n') | Rule('Y', r'(?<=\n)(-{5,})(?=\n)')
+		parser.anchor = r'^(?: == | - )'
+		builder = SimpleTreeBuilder()
+		parser(builder, text)
+		self.assertEqual(builder.get_root(), wanted)
+
 	## TODO -- Parser test cases ##
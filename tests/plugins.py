@@ -128,6 +128,48 @@ class TestPluginManager(tests.TestCase):
 		manager.general_preferences['plugins'] = list_b
 		self.assertEqual(sorted(manager._plugins), list_b)
 
+	def testLazyLoading(self):
+		from zim.config import VirtualConfigManager
+		config = VirtualConfigManager()
+		preferences = config.get_config_dict('<profile>/preferences.conf')
+		preferences['General'].setdefault('plugins', ['calendar', 'printtobrowser'])
+
+		manager = PluginManager(config)
+		self.assertEqual(sorted(manager._plugins), ['calendar']) # has constructor
+		self.assertEqual(sorted(manager._pending), ['printtobrowser'])
+		self.assertEqual(list(manager), ['calendar', 'printtobrowser'])
+		self.assertEqual(len(manager), 2)
+		self.assertIn('printtobrowser', manager)
+
+		class MainWindow(tests.MockObject):
+			pass
+
+		manager.extend(MainWindow())
+		self.assertEqual(sorted(manager._plugins), ['calendar', 'printtobrowser'])
+		self.assertEqual(manager._pending, {})
+		plugin = manager['printtobrowser']
+		self.assertEqual(len(plugin.extensions), 1)
+
+
+class TestPluginManifest(tests.TestCase):
+
+	def runTest(self):
+		file = File(self.get_tmp_name())
+		manifest = PluginManifest(file)
+
+		entry = manifest.get('printtobrowser')
+		klass = PluginManager.get_plugin_class('printtobrowser')
+		self.assertEqual(entry['info']['name'], klass.plugin_info['name'])
+		self.assertEqual(entry['extends'], ['MainWindow', 'TaskListDialog'])
+		self.assertTrue(entry['lazy'])
+		self.assertFalse(manifest.get('calendar')['lazy']) # has constructor
+		self.assertRaises(ImportError, manifest.get, 'nonexistingplugin')
+
+		self.assertTrue(file.exists())
+		manifest = PluginManifest(file)
+		self.assertEqual(manifest.get('printtobrowser'), entry)
+		self.assertEqual(sorted(manifest._plugins), ['calendar', 'printtobrowser'])
+
 
 class TestPlugins(tests.TestCase):
 	'''Test case to initiate all (loadable) plugins and load some extensions'''
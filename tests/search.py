@@ -196,10 +196,170 @@ class TestSearch(tests.TestCase):
 		results.search(query, callback=self.callback_check)
 		self.assertFalse(results)
 
+		query = Query('Tag: NonExistingTag foo')
+		results.search(query, callback=self.callback_check)
+		self.assertFalse(results) # no fallback to searching all pages
+
 		# TODO test ContentOrName versus Content
 		# TODO test Name
 
 
+class TestQueryPlanner(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = tests.new_notebook()
+		self.notebook.index.check_and_update()
+		self.planner = QueryPlanner.new_from_index(self.notebook.index)
+
+	def testIndexTerms(self):
+		'''Test selecting pages for index terms'''
+		n_all = self.planner.n_all_pages()
+		self.assertEqual(len(self.planner.list_all_pages()), n_all)
+
+		for term in (
+			QueryTerm('name', '*foo*'),
+			QueryTerm('namespace', 'Test'),
+			QueryTerm('tag', 'tags'),
+			QueryTerm('linksfrom', 'Test:*'),
+			QueryTerm('linksto', 'Linking:Foo:Bar'),
+			QueryTerm('tag', 'NonExistingTag'),
+		):
+			pages = self.planner.list_pages(term)
+			self.assertTrue(all(isinstance(p, Path) for p in pages))
+			self.assertEqual(self.planner.estimate(term), len(pages))
+			term.inverse = True
+			self.assertEqual(self.planner.estimate(term), n_all - len(pages))
+
+		pages = self.planner.list_pages(QueryTerm('tag', 'tags'))
+		self.assertIn(Path('Test:tags'), pages)
+
+		# LIKE patterns escape wildcards, so these should not match
+		for name in ('f_o', 'f%', 'Test\\foo'):
+			self.assertFalse(self.planner.list_pages(QueryTerm('name', name)))
+
+	def testNonAsciiNames(self):
+		'''Test planner plus regex gives the same pages as a full scan'''
+		names = (
+			u'Foo', u'Foo:Bar', u'Caf\xe9', u'Caf\xe9:Cr\xe8me',
+			u'\xdcber:Stra\xdfe', u'\xfcber', u'\xdcberall',
+			u'\u0130stanbul', u'\u0130stanbul:\xc7ay', u'Test:\u212aelvin',
+			u'\u212aelvin', u'Kelvin:\u0130',
+		)
+		notebook = self.setUpNotebook(
+			content=dict((name, 'test 123\n') for name in names))
+		notebook.index.check_and_update()
+		planner = QueryPlanner.new_from_index(notebook.index)
+		selection = SearchSelection(notebook)
+		all_pages = list(notebook.pages.walk())
+		self.assertEqual(len(all_pages), planner.n_all_pages())
+
+		for keyword, string in (
+			('name', u'istanbul'), # U+0130 only matched by GLOB
+			('name', u'*STANBUL*'),
+			('name', u'kelvin'), # U+212A only matched by GLOB
+			('name', u'*:kelvin'),
+			('name', u'caf\xe9'),
+			('name', u'*\xfcber*'),
+			('name', u'*stra\xdfe'),
+			('name', u'*:*'),
+			('section', u'istanbul'),
+			('section', u'\xdcber'),
+			('section', u'Caf\xe9'),
+			('section', u'kelvin'),
+			('contentorname', u'stanbul'),
+			('contentorname', u'elvin'),
+			('contentorname', u'\xc7ay'),
+			('contentorname', u'\xe8m'),
+		):
+			term = QueryTerm(keyword, string)
+			if keyword == 'section':
+				regex = selection._namespace_regex(string)
+			elif keyword == 'contentorname':
+				regex = selection._name_regex('*' + string + '*')
+			else:
+				regex = selection._name_regex(string)
+
+			wanted = set(p for p in all_pages if regex.match(p.name))
+			self.assertTrue(wanted, '%s: %r' % (keyword, string))
+			pages = planner.list_pages(term)
+			self.assertTrue(wanted.issubset(pages), '%s: %r' % (keyword, string))
+			self.assertEqual(set(p for p in pages if regex.match(p.name)), wanted)
+			self.assertGreaterEqual(planner.estimate(term), len(wanted))
+
+			if keyword == 'contentorname':
+				selection.search(Query(string)) # default keyword
+				self.assertTrue(wanted.issubset(selection))
+			else:
+				selection.search(Query(u'%s:%s' % (keyword.capitalize(), string)))
+				self.assertEqual(set(selection), wanted)
+
+		# Case-insensitive match for U+0130 and U+212A needs the GLOB
+		for string, name in ((u'istanbul', u'\u0130stanbul'), (u'kelvin', u'\u212aelvin')):
+			self.assertIn(Path(name), planner.list_pages(QueryTerm('name', string)))
+
+
+class TestIterSearch(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = tests.new_notebook()
+		self.notebook.index.check_and_update()
+
+	def runTest(self):
+		'''Test streaming search with limit and offset'''
+		for string in ('foo', 'Name:*foo*', 'foo or bar', 'Tag:tags', 'foo NOT bar'):
+			query = Query(string)
+			selection = SearchSelection(self.notebook)
+			selection.search(query)
+			self.assertTrue(len(selection) > 0)
+
+			results = SearchSelection(self.notebook)
+			paths = list(results.iter_search(query))
+			self.assertEqual(len(paths), len(set(paths)))
+			self.assertEqual(set(paths), selection)
+			self.assertEqual(results, selection)
+			self.assertEqual(results.scores, selection.scores)
+
+			results = SearchSelection(self.notebook)
+			mypaths = list(results.iter_search(query, limit=2, offset=1))
+			self.assertEqual(mypaths, paths[1:3])
+			self.assertEqual(set(results), set(paths[:3]))
+
+		ranked = selection.ranked()
+		self.assertEqual(set(ranked), selection)
+		scores = [selection.scores[p] for p in ranked]
+		self.assertEqual(scores, sorted(scores, reverse=True))
+		self.assertEqual(selection.ranked(limit=1, offset=1), ranked[1:2])
+
+
+class TestSearchThread(tests.TestCase):
+
+	def runTest(self):
+		'''Test search in a background thread'''
+		notebook = tests.new_notebook()
+		notebook.index.check_and_update()
+		selection = SearchSelection(notebook)
+		selection.search(Query('foo'))
+
+		thread = SearchThread(notebook, Query('foo'))
+		thread.start()
+		thread.join()
+		self.assertTrue(thread.done)
+		self.assertFalse(thread.error)
+		self.assertFalse(thread.cancelled)
+		results = thread.pop_results()
+		self.assertEqual(set(p for p, s in results), selection)
+		self.assertEqual(thread.selection, selection)
+		self.assertEqual(thread.selection.scores, selection.scores)
+		self.assertEqual(thread.pop_results(), [])
+
+		thread = SearchThread(notebook, Query('foo'))
+		thread.cancel()
+		thread.start()
+		thread.join()
+		self.assertTrue(thread.cancelled)
+		self.assertEqual(thread.pop_results(), [])
+
+
 @tests.slowTest
 class TestSearchFiles(TestSearch):
 
@@ -212,6 +372,38 @@ class TestSearchFiles(TestSearch):
 		TestSearch.runTest(self)
 
 
+class NoFullTextSearchSelection(SearchSelection):
+
+	def _content_hits(self, string):
+		return None, False
+
+
+class TestFullTextSearch(tests.TestCase):
+
+	def runTest(self):
+		'''Test search using the full text index gives same results'''
+		notebook = tests.new_notebook()
+		for string in (
+			'foo', 'Content: foo', 'foo bar', 'TODO -bar', 'TODO or bar',
+			'foo*', '*foo', 'Content: "foo bar"', 'NOT Content: bar',
+			'Namespace: "TaskList" fix', 'ThisWordDoesNotExistingInTheTestNotebook',
+		):
+			query = Query(string)
+			results = SearchSelection(notebook)
+			results.search(query)
+			wanted = NoFullTextSearchSelection(notebook)
+			wanted.search(query)
+			self.assertEqual(results, wanted, 'results differ for: %s' % string)
+			self.assertEqual(results.scores, wanted.scores, 'scores differ for: %s' % string)
+
+		# Single words are answered from the index without opening pages
+		notebook.get_page = tests.Counter()
+		results = SearchSelection(notebook)
+		results.search(Query('Content: foo'))
+		self.assertTrue(len(results) > 0)
+		self.assertEqual(notebook.get_page.count, 0)
+
+
 class TestUnicode(tests.TestCase):
 
 	def runTest(self):
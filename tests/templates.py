@@ -8,6 +8,7 @@ from __future__ import with_statement
 
 import tests
 
+import os
 
 from zim.fs import File, Dir, FileNotFoundError
 
@@ -18,6 +19,7 @@ from zim.templates.expression import *
 from zim.templates.expressionparser import *
 
 from zim.templates.processor import *
+from zim.templates.compiler import *
 
 from zim.parser import SimpleTreeElement, SimpleTreeBuilder, BuilderTextBuffer
 
@@ -489,9 +491,12 @@ class TestTemplateLoopState(tests.TestCase):
 
 class TestTemplateProcessor(tests.TestCase):
 
+	def new_processor(self, parts):
+		return TemplateProcessor(parts)
+
 	def testGetSet(self):
 		# test 'GET',  'SET'
-		processor = TemplateProcessor([
+		processor = self.new_processor([
 			E('TEMPLATE', None, [
 				E('SET', {
 					'var': ExpressionParameter('aaa.bbb'),
@@ -514,7 +519,7 @@ class TestTemplateProcessor(tests.TestCase):
 
 	def testIfElifElse(self):
 		# test 'IF', 'ELIF', 'ELSE',
-		processor = TemplateProcessor([
+		processor = self.new_processor([
 			E('TEMPLATE', None, [
 				E('IF', {'expr': ExpressionParameter('a')}, ['A']),
 				E('ELIF', {'expr': ExpressionParameter('b')}, ['B']),
@@ -535,7 +540,7 @@ class TestTemplateProcessor(tests.TestCase):
 
 	def testFor(self):
 		# test 'FOR'
-		processor = TemplateProcessor([
+		processor = self.new_processor([
 			E('TEMPLATE', None, [
 				E('FOR', {
 					'var': ExpressionParameter('iter'),
@@ -557,7 +562,7 @@ class TestTemplateProcessor(tests.TestCase):
 
 	def testInclude(self):
 		# test 'INCLUDE',
-		processor = TemplateProcessor([
+		processor = self.new_processor([
 			E('TEMPLATE', None, [
 				E('INCLUDE', {'expr': ExpressionParameter('foo')}),
 				E('INCLUDE', {'expr': ExpressionParameter('foo')}),
@@ -570,6 +575,120 @@ class TestTemplateProcessor(tests.TestCase):
 		processor.process(lines, TemplateContextDict({'foo': 'foo'}))
 		self.assertEqual(''.join(lines), 'FOO\nFOO\nFOO\n')
 
+	def testStreamOutput(self):
+		from cStringIO import StringIO
+
+		processor = self.new_processor([
+			E('TEMPLATE', None, [
+				E('GET', {'expr': ExpressionParameter('foo')}),
+				'\nbar\n',
+			])
+		])
+
+		stream = StringIO()
+		processor.process(StreamOutput(stream), TemplateContextDict({'foo': 'foo'}))
+		self.assertEqual(stream.getvalue(), 'foo\nbar\n')
+
+		stream = StringIO()
+		processor.process(StreamOutput(stream, '\r\n'), TemplateContextDict({'foo': 'foo'}))
+		self.assertEqual(stream.getvalue(), 'foo\r\nbar\r\n')
+
+
+class TestCompiledTemplate(TestTemplateProcessor):
+
+	def new_processor(self, parts):
+		return CompiledTemplate.new_from_parts(parts)
+
+	def testAccessFunction(self):
+		processor = self.new_processor([
+			E('TEMPLATE', None, [
+				E('GET', {'expr': ExpressionParameter('foo.strip')}),
+			])
+		])
+		with self.assertRaises(AssertionError):
+			processor.process([], TemplateContextDict({'foo': 'foo'}))
+
+		processor = self.new_processor([
+			E('TEMPLATE', None, [
+				E('GET', {'expr': ExpressionFunctionCall(
+					ExpressionParameter('foo.upper'), ExpressionList())}),
+				E('GET', {'expr': ExpressionFunctionCall(
+					ExpressionParameter('foo.lstrip'), ExpressionList())}),
+			])
+		])
+		output = []
+		processor.process(output, TemplateContextDict({'foo': 'foo'}))
+		self.assertEqual(output, ['FOO', 'foo'])
+
+		processor = self.new_processor([
+			E('TEMPLATE', None, [
+				E('GET', {'expr': ExpressionFunctionCall(
+					ExpressionParameter('foo.zfill'), ExpressionList([ExpressionLiteral(5)]))}),
+			])
+		])
+		with self.assertRaises(AssertionError):
+			processor.process([], TemplateContextDict({'foo': 'foo'}))
+
+	def testOperators(self):
+		parser = ExpressionParser()
+		processor = self.new_processor([
+			E('TEMPLATE', None, [
+				E('IF', {'expr': parser.parse('a == 1 and not b or c >= [1, 2]')}, ['T']),
+				E('ELSE', {}, ['F']),
+			])
+		])
+		for context, wanted in (
+			({'a': 1, 'b': False, 'c': []}, 'T'),
+			({'a': 1, 'b': True, 'c': []}, 'F'),
+			({'a': 2, 'b': True, 'c': [1, 2]}, 'T'),
+		):
+			output = []
+			processor.process(output, TemplateContextDict(context))
+			self.assertEqual(output, [wanted])
+
+
+class TestGetCompiledTemplate(tests.TestCase):
+
+	def runTest(self):
+		import zim.templates.compiler as compiler
+
+		dir = Dir(self.create_tmp_dir())
+		file = dir.file('test.html')
+		file.write('[% foo %]\n')
+
+		template = get_compiled_template(file)
+		self.assertIs(get_compiled_template(file), template)
+		output = []
+		template.process(output, TemplateContextDict({'foo': 'FOO'}))
+		self.assertEqual(''.join(output), 'FOO\n')
+
+		# Changed file is compiled again
+		file.write('[% foo %] [% foo %]\n')
+		mtime = file.mtime() + 10
+		os.utime(file.encodedpath, (mtime, mtime))
+		newtemplate = get_compiled_template(file)
+		self.assertIsNot(newtemplate, template)
+		output = []
+		newtemplate.process(output, TemplateContextDict({'foo': 'FOO'}))
+		self.assertEqual(''.join(output), 'FOO FOO\n')
+
+		# Without memory cache, template is loaded from disk
+		compiler._cache.clear()
+		orig = compiler.TemplateParser
+		def noparse(*a):
+			raise AssertionError('Template should not be parsed')
+		compiler.TemplateParser = noparse
+		try:
+			template = get_compiled_template(file)
+		finally:
+			compiler.TemplateParser = orig
+		self.assertIsNot(template, newtemplate)
+		output = []
+		template.process(output, TemplateContextDict({'foo': 'FOO'}))
+		self.assertEqual(''.join(output), 'FOO FOO\n')
+
+		self.assertRaises(FileNotFoundError, get_compiled_template, dir.file('nonexisting.html'))
+
 
 
 class TestTemplateList(tests.TestCase):
@@ -13,7 +13,10 @@ import logging
 import wsgiref.validate
 import wsgiref.handlers
 
+from functools import partial
+
 from zim.fs import File
+from zim.config import data_file
 from zim.www import WWWInterface
 from zim.config import VirtualConfigManager
 from zim.notebook import Path
@@ -169,3 +172,231 @@ class TestWWWInterfaceTemplateResources(TestWWWInterface):
 	def runTest(self):
 		'Test WWW interface with a template with resources.'
 		TestWWWInterface.runTest(self)
+
+
+def call_interface(interface, path, command='GET', **headers):
+	# Returns a 3-tuple of status, headers as a dict and body
+	environ = {
+		'REQUEST_METHOD': command,
+		'SCRIPT_NAME': '',
+		'PATH_INFO': path,
+		'QUERY_STRING': '',
+		'SERVER_NAME': 'localhost',
+		'SERVER_PORT': '80',
+		'SERVER_PROTOCOL': '1.0'
+	}
+	for key, value in headers.items():
+		environ['HTTP_' + key.upper()] = value
+	wfile = StringIO()
+	handler = wsgiref.handlers.SimpleHandler(StringIO(''), wfile, sys.stderr, environ)
+	handler.run(wsgiref.validate.validator(interface))
+	header, body = wfile.getvalue().split('\r\n\r\n', 1)
+	header = header.split('\r\n')
+	status = header.pop(0)
+	return status, dict(l.split(': ', 1) for l in header), body
+
+
+class TestRenderedPageCache(tests.TestCase):
+
+	def runTest(self):
+		notebook = tests.new_notebook(fakedir=self.get_tmp_name())
+		interface = WWWInterface(notebook, config=VirtualConfigManager())
+		call = partial(call_interface, interface)
+
+		status, headers, body = call('/Test/foo.html')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertIn('ETag', headers)
+		self.assertNotIn('Last-Modified', headers)
+		self.assertEqual(len(interface.render_cache), 1)
+
+		# Cache hit gives same result
+		interface.render_page = None # would raise if called
+		self.assertEqual(call('/Test/foo.html'), (status, headers, body))
+
+		# Conditional requests
+		etag = headers['ETag']
+		status, myheaders, mybody = call('/Test/foo.html', if_none_match=etag)
+		self.assertEqual(status, 'HTTP/1.0 304 Not Modified')
+		self.assertEqual(myheaders['ETag'], etag)
+		self.assertEqual(mybody, '')
+
+		status, myheaders, mybody = call('/Test/foo.html', if_none_match='"foo", ' + etag)
+		self.assertEqual(status, 'HTTP/1.0 304 Not Modified')
+
+		status, myheaders, mybody = call('/Test/foo.html', if_none_match='"foo"')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+
+		# Date is ignored, page can change when other pages change
+		status, myheaders, mybody = call('/Test/foo.html', if_modified_since='Fri, 01 Jan 2100 00:00:00 GMT')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+
+		# Changing the page source invalidates the entry
+		del interface.render_page # restore
+		page = notebook.get_page(Path('Test:foo'))
+		page.source_file.write('test 123\n')
+		page.source_file._set_mtime(page.source_file.mtime() + 10)
+		status, myheaders, mybody = call('/Test/foo.html', if_none_match=etag)
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertIn('test 123', mybody)
+		self.assertNotEqual(myheaders['ETag'], etag)
+
+		# Index change clears the cache
+		call('/')
+		self.assertEqual(len(interface.render_cache), 2)
+		notebook.index.emit('changed')
+		self.assertEqual(len(interface.render_cache), 0)
+
+
+class TestServeFiles(tests.TestCase):
+
+	def runTest(self):
+		notebook = tests.new_notebook(fakedir=self.get_tmp_name())
+		interface = WWWInterface(notebook, config=VirtualConfigManager())
+		call = partial(call_interface, interface)
+
+		data = ''.join(chr(i % 256) for i in range(1000))
+		file = notebook.folder.file('Test/foo/attachment.bin')
+		file.write_binary(data)
+
+		status, headers, body = call('/+file/Test/foo/attachment.bin')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertEqual(body, data)
+		self.assertEqual(headers['Content-Length'], '1000')
+		self.assertEqual(headers['Accept-Ranges'], 'bytes')
+		self.assertIn('ETag', headers)
+		self.assertIn('Last-Modified', headers)
+		etag = headers['ETag']
+
+		status, headers, body = call('/+file/Test/foo/attachment.bin', 'HEAD')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertEqual(headers['Content-Length'], '1000')
+		self.assertEqual(body, '')
+
+		# Conditional requests
+		status, headers, body = call('/+file/Test/foo/attachment.bin', if_none_match=etag)
+		self.assertEqual(status, 'HTTP/1.0 304 Not Modified')
+		self.assertEqual(body, '')
+
+		# Ranges
+		for myrange, start, end in (
+			('bytes=0-99', 0, 100),
+			('bytes=900-', 900, 1000),
+			('bytes=-10', 990, 1000),
+			('bytes=990-5000', 990, 1000),
+		):
+			status, headers, body = call('/+file/Test/foo/attachment.bin', range=myrange)
+			self.assertEqual(status, 'HTTP/1.0 206 Partial Content')
+			self.assertEqual(headers['Content-Range'], 'bytes %i-%i/1000' % (start, end - 1))
+			self.assertEqual(headers['Content-Length'], str(end - start))
+			self.assertEqual(body, data[start:end])
+
+		for myrange in ('bytes=0-9,20-29', 'bytes=50-10', 'lines=1-2', 'bytes=foo'):
+			status, headers, body = call('/+file/Test/foo/attachment.bin', range=myrange)
+			self.assertEqual(status, 'HTTP/1.0 200 OK')
+			self.assertEqual(body, data)
+
+		with tests.LoggingFilter('zim.www', '416'):
+			status, headers, body = call('/+file/Test/foo/attachment.bin', range='bytes=1000-')
+		self.assertEqual(status, 'HTTP/1.0 416 Requested Range Not Satisfiable')
+		self.assertEqual(headers['Content-Range'], 'bytes */1000')
+
+		status, headers, body = call('/+file/Test/foo/attachment.bin', range='bytes=0-9', if_range=etag)
+		self.assertEqual(status, 'HTTP/1.0 206 Partial Content')
+		status, headers, body = call('/+file/Test/foo/attachment.bin', range='bytes=0-9', if_range='"foo"')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertEqual(body, data)
+
+		# Non existing file
+		with Filter404():
+			status, headers, body = call('/+file/Test/foo/nonexisting.bin')
+		self.assertEqual(status, 'HTTP/1.0 404 Not Found')
+
+		# Local file is read in chunks
+		data = data_file('pixmaps/favicon.ico').raw()
+		status, headers, body = call('/favicon.ico')
+		self.assertEqual(status, 'HTTP/1.0 200 OK')
+		self.assertEqual(body, data)
+		self.assertIn('Cache-Control', headers)
+
+		status, headers, body = call('/favicon.ico', range='bytes=10-19')
+		self.assertEqual(status, 'HTTP/1.0 206 Partial Content')
+		self.assertEqual(body, data[10:20])
+
+
+import threading
+import time
+import urllib2
+
+from wsgiref.simple_server import WSGIRequestHandler
+
+from zim.www import ThreadPoolWSGIServer
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+	def log_message(self, *args):
+		pass
+
+
+class TestThreadPoolWSGIServer(tests.TestCase):
+
+	def runTest(self):
+		release = threading.Event()
+
+		def app(environ, start_response):
+			if environ['PATH_INFO'] == '/slow':
+				release.wait(5)
+			start_response('200 OK', [('Content-Type', 'text/plain')])
+			return [environ['PATH_INFO']]
+
+		httpd = ThreadPoolWSGIServer(('localhost', 0), QuietRequestHandler, workers=2, queue_size=4)
+		httpd.set_app(app)
+		thread = threading.Thread(target=httpd.serve_forever)
+		thread.start()
+		url = 'http://localhost:%i' % httpd.server_port
+
+		try:
+			# A slow request does not block a fast one
+			slow = []
+			slowthread = threading.Thread(
+				target=lambda: slow.append(urllib2.urlopen(url + '/slow').read()))
+			slowthread.start()
+			time.sleep(0.1)
+
+			self.assertEqual(urllib2.urlopen(url + '/fast').read(), '/fast')
+			self.assertFalse(slow)
+
+			release.set()
+			slowthread.join()
+			self.assertEqual(slow, ['/slow'])
+		finally:
+			release.set()
+			httpd.shutdown()
+			thread.join()
+			httpd.server_close()
+
+
+class TestThreadPoolWSGIServerWithNotebook(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content={'Foo': 'test 123\n'})
+		notebook.index.check_and_update()
+		interface = WWWInterface(notebook, config=VirtualConfigManager())
+
+		httpd = ThreadPoolWSGIServer(('localhost', 0), QuietRequestHandler, workers=2)
+		httpd.set_app(interface)
+		thread = threading.Thread(target=httpd.serve_forever)
+		thread.start()
+		url = 'http://localhost:%i' % httpd.server_port
+
+		try:
+			html = urllib2.urlopen(url + '/Foo.html').read()
+			self.assertIn('test 123', html)
+			self.assertTrue(notebook.index._db._connections)
+		finally:
+			httpd.shutdown()
+			thread.join()
+			httpd.server_close()
+
+		# Connections of the worker threads are closed
+		self.assertEqual(notebook.index._db._connections, [])
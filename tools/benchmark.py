@@ -0,0 +1,533 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''Benchmark for the main bulk operations on a synthetic notebook
+
+Generates a notebook with random pages, links and tags and times
+parsing, dumping, indexing, search, export and serving pages with the
+www interface. Results can be written as json and compared with the
+results of a previous run to find performance regressions.
+
+Timings are the wall clock time for a whole run of an operation, e.g.
+parsing all pages. Each operation is repeated and the minimum is the
+most reliable number to compare. Caches (like the parse tree cache)
+are used as they would be in normal use, so only the first repeat of
+an operation may see a cold cache.
+
+Run from the source folder, e.g.:
+
+	python tools/benchmark.py --pages 500 --output results.json
+	python tools/benchmark.py --pages 500 --compare results.json
+'''
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+import getopt
+import json
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+import time
+import timeit
+
+
+usage = '''\
+usage: %s [OPTIONS] [BENCHMARKS]
+
+Runs all benchmarks, or the ones given as arguments.
+Benchmarks: %s
+
+Options:
+  -h, --help          print this text
+  --pages=N           number of pages in the notebook (default %i)
+  --depth=N           max depth of the namespace tree (default %i)
+  --links=N           average number of links per page (default %i)
+  --tags=N            average number of tags per page (default %i)
+  --seed=N            seed for the random generator (default %i)
+  --repeat=N          number of times to repeat each benchmark (default %i)
+  --dir=DIR           folder for the notebook and output, is kept after
+                      the run, by default a temporary folder is used
+  --output=FILE       write results as json to FILE
+  --compare=FILE      compare results with a previous json output
+  --threshold=PERCENT slow down that is reported as regression (default %i)
+'''
+
+DEFAULTS = {
+	'pages': 200,
+	'depth': 3,
+	'links': 5,
+	'tags': 2,
+	'seed': 1,
+	'repeat': 3,
+	'threshold': 10,
+}
+
+RESULTS_VERSION = 1
+
+WORDS = '''\
+lorem ipsum dolor sit amet consectetur adipiscing elit mauris sodales
+facilisis est ut posuere congue in nam aliquet dui fermentum donec
+lobortis eros id pulvinar ultricies phasellus ligula leo tristique
+porta vel sed magna nunc volutpat malesuada nulla dictum erat nisl
+porttitor suspendisse risus nisi lacinia eu mattis eget pretium odio
+cras faucibus dapibus'''.split()
+
+SEARCH_QUERIES = (
+	'lorem',
+	'dolor AND magna',
+	'"sit amet"',
+	'@tag1',
+	'Name:Page1*',
+	'Links:Page2',
+	'porta OR odio',
+)
+
+
+## Generate notebook
+
+class NotebookGenerator(object):
+	'''Writes a notebook with random content
+
+	Pages are spread over a namespace tree with the given max depth.
+	Content is a mix of headings, paragraphs with inline formatting,
+	lists, checkboxes, links to random other pages and tags.
+	'''
+
+	def __init__(self, pages, depth, links, tags, seed):
+		self.n_pages = pages
+		self.depth = depth
+		self.links = links
+		self.tags = tags
+		self.random = random.Random(seed)
+		self.names = self._generate_names()
+
+	def _generate_names(self):
+		names = []
+		parents = [None]
+		for i in range(self.n_pages):
+			parent = self.random.choice(parents)
+			name = 'Page%i' % i
+			if parent is not None:
+				name = parent + ':' + name
+			names.append(name)
+			if name.count(':') + 1 < self.depth:
+				parents.append(name)
+		return names
+
+	def _words(self, n):
+		return ' '.join(self.random.choice(WORDS) for i in range(n))
+
+	def _paragraph(self, links, tags):
+		words = self._words(self.random.randint(20, 60)).split()
+		for i in range(links):
+			words.insert(self.random.randint(0, len(words)),
+				'[[:%s]]' % self.random.choice(self.names))
+		for i in range(tags):
+			words.insert(self.random.randint(0, len(words)),
+				'@tag%i' % self.random.randint(0, 20))
+		for i, style in enumerate(('**%s**', '//%s//', "''%s''", '__%s__')):
+			j = self.random.randint(0, len(words) - 1)
+			if not words[j].startswith(('[[', '@')):
+				words[j] = style % words[j]
+		return ' '.join(words) + '\n'
+
+	def page_content(self, name):
+		'''Returns the source text for a page'''
+		n_links = self.random.randint(0, 2 * self.links)
+		n_tags = self.random.randint(0, 2 * self.tags)
+		n_paras = self.random.randint(2, 6)
+		links = [0] * n_paras
+		tags = [0] * n_paras
+		for i in range(n_links):
+			links[self.random.randint(0, n_paras - 1)] += 1
+		for i in range(n_tags):
+			tags[self.random.randint(0, n_paras - 1)] += 1
+
+		text = [
+			'Content-Type: text/x-zim-wiki\n',
+			'Wiki-Format: zim 0.4\n',
+			'Creation-Date: 2017-01-01T12:00:00+01:00\n',
+			'\n',
+			'====== %s ======\n' % name.split(':')[-1],
+			'Created Sunday 01 January 2017\n',
+			'\n',
+		]
+		for i in range(n_paras):
+			if i > 0 and self.random.random() < 0.3:
+				text.append('\n===== %s =====\n' % self._words(3).title())
+			text.append(self._paragraph(links[i], tags[i]))
+			text.append('\n')
+			if self.random.random() < 0.3:
+				for j in range(self.random.randint(2, 5)):
+					text.append('* %s\n' % self._words(5))
+				text.append('\n')
+			if self.random.random() < 0.2:
+				for j in range(self.random.randint(2, 5)):
+					box = self.random.choice(' *x')
+					text.append('[%s] %s\n' % (box, self._words(5)))
+				text.append('\n')
+		return ''.join(text)
+
+	def write(self, dir):
+		'''Write the notebook
+		@param dir: the notebook folder, should not exist yet
+		'''
+		os.makedirs(dir)
+		with open(os.path.join(dir, 'notebook.zim'), 'w') as fh:
+			fh.write('[Notebook]\nname=Benchmark\n')
+
+		for name in self.names:
+			path = os.path.join(dir, *name.split(':')) + '.txt'
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			with open(path, 'w') as fh:
+				fh.write(self.page_content(name))
+
+
+## Benchmarks
+# Each function gets the benchmark context and returns a 2-tuple of
+# a function to time and the number of items it processes. Setup is
+# done outside the timed function.
+
+def bench_parse(ctx):
+	from zim.formats import get_format
+	parser = get_format('wiki').Parser()
+	texts = [ctx.read_source(name) for name in ctx.names]
+
+	def run():
+		for text in texts:
+			parser.parse(text)
+
+	return run, len(texts)
+
+
+def bench_dump_wiki(ctx):
+	from zim.formats import get_format
+	trees = ctx.parse_all()
+	dumper = get_format('wiki').Dumper()
+
+	def run():
+		for tree in trees:
+			dumper.dump(tree)
+
+	return run, len(trees)
+
+
+def bench_dump_html(ctx):
+	from zim.formats import get_format, StubLinker
+	trees = ctx.parse_all()
+	dumper = get_format('html').Dumper(linker=StubLinker())
+
+	def run():
+		for tree in trees:
+			dumper.dump(tree)
+
+	return run, len(trees)
+
+
+def bench_index_full(ctx):
+	index = ctx.notebook.index
+
+	def run():
+		index.flush()
+		index.check_and_update()
+
+	return run, len(ctx.names)
+
+
+def bench_index_incremental(ctx):
+	index = ctx.notebook.index
+	index.check_and_update()
+	n = max(1, len(ctx.names) // 100)
+
+	def run():
+		# Touch 1% of the pages, they change content
+		for name in ctx.random.sample(ctx.names, n):
+			ctx.append_source(name, 'Edited %s\n' % time.time())
+		index.check_and_update()
+
+	return run, n
+
+
+def bench_search(ctx):
+	from zim.search import SearchSelection, Query
+	ctx.notebook.index.check_and_update()
+	queries = [Query(q) for q in SEARCH_QUERIES]
+
+	def run():
+		for query in queries:
+			selection = SearchSelection(ctx.notebook)
+			selection.search(query)
+
+	return run, len(queries)
+
+
+def bench_export(ctx):
+	from zim.fs import Dir
+	from zim.export import build_notebook_exporter
+	from zim.export.selections import AllPages
+	ctx.notebook.index.check_and_update()
+	root = os.path.join(ctx.dir, 'export')
+
+	def run():
+		if os.path.exists(root):
+			shutil.rmtree(root)
+		exporter = build_notebook_exporter(Dir(root), 'html', 'Default')
+		exporter.export(AllPages(ctx.notebook))
+
+	return run, len(ctx.names)
+
+
+def bench_www(ctx):
+	from zim.www import WWWInterface
+	from zim.config import VirtualConfigManager
+	ctx.notebook.index.check_and_update()
+	interface = WWWInterface(ctx.notebook, config=VirtualConfigManager())
+	paths = ['/'] + ['/' + name.replace(':', '/') + '.html' for name in ctx.names]
+
+	def start_response(status, headers):
+		assert status.startswith('200'), status
+
+	def run():
+		for path in paths:
+			environ = {
+				'REQUEST_METHOD': 'GET',
+				'SCRIPT_NAME': '',
+				'PATH_INFO': path,
+				'QUERY_STRING': '',
+				'SERVER_NAME': 'localhost',
+				'SERVER_PORT': '80',
+				'SERVER_PROTOCOL': 'HTTP/1.0',
+			}
+			for chunk in interface(environ, start_response):
+				pass
+
+	return run, len(paths)
+
+
+BENCHMARKS = (
+	('parse', bench_parse),
+	('dump_wiki', bench_dump_wiki),
+	('dump_html', bench_dump_html),
+	('index_full', bench_index_full),
+	('index_incremental', bench_index_incremental),
+	('search', bench_search),
+	('export', bench_export),
+	('www', bench_www),
+)
+
+
+class BenchmarkContext(object):
+	'''Shared state for the benchmark functions'''
+
+	def __init__(self, dir, names, seed):
+		self.dir = dir
+		self.notebook_dir = os.path.join(dir, 'notebook')
+		self.names = names
+		self.random = random.Random(seed)
+		self._notebook = None
+		self._trees = None
+
+	@property
+	def notebook(self):
+		if self._notebook is None:
+			from zim.fs import Dir
+			from zim.notebook import Notebook
+			self._notebook = Notebook.new_from_dir(Dir(self.notebook_dir))
+		return self._notebook
+
+	def source_path(self, name):
+		return os.path.join(self.notebook_dir, *name.split(':')) + '.txt'
+
+	def read_source(self, name):
+		with open(self.source_path(name)) as fh:
+			return fh.read().decode('utf-8')
+
+	def append_source(self, name, text):
+		path = self.source_path(name)
+		with open(path, 'a') as fh:
+			fh.write(text)
+		mtime = os.stat(path).st_mtime + 1 # make sure change is noticed
+		os.utime(path, (mtime, mtime))
+
+	def parse_all(self):
+		if self._trees is None:
+			from zim.formats import get_format
+			parser = get_format('wiki').Parser()
+			self._trees = [parser.parse(self.read_source(name)) for name in self.names]
+		return self._trees
+
+
+def run_benchmarks(ctx, names, repeat):
+	'''Run benchmarks
+	@param ctx: a L{BenchmarkContext}
+	@param names: names of the benchmarks to run
+	@param repeat: number of repeats per benchmark
+	@returns: a dict with results per benchmark
+	'''
+	results = {}
+	for name, func in BENCHMARKS:
+		if name not in names:
+			continue
+
+		sys.stderr.write('%-20s' % name)
+		run, items = func(ctx)
+		timings = []
+		for i in range(repeat):
+			start = timeit.default_timer()
+			run()
+			timings.append(timeit.default_timer() - start)
+
+		results[name] = {
+			'items': items,
+			'repeat': repeat,
+			'min': min(timings),
+			'max': max(timings),
+			'mean': sum(timings) / len(timings),
+		}
+		sys.stderr.write('%8.3f s  (%.2f ms/item)\n' % (min(timings), 1000 * min(timings) / items))
+
+	return results
+
+
+def compare_results(results, params, previous, threshold):
+	'''Print a comparison with previous results
+	@returns: list of names of benchmarks that are slower than the
+	threshold
+	'''
+	regressions = []
+	print '%-20s%10s%10s%9s' % ('Benchmark', 'Previous', 'Current', 'Change')
+	for name, result in sorted(results.items()):
+		if name not in previous['results']:
+			continue
+		before = previous['results'][name]['min']
+		now = result['min']
+		change = 100.0 * (now - before) / before if before else 0.0
+		flag = ''
+		if change > threshold:
+			regressions.append(name)
+			flag = '  REGRESSION'
+		print '%-20s%10.3f%10.3f%+8.1f%%%s' % (name, before, now, change, flag)
+
+	if previous['params'] != params:
+		print '\nWARNING: parameters differ from previous run: %r' % previous['params']
+
+	return regressions
+
+
+def git_commit():
+	try:
+		pipe = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		out, err = pipe.communicate()
+		return out.strip() or None
+	except OSError:
+		return None
+
+
+def main(argv):
+	params = dict(DEFAULTS)
+	workdir = None
+	output = None
+	compare = None
+	try:
+		opts, args = getopt.gnu_getopt(argv[1:], 'h', [
+			'help', 'pages=', 'depth=', 'links=', 'tags=', 'seed=',
+			'repeat=', 'dir=', 'output=', 'compare=', 'threshold='
+		])
+		for o, a in opts:
+			if o in ('-h', '--help'):
+				print usage % (argv[0], ', '.join(n for n, f in BENCHMARKS),
+					DEFAULTS['pages'], DEFAULTS['depth'], DEFAULTS['links'],
+					DEFAULTS['tags'], DEFAULTS['seed'], DEFAULTS['repeat'],
+					DEFAULTS['threshold'])
+				return 0
+			elif o == '--dir':
+				workdir = os.path.abspath(a)
+			elif o == '--output':
+				output = a
+			elif o == '--compare':
+				compare = a
+			else:
+				params[o[2:]] = int(a)
+	except (getopt.GetoptError, ValueError) as error:
+		print >>sys.stderr, error
+		return 1
+
+	names = args or [n for n, f in BENCHMARKS]
+	for name in names:
+		if name not in [n for n, f in BENCHMARKS]:
+			print >>sys.stderr, 'No such benchmark: %s' % name
+			return 1
+
+	if compare:
+		with open(compare) as fh:
+			previous = json.load(fh)
+		if previous.get('version') != RESULTS_VERSION:
+			print >>sys.stderr, 'Can not compare with results from a different version'
+			return 1
+	else:
+		previous = None
+
+	if workdir:
+		if os.path.exists(workdir):
+			print >>sys.stderr, 'Folder already exists: %s' % workdir
+			return 1
+		os.makedirs(workdir)
+	else:
+		tmpdir = tempfile.mkdtemp(prefix='zim-benchmark-')
+	dir = workdir or tmpdir
+
+	# Keep index and caches out of the user folders, set before
+	# importing zim
+	os.environ['XDG_CACHE_HOME'] = os.path.join(dir, 'cache')
+
+	# Zim finds the data files relative to the executable when running
+	# from the source folder
+	sys.argv[0] = os.path.abspath('zim.py')
+	import zim
+	try:
+		generator = NotebookGenerator(
+			params['pages'], params['depth'], params['links'],
+			params['tags'], params['seed'])
+		ctx = BenchmarkContext(dir, generator.names, params['seed'])
+		sys.stderr.write('Writing notebook with %i pages to %s\n' % (params['pages'], ctx.notebook_dir))
+		generator.write(ctx.notebook_dir)
+
+		results = run_benchmarks(ctx, names, params['repeat'])
+	finally:
+		if not workdir:
+			shutil.rmtree(tmpdir)
+
+	notebook_params = dict((k, params[k]) for k in ('pages', 'depth', 'links', 'tags', 'seed'))
+	data = {
+		'version': RESULTS_VERSION,
+		'zim_version': zim.__version__,
+		'commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'params': notebook_params,
+		'results': results,
+	}
+	if output:
+		with open(output, 'w') as fh:
+			json.dump(data, fh, indent=1, sort_keys=True)
+
+	if previous:
+		regressions = compare_results(results, notebook_params, previous, params['threshold'])
+		if regressions:
+			return 2
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
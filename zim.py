@@ -39,6 +39,13 @@ logging.captureWarnings(True)
 
 # Try importing our modules
 try:
+	if '--profile-startup' in sys.argv:
+		# Start profiling first, so the imports below are measured
+		import time
+		start_time = time.time()
+		import zim.profiler
+		zim.profiler.start_profiler(start_time)
+
 	import zim
 	import zim.main
 except ImportError:
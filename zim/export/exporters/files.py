@@ -4,28 +4,52 @@
 
 from functools import partial
 
+import os
+import re
+import hashlib
 import logging
 
 logger = logging.getLogger('zim.export')
 
+try:
+	import multiprocessing
+except ImportError: #pragma: no cover
+	multiprocessing = None
+
 from zim.utils import MovingWindowIter
 
 from zim.config import data_file
-from zim.notebook import Path
+from zim.notebook import Path, LINK_DIR_BACKWARD
 from zim.formats import get_format
 
 from zim.export.exporters import Exporter, createIndexPage
 from zim.export.linker import ExportLinker
+from zim.export.manifest import ExportManifest
 from zim.export.template import ExportTemplateContext
+from zim.templates import StreamOutput
 
-from zim.fs import Dir
+from zim.fs import File, Dir, PathLookupError
 from zim.newfs import FileNotFoundError, LocalFolder
 
 
+# Templates that call the index function include the page index in
+# each page, so each page changes when any page is added or removed
+_index_function_re = re.compile(r'\bindex\s*\(')
+
+
+def _is_copy_uptodate(source, target):
+	# Copies preserve the mtime, but possibly with less precision
+	return target.exists() \
+		and target.size() == source.size() \
+		and int(target.mtime()) == int(source.mtime())
+
+
 
 class FilesExporterBase(Exporter):
 	'''Base class for exporters that export to files'''
 
+	_manifest = None # L{ExportManifest} during an incremental export
+
 	def __init__(self, layout, template, format, document_root_url=None):
 		'''Constructor
 		@param layout: a L{ExportLayout} to map pages to files
@@ -45,16 +69,32 @@ class FilesExporterBase(Exporter):
 		target = self.layout.attachments_dir(page)
 		assert isinstance(target, Dir)
 		target = LocalFolder(target.path) # XXX convert
+		if self._manifest:
+			self._remove_stale_attachments(page, source, target)
+
 		try:
 			for file in source.list_files():
 					yield file
 					targetfile = target.file(file.basename)
 					if targetfile.exists():
+						if self._manifest and _is_copy_uptodate(file, targetfile):
+							continue
 						targetfile.remove() # Export does overwrite by default
 					file.copyto(targetfile)
 		except FileNotFoundError:
 			pass
 
+	def _remove_stale_attachments(self, page, source, target):
+		state = self._manifest.get_previous(page.name)
+		if not state:
+			return
+
+		for name, mtime, size in state['attachments']:
+			if not source.file(name).exists():
+				file = target.file(name)
+				if file.exists():
+					file.remove()
+
 	def export_resources(self):
 		dir = self.layout.resources_dir()
 
@@ -68,23 +108,78 @@ class FilesExporterBase(Exporter):
 		if self.template.resources_dir \
 		and self.template.resources_dir.exists():
 			if dir.exists(): # Export does overwrite by default
+				if self._manifest and self._resources_uptodate(dir):
+					return
 				dir.remove_children()
 				dir.remove()
 			self.template.resources_dir.copyto(dir)
 
+	def _resources_uptodate(self, dir):
+		source = self.template.resources_dir
+		sourcefiles = [f for f in source.walk() if isinstance(f, File)]
+		targetfiles = [f for f in dir.walk() if isinstance(f, File)]
+		if len(sourcefiles) != len(targetfiles):
+			return False
+
+		for file in sourcefiles:
+			target = dir.file(file.relpath(source))
+			if not _is_copy_uptodate(file, target):
+				return False
+		return True
+
+
+# Number of pages handed to a worker process at once
+EXPORT_CHUNKSIZE = 4
+
+_worker_state = None # (exporter, pages) - inherited by forked workers
+
+
+def _init_export_worker():
+	# Runs in the worker process - the index connection can not be
+	# shared with the parent process. Only the main process writes to
+	# the parse tree cache.
+	exporter, pages = _worker_state
+	notebook = pages.notebook
+	notebook.index.reopen_after_fork()
+	if notebook.parsetree_cache is not None:
+		notebook.parsetree_cache.readonly = True
+
+
+def _export_page_worker(args):
+	# Runs in the worker process, returns True on success
+	exporter, pages = _worker_state
+	notebook = pages.notebook
+	name, prevname, nextname = args
+	try:
+		page = notebook.get_page(Path(name))
+		prevpage = notebook.get_page(Path(prevname)) if prevname else None
+		nextpage = notebook.get_page(Path(nextname)) if nextname else None
+		exporter.export_page(notebook, page, pages, prevpage=prevpage, nextpage=nextpage)
+	except:
+		logger.exception('Error while exporting: %s', name)
+		return False
+	else:
+		return True
+
 
 class MultiFileExporter(FilesExporterBase):
 	'''Exporter that exports each page to a single file'''
 
-	def __init__(self, layout, template, format, index_page=None, document_root_url=None):
+	def __init__(self, layout, template, format, index_page=None, document_root_url=None, jobs=None, incremental=False):
 		'''Constructor
 		@param layout: a L{ExportLayout} to map pages to files
 		@param template: a L{Template} object
 		@param format: the format for the file content
 		@param index_page: a page to output the index or C{None}
 		@param document_root_url: optional URL for the document root
+		@param jobs: number of worker processes to render pages in
+		parallel, C{None} or C{1} to export in this process
+		@param incremental: if C{True} only pages that changed since
+		the previous export are exported again, see L{ExportManifest}
 		'''
 		FilesExporterBase.__init__(self, layout, template, format, document_root_url)
+		self.jobs = jobs
+		self.incremental = incremental
 		if index_page:
 			if isinstance(index_page, basestring):
 				self.index_page = Path(Path.makeValidPageName(index_page))
@@ -94,11 +189,109 @@ class MultiFileExporter(FilesExporterBase):
 			self.index_page = None
 		# TODO make index_page generic special page in output selection
 
+	@staticmethod
+	def parallel_export_supported():
+		'''Returns C{True} when pages can be exported in parallel.
+		Worker processes are forked, so they inherit the notebook and
+		plugin state.
+		'''
+		return multiprocessing is not None and hasattr(os, 'fork')
+
 	def export_iter(self, pages):
+		if self.incremental:
+			self._manifest = ExportManifest(self.layout.manifest_file())
+			if not self._manifest.check_settings(self._get_settings(pages)):
+				logger.info('Export settings changed, exporting all pages')
+
+		try:
+			if self.jobs and self.jobs > 1 and self.parallel_export_supported():
+				iter = self._export_iter_parallel(pages)
+			else:
+				iter = self._export_iter(pages)
+
+			for p in iter:
+				yield p
+
+			if self._manifest:
+				for name in self._manifest.list_removed():
+					self._remove_page(Path(name))
+				self._manifest.write()
+		finally:
+			self._manifest = None
+
+	def _get_settings(self, pages):
+		# Everything that affects the output of all pages
+		text = File(self.template.filename).read()
+		settings = {
+			'format': self.format.info['name'],
+			'template': hashlib.md5(text.encode('utf-8')).hexdigest(),
+			'document_root': pages.notebook.document_root.path
+				if pages.notebook.document_root else None,
+			'document_root_url': self.document_root_url,
+			'home': pages.notebook.get_home_page().name,
+			'index_page': self.index_page.name if self.index_page else None,
+		}
+		if _index_function_re.search(text):
+			names = u'\n'.join(p.name for p in pages)
+			settings['pages'] = hashlib.md5(names.encode('utf-8')).hexdigest()
+		return settings
+
+	def _get_page_state(self, notebook, page, prevpage, nextpage):
+		# Everything that affects the output of a single page
+		source = page.source_file
+		links = set(
+			link.target.name for link in notebook.links.list_links(page))
+		backlinks = set(
+			link.source.name for link in
+				notebook.links.list_links(page, LINK_DIR_BACKWARD))
+		try:
+			attachments = sorted(
+				(f.basename, f.mtime(), f.size())
+					for f in notebook.get_attachments_dir(page).list_files()
+			)
+		except FileNotFoundError:
+			attachments = []
+
+		return {
+			'source': (source.mtime(), source.size()) if source.exists() else None,
+			'prev': prevpage.name if prevpage else None,
+			'next': nextpage.name if nextpage else None,
+			'links': sorted(links),
+			'backlinks': sorted(backlinks),
+			'attachments': attachments,
+		}
+
+	def _remove_page(self, path):
+		# Remove output for a page that is no longer part of the export
+		try:
+			file = self.layout.page_file(path)
+			dir = self.layout.attachments_dir(path)
+		except PathLookupError:
+			return
+
+		logger.info('Remove: %s', path)
+		if file.exists():
+			file.remove()
+
+		state = self._manifest.get_previous(path.name)
+		if state:
+			for name, mtime, size in state['attachments']:
+				attachment = dir.file(name)
+				if attachment.exists():
+					attachment.remove()
+			dir.cleanup()
+
+	def _export_iter(self, pages):
 		self.export_resources()
 
 		for prev, page, next in MovingWindowIter(pages):
 			yield page
+			if self._manifest:
+				state = self._get_page_state(pages.notebook, page, prev, next)
+				if self._manifest.is_uptodate(page.name, state):
+					self._manifest.update(page.name, state)
+					continue
+
 			try:
 				self.export_page(pages.notebook, page, pages, prevpage=prev, nextpage=next)
 					# XXX FIXME remove need for notebook here
@@ -109,6 +302,76 @@ class MultiFileExporter(FilesExporterBase):
 				raise
 				logger.exception('Error while exporting: %s', page.name)
 
+			if self._manifest:
+				self._manifest.update(page.name, state)
+
+		if self.index_page:
+			try:
+				logger.info('Export index: %s', self.index_page)
+				yield self.index_page
+				self.export_index(self.index_page, pages)
+			except:
+				logger.exception('Error while exporting index')
+
+	def _export_iter_parallel(self, pages):
+		# Pages are rendered by worker processes, everything else is
+		# done here in the same order as for _export_iter(). The
+		# pages and their navigation links are fixed up front, so the
+		# result does not depend on the order in which workers finish.
+		global _worker_state
+
+		self.export_resources()
+
+		window = []
+		work = []
+		for prev, page, next in MovingWindowIter(pages):
+			state = None
+			if self._manifest:
+				state = self._get_page_state(pages.notebook, page, prev, next)
+				if self._manifest.is_uptodate(page.name, state):
+					window.append((page, state, False))
+					continue
+
+			window.append((page, state, True))
+			work.append(
+				(page.name, prev.name if prev else None, next.name if next else None))
+
+		if work:
+			logger.debug('Exporting %i pages with %i processes', len(work), self.jobs)
+			_worker_state = (self, pages)
+			pool = multiprocessing.Pool(self.jobs, _init_export_worker)
+			results = pool.imap(_export_page_worker, work, EXPORT_CHUNKSIZE)
+		else:
+			pool = None
+
+		try:
+			for page, state, export in window:
+				yield page
+				if not export:
+					self._manifest.update(page.name, state)
+					continue
+				elif not results.next():
+					# error was logged by the worker, try again next time
+					if self._manifest:
+						self._manifest.update(page.name, None)
+					continue
+
+				try:
+					for file in self.export_attachments_iter(pages.notebook, page):
+						yield file
+				except:
+					logger.exception('Error while exporting: %s', page.name)
+				else:
+					if self._manifest:
+						self._manifest.update(page.name, state)
+			if pool:
+				pool.close()
+		finally:
+			if pool:
+				pool.terminate()
+				pool.join()
+			_worker_state = None
+
 		if self.index_page:
 			try:
 				logger.info('Export index: %s', self.index_page)
@@ -121,8 +384,7 @@ class MultiFileExporter(FilesExporterBase):
 		# XXX FIXME remove need for notebook here
 
 		file = self.layout.page_file(page)
-		if file.exists():
-			file.remove() # export does overwrite by default
+			# export does overwrite by default, file is replaced on write
 
 		linker_factory = partial(ExportLinker,
 			notebook=notebook,
@@ -187,13 +449,21 @@ class SingleFileExporter(FilesExporterBase):
 			index_page=None,
 		)
 
-		lines = []
-		self.template.process(lines, context)
-		if self.layout.file.exists():
-			self.layout.file.remove() # export does overwrite by default
-		self.layout.file.writelines(lines)
+		# Write while processing the template, the output for all pages
+		# together can be much larger than we want to keep in memory.
+		# Export does overwrite by default, the file is replaced when
+		# the stream is closed. On error the partial output is discarded
+		# and any previous export is left in place.
+		file = self.layout.file
+		stream = file.open('w')
+		try:
+			self.template.process(StreamOutput(stream, file.get_endofline()), context)
+		except:
+			stream.discard()
+			raise
+		else:
+			stream.close()
 
-		# TODO incremental write to save memory on large notebooks...
 		# TODO also yield while exporting main page
 
 		for page in pages:
@@ -42,6 +42,12 @@ class ExportLayout(object):
 		'''
 		raise NotImplementedError
 
+	def manifest_file(self):
+		'''Returns the file for the manifest of an incremental export
+		@returns: a L{File} object
+		'''
+		raise NotImplementedError
+
 
 class DirLayoutBase(ExportLayout):
 
@@ -65,6 +71,9 @@ class DirLayoutBase(ExportLayout):
 	def resources_dir(self):
 		return self.dir.subdir('_resources')
 
+	def manifest_file(self):
+		return self.dir.file('_manifest.json')
+
 
 class MultiFileLayout(DirLayoutBase):
 	'''Layout that maps pages to files in a folder similar to how a
@@ -74,6 +83,7 @@ class MultiFileLayout(DirLayoutBase):
 
 	  dir/
 	   `--> _resources/
+	   `--> _manifest.json  (incremental export only)
 	   `--> page.html
 	   `--> page/
 	         `--> attachment.png
@@ -132,6 +142,7 @@ class FileLayout(DirLayoutBase):
 	   `--> subpage.html
 	   `--> subpage/attachment.pdf
 	   `--> _resources/
+	   `--> _manifest.json  (incremental export only)
 
 	The root for relative links is "page_files/"
 	'''
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''The ExportManifest object keeps a record of the state of the
+notebook at the time of the last export. This allows an incremental
+export to only re-render the pages that changed since then.
+
+The manifest is a json file stored next to the exported files. For
+each page it records the state of everything that goes into the
+output for that page: the source file, the navigation links, the link
+targets and the attachments. Settings that affect all pages, like the
+template and the output format, are recorded once; when they change,
+all pages are exported again.
+'''
+
+import logging
+
+logger = logging.getLogger('zim.export')
+
+from zim.config import json
+
+
+MANIFEST_VERSION = 1 #: Version of the manifest format
+
+
+def _normalize(data):
+	# Round trip through json, so newly computed states compare equal
+	# to loaded ones - e.g. tuples become lists, str become unicode
+	return json.loads(json.dumps(data))
+
+
+class ExportManifest(object):
+	'''Record of the state of the pages at the last export
+
+	@ivar file: the L{File} object for the manifest
+	@ivar settings: the settings of the export, or C{None}
+	@ivar pages: dict mapping page names to the recorded state for
+	pages exported in the current run
+	'''
+
+	def __init__(self, file):
+		'''Constructor, loads the manifest if it exists
+		@param file: a L{File} object
+		'''
+		self.file = file
+		self.settings = None
+		self.pages = {}
+		self._previous = {}
+		self._uptodate = {}
+
+		if file.exists():
+			try:
+				data = json.loads(file.read())
+				if data.get('version') == MANIFEST_VERSION:
+					self.settings = data['settings']
+					self._previous = data['pages']
+			except:
+				logger.exception('Could not read export manifest: %s', file)
+			else:
+				self._uptodate = self._previous
+
+	def check_settings(self, settings):
+		'''Set the settings for the current export. If the settings
+		differ from the previous export, all pages are considered out
+		of date.
+		@param settings: a dict with json serializable values
+		@returns: C{True} if the settings did not change
+		'''
+		settings = _normalize(settings)
+		if settings != self.settings:
+			self.settings = settings
+			self._uptodate = {}
+			return False
+		else:
+			return True
+
+	def is_uptodate(self, name, state):
+		'''Check whether a page needs to be exported again
+		@param name: the page name
+		@param state: the state of the page, a dict with json
+		serializable values
+		@returns: C{True} if the page was exported before with the
+		same settings and state
+		'''
+		return name in self._uptodate \
+			and self._uptodate[name] == _normalize(state)
+
+	def get_previous(self, name):
+		'''Get the state recorded for a page by the previous export
+		@param name: the page name
+		@returns: the state or C{None}
+		'''
+		return self._previous.get(name)
+
+	def update(self, name, state):
+		'''Record the state of a page that is exported
+		@param name: the page name
+		@param state: the state of the page, or C{None} if the page
+		failed to export and should be tried again next time
+		'''
+		self.pages[name] = _normalize(state)
+
+	def list_removed(self):
+		'''List pages that were exported previously, but are no longer
+		part of the export
+		@returns: a list of page names
+		'''
+		return sorted(n for n in self._previous if n not in self.pages)
+
+	def write(self):
+		'''Write the manifest file'''
+		self.file.write(json.dumps({
+			'version': MANIFEST_VERSION,
+			'settings': self.settings,
+			'pages': self.pages,
+		}, sort_keys=True))
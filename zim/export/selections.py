@@ -23,6 +23,12 @@ class PageSelection(object):
 		'''
 		raise NotImplemented
 
+	def __len__(self):
+		'''Number of pages in the selection
+		@implementation: must be implemented by subclases
+		'''
+		raise NotImplemented
+
 	def index(self, namespace=None):
 		'''Iterate path objects for template C{index()} function, depth first
 		@param namespace: the sub namespace to iterate or None to iterate
@@ -30,7 +36,6 @@ class PageSelection(object):
 		'''
 		raise NotImplemented
 
-	# TODO add __len__ that gives total pages for progress
 	# TODO Use collections subclass to make interface complete ?
 
 
@@ -49,6 +54,9 @@ class AllPages(PageSelection):
 			except PageNotFoundError:
 				pass
 
+	def __len__(self):
+		return self.notebook.pages.n_all_pages()
+
 	def index(self, namespace=None):
 		return self.notebook.pages.walk(namespace)
 
@@ -69,6 +77,9 @@ class SinglePage(PageSelection):
 		except PageNotFoundError:
 			pass
 
+	def __len__(self):
+		return 1
+
 	def index(self, namespace=None):
 		if namespace is None or self.page.ischild(namespace):
 			yield self.page
@@ -84,6 +95,9 @@ class SubPages(SinglePage):
 		for path in self.notebook.pages.walk(self.page):
 			yield self.notebook.get_page(path)
 
+	def __len__(self):
+		return 1 + sum(1 for path in self.notebook.pages.walk(self.page))
+
 	def index(self, namespace=None):
 		if namespace is None or namespace.name == self.page.name:
 			yield self.page
@@ -365,6 +365,9 @@ class ExportTemplatePageIter(object):
 		for p in self.content:
 			yield p
 
+	def __len__(self):
+		return len(self.special) + len(self.content)
+
 
 class HeadingSplitter(Visitor):
 
@@ -419,6 +422,11 @@ class PageListProxy(object):
 			dumper = self._dumper_factory(linker)
 			yield PageProxy(self._notebook, page, dumper, linker)
 
+	def __len__(self):
+		# Having a length prevents the template from turning this
+		# object into a list, which would keep all pages in memory
+		return len(self._iterable)
+
 
 class ParseTreeProxy(object):
 
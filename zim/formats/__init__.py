@@ -68,6 +68,7 @@ to a title or subtitle in the document.
 import re
 import string
 import itertools
+import threading
 import logging
 
 import types
@@ -151,7 +152,7 @@ BLOCK_LEVEL = (PARAGRAPH, HEADING, VERBATIM_BLOCK, BLOCK, OBJECT, IMAGE, LISTITE
 
 
 
-from zim.tokenparser import TokenBuilder
+from zim.tokenparser import TokenBuilder, TEXT as _TEXT, END as _END
 
 
 _letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
@@ -318,8 +319,9 @@ class ParseTree(object):
 
 		# Parent dies when we have attributes that are not a string
 		for element in self._etree.getiterator('*'):
-			for key in element.attrib.keys():
-				element.attrib[key] = str(element.attrib[key])
+			for key, value in element.attrib.items():
+				if not isinstance(value, basestring):
+					element.attrib[key] = str(value)
 
 		xml = StringIO()
 		xml.write("<?xml version='1.0' encoding='utf-8'?>\n")
@@ -335,6 +337,27 @@ class ParseTree(object):
 			print ">>>", xml, "<<<"
 			raise
 
+	def totokens(self):
+		'''Get the content of the tree as a flat list of tokens, see
+		L{TokenParseTree} for the format. The list can be serialized
+		with e.g. C{marshal} or C{pickle} as long as all attributes
+		have basic types.
+		@returns: a list
+		'''
+		tokens = []
+		def walk(element):
+			tokens.extend((element.tag, dict(element.attrib) or None))
+			if element.text:
+				tokens.extend((_TEXT, element.text))
+			for child in element:
+				walk(child) # recurs
+				if child.tail:
+					tokens.extend((_TEXT, child.tail))
+			tokens.extend((_END, element.tag))
+
+		walk(self._etree.getroot())
+		return tokens
+
 	def iter_tokens(self):
 		tb = TokenBuilder()
 		self.visit(tb)
@@ -370,6 +393,19 @@ class ParseTree(object):
 				seen.add(name)
 				yield name.lstrip('@')
 
+	def iter_text(self):
+		'''Generator for the text in the tree, yields the text segments
+		between formatting elements separately, the same way they are
+		matched by L{countre()}. Segments are not strictly in document
+		order.
+		@returns: yields strings
+		'''
+		for element in self._etree.getiterator():
+			if element.text:
+				yield element.text
+			if element.tail:
+				yield element.tail
+
 	def _get_heading_element(self, level=1):
 		root = self._etree.getroot()
 		children = root.getchildren()
@@ -714,6 +750,312 @@ class ParseTree(object):
 			return None
 
 
+def _iter_token_pairs(tokens):
+	# Iterate flat token list in pairs of type and value
+	i = iter(tokens)
+	return itertools.izip(i, i)
+
+
+class TokenParseTree(ParseTree):
+	'''Lightweight version of L{ParseTree} that keeps the content as
+	a flat list of tokens instead of an ElementTree.
+
+	The token list contains pairs of items: C{tag, attrib} for the start
+	of an element, C{TEXT, text} for text and C{END, tag} for the end
+	of an element, using the C{TEXT} and C{END} constants from
+	L{zim.tokenparser}. To save memory the list is not nested and
+	C{attrib} is C{None} for elements without attributes. Adjacent text
+	is always joined, so this is an exact representation of the
+	ElementTree.
+
+	Indexers and search only need to iterate over the content, this can
+	be done directly on the token list by L{visit()}, L{iter_href()},
+	L{iter_tag_names()}, L{iter_text()}, L{iter_tokens()}, L{count()} and
+	L{countre()}. This avoids the overhead of building an ElementTree
+	for each page. All other methods, e.g. those that modify the tree,
+	convert the tokens to an ElementTree on first use. After that
+	the object behaves exactly like a normal L{ParseTree}.
+
+	The conversion is done under a lock and methods that use the tokens
+	take a single reference to the token list, so reading the same tree
+	from multiple threads is safe, e.g. for a page shared by the worker
+	threads of the web server. Modifying the tree is not.
+	'''
+
+	def __init__(self, tokens):
+		'''Constructor
+		@param tokens: a flat list of tokens, e.g. as produced by
+		L{TokenParseTreeBuilder} or L{ParseTree.totokens()}, the
+		list is used directly, not copied
+		'''
+		self._tokens = tokens
+		self._real_etree = None
+		self._lock = threading.Lock()
+		self._object_cache = {}
+		self.meta = OrderedDict()
+
+	@property
+	def _etree(self):
+		if self._real_etree is None:
+			with self._lock:
+				if self._real_etree is None:
+					builder = ElementTreeModule.TreeBuilder()
+					for tag, value in _iter_token_pairs(self._tokens):
+						if tag == _TEXT:
+							builder.data(value)
+						elif tag == _END:
+							builder.end(value)
+						else:
+							builder.start(tag, value or {})
+					self._real_etree = ElementTreeModule.ElementTree(builder.close())
+					self._tokens = None # etree may be modified from now on
+		return self._real_etree
+
+	@property
+	def hascontent(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.hascontent.fget(self)
+
+		for tag, value in _iter_token_pairs(tokens[2:-2]):
+			if tag != _TEXT:
+				return True # root has child elements
+			elif value and not value.isspace():
+				return True
+		else:
+			return False
+
+	@property
+	def ispartial(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.ispartial.fget(self)
+		return (tokens[1] or {}).get('partial', False)
+
+	@property
+	def israw(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.israw.fget(self)
+		return (tokens[1] or {}).get('raw', False)
+
+	def _get_heading_index(self, tokens, level=1):
+		# Like ParseTree._get_heading_element(), but returns the index
+		# of the start token of the heading or None
+		i = 2
+		if tokens[i] == _TEXT:
+			if tokens[i + 1] and not tokens[i + 1].isspace():
+				return None
+			i += 2
+
+		if tokens[i] == 'h' and tokens[i + 1]['level'] >= level:
+			return i
+		return None
+
+	def get_heading_level(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.get_heading_level(self)
+
+		i = self._get_heading_index(tokens)
+		if i is not None:
+			return int(tokens[i + 1]['level'])
+		else:
+			return None
+
+	def get_heading(self, level=1):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.get_heading(self, level)
+
+		i = self._get_heading_index(tokens, level)
+		if i is not None:
+			return self._get_element_text(tokens, i)
+		else:
+			return ""
+
+	def copy(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.copy(self)
+		return TokenParseTree([
+			value.copy() if isinstance(value, dict) else value
+				for value in tokens
+		])
+
+	def totokens(self):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.totokens(self)
+		return tokens
+
+	@staticmethod
+	def _iter_elements(tokens, *tags):
+		# Yields index of start tokens for given tags, in document order
+		for i in xrange(0, len(tokens), 2):
+			if tokens[i] in tags:
+				yield i
+
+	@staticmethod
+	def _get_element_text(tokens, i):
+		if tokens[i + 2] == _TEXT:
+			return tokens[i + 3]
+		else:
+			return None
+
+	def iter_href(self):
+		tokens = self._tokens
+		if tokens is None:
+			for href in ParseTree.iter_href(self):
+				yield href
+			return
+
+		from zim.notebook.page import HRef # XXX
+		seen = set()
+		for i in itertools.chain(
+			self._iter_elements(tokens, LINK),
+			self._iter_elements(tokens, IMAGE)
+		):
+			href = (tokens[i + 1] or {}).get('href')
+			if href and href not in seen:
+				seen.add(href)
+				if link_type(href) == 'page':
+					try:
+						yield HRef.new_from_wiki_link(href)
+					except ValueError:
+						pass
+
+	def iter_tag_names(self):
+		tokens = self._tokens
+		if tokens is None:
+			for name in ParseTree.iter_tag_names(self):
+				yield name
+			return
+
+		seen = set()
+		for i in self._iter_elements(tokens, TAG):
+			name = self._get_element_text(tokens, i)
+			if not name in seen:
+				seen.add(name)
+				yield name.lstrip('@')
+
+	def iter_text(self):
+		tokens = self._tokens
+		if tokens is None:
+			for text in ParseTree.iter_text(self):
+				yield text
+			return
+
+		# Same order as ElementTree: text and tail of each element
+		# in order of the start tags
+		n = len(tokens)
+		tails = {}
+		stack = []
+		for i in xrange(0, n, 2):
+			tag = tokens[i]
+			if tag == _END:
+				start = stack.pop()
+				if i + 2 < n and tokens[i + 2] == _TEXT:
+					tails[start] = tokens[i + 3]
+			elif tag != _TEXT:
+				stack.append(i)
+
+		for i in xrange(0, n, 2):
+			if tokens[i] not in (_TEXT, _END):
+				text = self._get_element_text(tokens, i)
+				if text:
+					yield text
+				if tails.get(i):
+					yield tails[i]
+
+	def count(self, text):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.count(self, text)
+
+		return sum(
+			value.count(text)
+				for tag, value in _iter_token_pairs(tokens)
+					if tag == _TEXT
+		)
+
+	def countre(self, regex):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.countre(self, regex)
+
+		count = 0
+		for tag, value in _iter_token_pairs(tokens):
+			if tag == _TEXT and value:
+				newstring, n = regex.subn('', value)
+				count += n
+		return count
+
+	def visit(self, visitor):
+		tokens = self._tokens
+		if tokens is None:
+			return ParseTree.visit(self, visitor)
+
+		try:
+			self._visit_tokens(tokens, visitor)
+		except VisitorStop:
+			pass
+
+	def _visit_tokens(self, tokens, visitor):
+		# Same calls as ParseTree._visit() - elements without children
+		# use visitor.append(), VisitorSkip skips the rest of the
+		# element that is being processed
+		stack = [] # index of start tokens for open elements
+		i = 0
+		while i < len(tokens):
+			tag, value = tokens[i], tokens[i + 1]
+			leaf = False
+			try:
+				if tag == _END:
+					stack.pop()
+					i += 2
+					visitor.end(value)
+				elif tag == _TEXT:
+					# tail of a child element
+					i += 2
+					if value:
+						visitor.text(value)
+				else:
+					if value is None:
+						# visitor may modify attrib, so store it
+						value = tokens[i + 1] = {}
+					start = i
+					text = self._get_element_text(tokens, i)
+					i += 4 if text is not None else 2
+					if tokens[i] == _END:
+						i += 2
+						leaf = True
+						visitor.append(tag, value, text)
+					else:
+						stack.append(start)
+						visitor.start(tag, value)
+						if text:
+							visitor.text(text)
+			except VisitorSkip:
+				if tag != _END and not leaf:
+					# skip rest of current element
+					i = self._find_end(tokens, stack.pop()) + 2
+
+	@staticmethod
+	def _find_end(tokens, start):
+		# Returns index of end token matching start token
+		depth = 0
+		for i in xrange(start, len(tokens), 2):
+			tag = tokens[i]
+			if tag == _END:
+				depth -= 1
+				if depth == 0:
+					return i
+			elif tag != _TEXT:
+				depth += 1
+		raise AssertionError('BUG: unbalanced tokens')
+
+
 class VisitorStop(Exception):
 	'''Exception to be raised to cancel a visitor action'''
 	pass
@@ -868,6 +1210,44 @@ class ParseTreeBuilder(Builder):
 		self._last_char = None
 
 
+class _TokenTreeBuilder(object):
+	# Replacement for the ElementTree TreeBuilder that collects a flat
+	# list of tokens instead of building elements
+
+	def __init__(self):
+		self._tokens = []
+
+	def start(self, tag, attrib):
+		self._tokens.extend((tag, dict(attrib) if attrib else None))
+
+	def data(self, text):
+		tokens = self._tokens
+		if tokens and tokens[-2] == _TEXT:
+			tokens[-1] += text
+		else:
+			tokens.extend((_TEXT, text))
+
+	def end(self, tag):
+		self._tokens.extend((_END, tag))
+
+	def close(self):
+		return self._tokens
+
+
+class TokenParseTreeBuilder(ParseTreeBuilder):
+	'''Builder object that builds a L{TokenParseTree}'''
+
+	def __init__(self, partial=False, _parsetree_roundtrip=False):
+		ParseTreeBuilder.__init__(self, partial, _parsetree_roundtrip)
+		self._b = _TokenTreeBuilder()
+
+	def get_parsetree(self):
+		tokens = self._b.close()
+		if self.partial:
+			tokens[1] = dict(tokens[1] or {}, partial=True)
+		return TokenParseTree(tokens)
+
+
 count_eol_re = re.compile(r'\n+\Z')
 split_para_re = re.compile(r'((?:^[ \t]*\n){2,})', re.M)
 
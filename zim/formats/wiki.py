@@ -56,6 +56,10 @@ empty_lines_re = re.compile(r'((?:^[\ \t]*\n)+)', re.M | re.U)
 unindented_line_re = re.compile('^\S', re.M)
 	# match any unindented line
 
+inline_trigger_re = re.compile(r"@|\[\[|\{\{|//|\*\*|__|_\{|\^\{|~~|''")
+	# match text that is needed for any of the inline rules to match,
+	# urls need "://" or "@"
+
 
 def _remove_indent(text, indent):
 	return re.sub('(?m)^' + indent, '', text)
@@ -78,8 +82,16 @@ class WikiParser(object):
 		'*': BULLET,
 	}
 
+	# For speed, the block level and intermediate level parsers have an
+	# "anchor" to only try the rules at the start of a line. For inline
+	# formatting there is a second parser without the rules for urls and
+	# tags, which are expensive and can only match when the text contains
+	# "@" or "://". Text without any formatting skips the inline parser
+	# altogether. These shortcuts do not change the results.
+
 	def __init__(self):
 		self.inline_parser = self._init_inline_parse()
+		self.simple_inline_parser = self._init_inline_parse(urls=False)
 		self.list_and_indent_parser = self._init_intermediate_parser()
 		self.block_parser = self._init_block_parser()
 
@@ -88,12 +100,10 @@ class WikiParser(object):
 		self.block_parser(builder, text)
 		builder.end(FORMATTEDTEXT)
 
-	def _init_inline_parse(self):
+	def _init_inline_parse(self, urls=True):
 		# Rules for inline formatting, links and tags
-		return (
-			Rule(LINK, url_re.r, process=self.parse_url) # FIXME need .r atribute because url_re is a Re object
-			| Rule(TAG, r'(?<!\S)@\w+', process=self.parse_tag)
-			| Rule(LINK, r'\[\[(?!\[)(.*?)\]\]', process=self.parse_link)
+		parser = (
+			Rule(LINK, r'\[\[(?!\[)(.*?)\]\]', process=self.parse_link)
 			| Rule(IMAGE, r'\{\{(?!\{)(.*?)\}\}', process=self.parse_image)
 			| Rule(EMPHASIS, r'//(?!/)(.*?)//')
 			| Rule(STRONG, r'\*\*(?!\*)(.*?)\*\*')
@@ -103,6 +113,23 @@ class WikiParser(object):
 			| Rule(STRIKE, r'~~(?!~)(.+?)~~')
 			| Rule(VERBATIM, r"''(?!')(.+?)''")
 		)
+		if urls:
+			# Urls and tags go first, so they take precedence
+			parser = (
+				Rule(LINK, url_re.r, process=self.parse_url) # FIXME need .r atribute because url_re is a Re object
+				| Rule(TAG, r'(?<!\S)@\w+', process=self.parse_tag)
+				| parser
+			)
+		return parser
+
+	def parse_inline(self, builder, text):
+		'''Parse inline formatting, links and tags'''
+		if text and not inline_trigger_re.search(text):
+			builder.text(text)
+		elif '@' in text or '://' in text:
+			self.inline_parser(builder, text)
+		else:
+			self.simple_inline_parser(builder, text)
 
 	def _init_intermediate_parser(self):
 		# Intermediate level, breaks up lists and indented blocks
@@ -140,7 +167,8 @@ class WikiParser(object):
 				process=self.parse_indent
 			),
 		)
-		p.process_unmatched = self.inline_parser
+		p.anchor = r'^(?: \t | %s )' % bullet_pattern
+		p.process_unmatched = self.parse_inline
 		return p
 
 	def _init_block_parser(self):
@@ -177,6 +205,7 @@ class WikiParser(object):
 			Rule(LINE, r'(?<=\n)-{5,}(?=\n)', process=self.parse_line) # \n----\n
 
 		)
+		p.anchor = r"^(?: \t*\'\'\' | \t*\{\{\{ | == | \| | -{5} )"
 		p.process_unmatched = self.parse_para
 		return p
 
@@ -307,7 +336,7 @@ class WikiParser(object):
 				celltext = celltext.replace('#124;', '|').replace('\\n', '\n').strip()  # cleanup cell
 				if not celltext:
 					celltext = ' '  # celltext must contain at least one character
-				self.inline_parser(builder, celltext)
+				self.parse_inline(builder, celltext)
 				builder.end(TABLEDATA)
 			builder.end(TABLEROW)
 
@@ -383,7 +412,7 @@ class WikiParser(object):
 				else: # BULLETLIST
 					attrib = {'bullet': BULLET}
 				builder.start(LISTITEM, attrib)
-				self.inline_parser(builder, text)
+				self.parse_inline(builder, text)
 				builder.end(LISTITEM)
 
 				lines.pop(0)
@@ -394,7 +423,7 @@ class WikiParser(object):
 		'''Parse indented blocks and turn them into 'div' elements'''
 		text = _remove_indent(text, indent)
 		builder.start(BLOCK, {'indent': len(indent)})
-		self.inline_parser(builder, text)
+		self.parse_inline(builder, text)
 		builder.end(BLOCK)
 
 	@staticmethod
@@ -459,7 +488,7 @@ class Parser(ParserClass):
 			if version and version not in ('zim 0.26', WIKI_FORMAT_VERSION):
 				backward = True
 
-		builder = ParseTreeBuilder(partial=partial)
+		builder = TokenParseTreeBuilder(partial=partial)
 		wikiparser.backward = backward or self.backward # HACK
 		wikiparser(builder, input)
 
@@ -1435,12 +1435,14 @@ class UnixFile(FilePath):
 		@param mode: the open mode, either 'r' or 'w' (other modes
 		are not supported)
 
-		@returns: a file object
+		@returns: a file object, when opened for writing it has a
+		C{discard()} method that closes it without replacing the file
 		'''
 		# When we open for writing, we actually open the tmp file
 		# and return a FileHandle object that will call _on_write()
 		# when it is closed. This handler will take care of replacing
-		# the actual file with the newly written tmp file.
+		# the actual file with the newly written tmp file. The write
+		# can be cancelled by calling discard() instead of close().
 		assert mode in ('r', 'w')
 		if mode == 'w':
 			if not self.iswritable():
@@ -1892,6 +1894,16 @@ class FileHandle(file):
 		if not self.on_close is None:
 			self.on_close()
 
+	def discard(self):
+		'''Close the file without calling the callback and remove it.
+		For a file opened for writing with L{File.open()} this cancels
+		the write, the tmp file is removed and the original file is
+		left untouched.
+		'''
+		file.close(self)
+		if os.path.isfile(self.name):
+			os.remove(self.name)
+
 
 
 
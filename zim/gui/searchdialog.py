@@ -73,11 +73,13 @@ class SearchDialog(Dialog):
 		self.search_button.connect_object('clicked', self.__class__._search, self)
 		self.cancel_button.connect_object('clicked', self.__class__._cancel, self)
 		self.query_entry.connect_object('activate', self.__class__._search, self)
+		self.query_entry.connect_object('changed', self.__class__._cancel, self)
+		self.results_treeview.connect_object('search-finished', self.__class__._on_search_finished, self)
 
 	def search(self, query):
 		'''Trigger a search to be performed.
-		Because search can take a long time to execute it is best to
-		call this method after the dialog is shown.
+		The search runs in a background thread, results are shown
+		in the dialog while they are found.
 
 		@param query: the query as string
 		'''
@@ -90,11 +92,17 @@ class SearchDialog(Dialog):
 			string = 'Section: "%s" ' % self.app_window.ui.page.name + string # XXX
 		#~ print '!! QUERY: ' + string
 
-		self._set_state(self.SEARCHING)
 		try:
-			self.results_treeview.search(string)
+			started = self.results_treeview.search(string)
 		except Exception as error:
 			ErrorDialog(self, error).run()
+		else:
+			if started:
+				self._set_state(self.SEARCHING)
+
+	def _on_search_finished(self, error):
+		if error:
+			ErrorDialog(self, error).run()
 
 		if not self.results_treeview.cancelled:
 			self._set_state(self.READY)
@@ -102,7 +110,7 @@ class SearchDialog(Dialog):
 			self._set_state(self.CANCELLED)
 
 	def _cancel(self):
-		self.results_treeview.cancelled = True
+		self.results_treeview.cancel()
 
 	def _set_state(self, state):
 		# TODO set cursor for treeview part
@@ -116,14 +124,12 @@ class SearchDialog(Dialog):
 			button.show_all()
 
 		if state in (self.READY, self.CANCELLED):
-			self.query_entry.set_sensitive(True)
 			hide(self.cancel_button)
 			if self.spinner:
 				self.spinner.stop()
 				hide(self.spinner)
 			show(self.search_button)
 		elif state == self.SEARCHING:
-			self.query_entry.set_sensitive(False)
 			hide(self.search_button)
 			if self.spinner:
 				show(self.spinner)
@@ -135,19 +141,35 @@ class SearchDialog(Dialog):
 
 
 class SearchResultsTreeView(BrowserTreeView):
+	'''Widget showing search results. The search runs in a
+	L{SearchThread} and the results are added to the view while the
+	search progresses.
+
+	@signal: C{search-finished (error)}: emitted when the search is
+	done or cancelled, C{error} is an exception raised by the search
+	or C{None}
+	'''
+
+	# define signals we want to use - (closure type, return type and arg types)
+	__gsignals__ = {
+		'search-finished': (gobject.SIGNAL_RUN_LAST, None, (object,)),
+	}
 
 	NAME_COL = 0
 	SCORE_COL = 1
 	PATH_COL = 2
 
+	POLL_TIMEOUT = 100 #: timeout in milliseconds to check for new results
+
 	def __init__(self, window):
 		model = gtk.ListStore(str, int, object)
 			# NAME_COL, SCORE_COL, PATH_COL
 		BrowserTreeView.__init__(self, model)
 		self.app_window = window
 		self.query = None
-		self.selection = SearchSelection(window.ui.notebook) # XXX
-		self.cancelled = False
+		self.selection = None
+		self._thread = None
+		self._timer = None
 
 		cell_renderer = gtk.CellRendererText()
 		for name, i in (
@@ -164,32 +186,83 @@ class SearchResultsTreeView(BrowserTreeView):
 			# By default sort by score
 
 		self.connect('row-activated', self._do_open_page)
-		self.connect('destroy', self.__class__._cancel)
+		self.connect('destroy', self.__class__._do_destroy)
+
+	@property
+	def cancelled(self):
+		'''C{True} if the last search was cancelled'''
+		return self._thread is not None and self._thread.cancelled
 
-	def _cancel(self): self.cancelled = True
+	@property
+	def searching(self):
+		'''C{True} while a search is running'''
+		return self._timer is not None
 
 	def search(self, query):
+		'''Start a search in a background thread. A search that is
+		still running is cancelled.
+		@param query: the query as string
+		@returns: C{True} if a search was started
+		'''
 		query = query.strip()
 		if not query:
-			return
+			return False
 		logger.info('Searching for: %s', query)
 
+		self.cancel()
+		self._stop()
 		self.get_model().clear()
-		self.cancelled = False
 		self.query = Query(query)
-		self.selection.search(self.query, callback=self._search_callback)
-		self._update_results(self.selection)
-
-	def _search_callback(self, results, path):
-		# Returning False will cancel the search
-		#~ print '!! CB', path
-		if results is not None:
-			self._update_results(results)
-
-		while gtk.events_pending():
-			gtk.main_iteration(block=False)
+		self._thread = SearchThread(self.app_window.ui.notebook, self.query)
+		self.selection = self._thread.selection
+		self._thread.start()
+		self._timer = gobject.timeout_add(self.POLL_TIMEOUT, self._poll)
+		return True
+
+	def cancel(self):
+		'''Cancel a running search, the results found so far are
+		kept in the view
+		'''
+		if self._thread is not None:
+			self._thread.cancel()
+
+	def _poll(self):
+		# Called by a timer in the main loop to transfer new results
+		# from the search thread to the model
+		thread = self._thread
+		done = thread.done # check before pop to not miss any results
+		self._add_results(thread.pop_results())
+		if not done:
+			return True # keep timer
+
+		self._timer = None
+		if thread.error:
+			logger.error('Error in search', exc_info=thread.exc_info)
+			self.emit('search-finished', thread.exc_info[1])
+		else:
+			if not thread.cancelled:
+				self._update_results(thread.selection)
+			self.emit('search-finished', None)
+		return False # stop timer
+
+	def _stop(self):
+		# Detach from a previous search thread, it is cancelled, but
+		# can take a moment to actually stop
+		if self._timer is not None:
+			gobject.source_remove(self._timer)
+			self._timer = None
+
+	def _do_destroy(self):
+		self.cancel()
+		self._stop()
+
+	def _add_results(self, results):
+		model = self.get_model()
+		if not model or not results:
+			return
 
-		return not self.cancelled
+		for path, score in results:
+			model.append((path.name, score, path))
 
 	def _update_results(self, results):
 		model = self.get_model()
@@ -231,3 +304,5 @@ class SearchResultsTreeView(BrowserTreeView):
 			string = self.query.simple_match
 			string = string.strip('*') # support partial matches
 			self.app_window.pageview.show_find(string, highlight=True)
+
+gobject.type_register(SearchResultsTreeView)
@@ -19,6 +19,7 @@ import zim
 import zim.fs
 import zim.errors
 import zim.config
+import zim.profiler
 import zim.config.basedirs
 
 from zim import __version__
@@ -58,6 +59,7 @@ General Options:
   --manual         open the user manual
   -V, --verbose    print information to terminal
   -D, --debug      print debug messages
+  --profile-startup  report time spent on imports and loading plugins
   -v, --version    print version and exit
   -h, --help       print this text
 
@@ -71,6 +73,8 @@ GUI Options:
 Server Options:
   --port           port to use (defaults to 8080)
   --template       name of the template to use
+  -w, --workers    number of threads handling requests (defaults to 1)
+  --queue-size     number of requests that can wait for a thread
   --gui            run the gui wrapper for the server
 
 Export Options:
@@ -82,9 +86,14 @@ Export Options:
   -r, --recursive  when exporting a page, also export sub-pages
   -s, --singlefile export all pages to a single output file
   -O, --overwrite  force overwriting existing file(s)
+  -j, --jobs       number of processes to export pages in parallel
+  -i, --incremental
+                   only export pages that changed since the previous
+                   export, implies "--overwrite"
 
 Search Options:
-  None
+  --limit          maximum number of results to show
+  --json           print results with their score as json
 
 Index Options:
   None
@@ -302,6 +311,8 @@ class ServerCommand(NotebookCommand):
 	options = (
 		('port=', 'p', 'port number to use (defaults to 8080)'),
 		('template=', 't', 'name or path of the template to use'),
+		('workers=', 'w', 'number of threads handling requests (defaults to 1)'),
+		('queue-size=', '', 'number of requests that can wait for a thread'),
 		('standalone', '', 'start a single instance, no background process'),
 	)
 
@@ -309,9 +320,18 @@ class ServerCommand(NotebookCommand):
 		import zim.www
 		self.opts['port'] = int(self.opts.get('port', 8080))
 		self.opts.setdefault('template', 'Default')
+		try:
+			workers = int(self.opts.get('workers', 1))
+			queue_size = int(self.opts.get('queue-size', zim.www.DEFAULT_QUEUE_SIZE))
+		except ValueError:
+			workers = queue_size = 0
+		if workers < 1 or queue_size < 1:
+			raise UsageError(_('Number of workers and queue size should be positive integers')) # T: error in server command
 		notebook, page = self.build_notebook()
 
-		self.server = httpd = zim.www.make_server(notebook, public=True, **self.get_options('template', 'port'))
+		self.server = httpd = zim.www.make_server(notebook, public=True,
+			workers=workers, queue_size=queue_size,
+			**self.get_options('template', 'port'))
 			# server attribute used in testing to stop sever in thread
 		logger.info("Serving HTTP on %s port %i...", httpd.server_name, httpd.server_port)
 		httpd.serve_forever()
@@ -359,6 +379,8 @@ class ExportCommand(NotebookCommand):
 		('recursive', 'r', 'when exporting a page, also export sub-pages'),
 		('singlefile', 's', 'export all pages to a single output file'),
 		('overwrite', 'O', 'overwrite existing file(s)'),
+		('jobs=', 'j', 'number of processes to export pages in parallel'),
+		('incremental', 'i', 'only export pages that changed since the previous export'),
 	)
 
 	def get_exporter(self, page):
@@ -377,7 +399,15 @@ class ExportCommand(NotebookCommand):
 			output = File(self.opts.get('output'))
 		template = self.opts.get('template', 'Default')
 
-		if output.exists() and not self.opts.get('overwrite'):
+		try:
+			jobs = int(self.opts.get('jobs', 1))
+		except ValueError:
+			jobs = 0
+		if jobs < 1:
+			raise UsageError(_('Number of jobs should be a positive integer')) # T: error in export command
+
+		if output.exists() and not self.opts.get('overwrite') \
+		and not self.opts.get('incremental'):
 			if output.isdir():
 				if len(output.list()) > 0:
 					raise Error(_('Output folder exists and not empty, specify "--overwrite" to force export'))  # T: error message for export
@@ -387,7 +417,7 @@ class ExportCommand(NotebookCommand):
 				raise Error(_('Output file exists, specify "--overwrite" to force export'))  # T: error message for export
 
 		if format == 'mhtml':
-			self.ignore_options('index-page')
+			self.ignore_options('index-page', 'jobs', 'incremental')
 			if output.isdir():
 				raise UsageError(_('Need output file to export MHTML')) # T: error message for export
 
@@ -396,7 +426,7 @@ class ExportCommand(NotebookCommand):
 				document_root_url=self.opts.get('root-url'),
 			)
 		elif self.opts.get('singlefile'):
-			self.ignore_options('index-page')
+			self.ignore_options('index-page', 'jobs', 'incremental')
 			if output.exists() and output.isdir():
 				ext = get_format(format).info['extension']
 				output = output.file(page.basename) + '.' + ext
@@ -414,6 +444,8 @@ class ExportCommand(NotebookCommand):
 			exporter = build_page_exporter(
 				output, format, template, page,
 				document_root_url=self.opts.get('root-url'),
+				jobs=jobs,
+				incremental=self.opts.get('incremental', False),
 			)
 		else:
 			if not output.exists():
@@ -425,6 +457,8 @@ class ExportCommand(NotebookCommand):
 				output, format, template,
 				index_page=self.opts.get('index-page'),
 				document_root_url=self.opts.get('root-url'),
+				jobs=jobs,
+				incremental=self.opts.get('incremental', False),
 			)
 
 		return exporter
@@ -460,9 +494,14 @@ class SearchCommand(NotebookCommand):
 	'''Class implementing the C{--search} command'''
 
 	arguments = ('NOTEBOOK', 'QUERY')
+	options = (
+		('limit=', '', 'maximum number of results to show'),
+		('json', '', 'print results with their score as json'),
+	)
 
 	def run(self):
 		from zim.search import SearchSelection, Query
+		from zim.config import json
 
 		notebook, p = self.build_notebook()
 		n, query = self.get_arguments()
@@ -473,10 +512,30 @@ class SearchCommand(NotebookCommand):
 		else:
 			raise ValueError('Empty query')
 
+		limit = self.opts.get('limit')
+		if limit is not None:
+			try:
+				limit = int(limit)
+			except ValueError:
+				raise UsageError(_('Limit should be a positive integer')) # T: error in search command
+			if limit < 1:
+				raise UsageError(_('Limit should be a positive integer')) # T: error in search command
+
 		selection = SearchSelection(notebook)
 		selection.search(query)
-		for path in sorted(selection, key=lambda p: p.name):
-			print path.name
+		if limit is None and not self.opts.get('json'):
+			paths = sorted(selection, key=lambda p: p.name)
+		else:
+			paths = selection.ranked(limit)
+
+		if self.opts.get('json'):
+			print json.dumps([
+				{'name': path.name, 'score': selection.scores.get(path, 0)}
+					for path in paths
+			], indent=1)
+		else:
+			for path in paths:
+				print path.name
 
 
 class IndexCommand(NotebookCommand):
@@ -487,7 +546,7 @@ class IndexCommand(NotebookCommand):
 	def run(self):
 		notebook, p = self.build_notebook(ensure_uptodate=False)
 		notebook.index.flush()
-		for info in notebook.index.update_iter():
+		for info in notebook.index.update_iter(bulk=True):
 			#logger.info('Indexing %s', info)
 			pass # TODO meaningful info for above message
 
@@ -646,6 +705,10 @@ class ZimApplication(object):
 			else:
 				cmd.run()
 		else:
+			if cmd.opts.get('profile-startup'):
+				# Started already by zim.py, but not when called otherwise
+				zim.profiler.start_profiler()
+
 			# Although a-typical, this path could be re-entrant if a
 			# run_local() dispatches another command - therefore we set
 			# standalone before calling run_local()
@@ -655,12 +718,13 @@ class ZimApplication(object):
 					return
 
 				if not self._standalone and self._try_dispatch(args, cmd.pwd):
-					pass # We are done
+					self._report_startup_profile()
 				else:
 					self._running = True
 					self._run_main_loop(cmd)
 			else:
 				cmd.run()
+				self._report_startup_profile()
 
 	def _run_main_loop(self, cmd):
 		# Run for the 1st gtk command in a primary process,
@@ -704,6 +768,8 @@ class ZimApplication(object):
 		if w is not None:
 			self.add_window(w)
 
+		self._report_startup_profile()
+
 		while self._windows:
 			gtk.main()
 
@@ -748,6 +814,11 @@ class ZimApplication(object):
 			logger.debug(zim.get_zim_revision())
 			zim.config.log_basedirs()
 
+	def _report_startup_profile(self):
+		profiler = zim.profiler.stop_profiler()
+		if profiler is not None:
+			profiler.report()
+
 	def _setup_signal_handling(self):
 		def handle_sigterm(signal, frame):
 			import gtk
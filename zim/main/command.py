@@ -48,6 +48,7 @@ class Command(object):
 	default_options = (
 		('verbose', 'V', 'Verbose output'),
 		('debug', 'D', 'Debug output'),
+		('profile-startup', '', 'Report import and init time'),
 	)
 
 	def __init__(self, command, pwd=None):
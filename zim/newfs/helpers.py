@@ -20,7 +20,8 @@ import logging
 logger = logging.getLogger('zim.newfs.helpers')
 
 
-from .local import LocalFSObjectBase
+from .base import FileNotFoundError, _decode_path
+from .local import LocalFSObjectBase, LocalFolder
 
 
 class FileTreeWatcher(SignalEmitter):
@@ -41,6 +42,117 @@ class FileTreeWatcher(SignalEmitter):
 
 
 
+class FolderTreeMonitor(SignalEmitter):
+	'''Helper object that monitors a L{LocalFolder} and all folders
+	below it for changes made by other applications. Depends on the
+	C{gio} library, which uses OS notifications (e.g. "inotify") so
+	changes are reported without polling the file system.
+
+	Hidden files and temporary files are ignored, same as in the
+	listing of a folder.
+
+	@signal: C{changed (file)}: emitted when a file or folder is
+	created or when a file changed
+	@signal: C{removed (file)}: emitted when a file or folder is removed,
+	the type of the object depends on whether the path was a monitored
+	folder
+	'''
+
+	__signals__ = {
+		'changed': (SIGNAL_NORMAL, None, (object,)),
+		'removed': (SIGNAL_NORMAL, None, (object,)),
+	} #: signals supported by this class
+
+	def __init__(self, folder):
+		'''Constructor
+		@param folder: a L{LocalFolder} object
+		'''
+		assert isinstance(folder, LocalFolder)
+		self.folder = folder
+		self._monitors = {}
+
+	@staticmethod
+	def is_supported():
+		'''Returns C{True} when file monitoring is supported'''
+		return gio is not None
+
+	@property
+	def running(self):
+		return bool(self._monitors)
+
+	def start(self):
+		'''Start monitoring
+		@returns: C{True} when monitoring is running
+		'''
+		if gio and not self._monitors:
+			logger.debug('Start monitoring folder tree: %s', self.folder)
+			self._add_tree(self.folder)
+		return self.running
+
+	def stop(self):
+		'''Stop monitoring'''
+		for monitor in self._monitors.values():
+			monitor.cancel()
+		self._monitors.clear()
+
+	def _add_tree(self, folder):
+		try:
+			monitor = gio.File(uri=folder.uri).monitor_directory()
+		except:
+			logger.exception('Error while setting up file monitor')
+			return
+		monitor.connect('changed', self._on_changed)
+		self._monitors[folder.path] = monitor
+		try:
+			for child in folder.list_folders():
+				self._add_tree(child) # recurs
+		except FileNotFoundError:
+			pass # removed in the mean time, handled by "deleted" event
+
+	def _remove_tree(self, folder):
+		prefix = folder.path + os.sep
+		for path in self._monitors.keys():
+			if path == folder.path or path.startswith(prefix):
+				self._monitors.pop(path).cancel()
+
+	def _on_changed(self, filemonitor, gfile, other_gfile, event_type):
+		# Monitors are not recursive, so there is a monitor per folder.
+		# The monitors for a folder and for its parent can both report
+		# the folder itself, signals are emitted for both.
+		path = gfile.get_path()
+		if path is None:
+			return
+		path = _decode_path(path)
+		if not path.startswith(self.folder.path + os.sep):
+			return
+
+		relpath = path[len(self.folder.path)+1:]
+		for name in relpath.split(os.sep):
+			if name[0] in ('.', '~') or name[-1] == '~':
+				return # Ignore hidden files and tmp files
+
+		if event_type == gio.FILE_MONITOR_EVENT_DELETED:
+			if path in self._monitors:
+				folder = self.folder.folder(relpath)
+				self._remove_tree(folder)
+				self.emit('removed', folder)
+			else:
+				self.emit('removed', self.folder.file(relpath))
+		elif event_type in (
+			gio.FILE_MONITOR_EVENT_CREATED,
+			gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT,
+		):
+			try:
+				child = self.folder.child(relpath)
+			except FileNotFoundError:
+				return # removed again, handled by "deleted" event
+
+			if isinstance(child, LocalFolder) \
+			and child.path not in self._monitors:
+				self._add_tree(child)
+			self.emit('changed', child)
+
+
 class TrashHelper(object):
 
 	def trash(self, file):
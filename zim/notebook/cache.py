@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''Caches for page objects and page parse trees
+
+Parsing the page source is the most expensive step when reading a page.
+Pages are read over and over again by e.g. search and export, while
+most of them do not change in between. The L{ParseTreeCache} keeps the
+parse tree of pages on disk in serialized form, so for unchanged pages
+the parser can be skipped. Parse trees are stored as a marshalled
+token list, see L{TokenParseTree}, which loads much faster than xml. The L{PageLRUCache} keeps recently used
+page objects in memory, so they can be re-used as a whole.
+'''
+
+from __future__ import with_statement
+
+import os
+import marshal
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger('zim.notebook')
+
+import zim
+
+from zim.config import json
+from zim.formats import TokenParseTree
+from zim.utils import OrderedDict
+
+
+#: Version of the cache format, cache is dropped when it does not match.
+#: Includes the zim version because parser changes alter the results.
+CACHE_VERSION = zim.__version__ + '-2'
+
+#: Default size limit for the cache in bytes of serialized data
+MAX_CACHE_SIZE = 50 * 1000 * 1000
+
+#: Default number of pages kept in memory by the L{PageLRUCache}
+MAX_CACHED_PAGES = 100
+
+#: Default limit for the size of page sources kept in memory by the
+#: L{PageLRUCache} in bytes
+MAX_CACHED_PAGES_MEMORY = 10 * 1000 * 1000
+
+
+class PageLRUCache(object):
+	'''Keeps strong references to the most recently used pages. The
+	notebook only keeps weak references to pages, so without this
+	cache a page and its parse tree are dropped as soon as it is no
+	longer used. Bulk operations that get the same pages repeatedly
+	would then read and parse these pages again and again.
+
+	The cache is limited both by the number of pages and by the
+	approximate memory used. Memory usage is estimated by the size of
+	the page source for pages that have their content loaded.
+
+	Methods can be called from multiple threads.
+
+	@ivar max_pages: maximum number of pages
+	@ivar max_memory: maximum memory usage in bytes
+	@ivar hits: number of lookups that found a page in the cache
+	@ivar misses: number of lookups that did not find a page
+	'''
+
+	def __init__(self, max_pages=MAX_CACHED_PAGES, max_memory=MAX_CACHED_PAGES_MEMORY):
+		self.max_pages = max_pages
+		self.max_memory = max_memory
+		self.hits = 0
+		self.misses = 0
+		self._pages = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._pages)
+
+	def __contains__(self, name):
+		return name in self._pages
+
+	@property
+	def memory(self):
+		'''Approximate memory used by the cached pages in bytes'''
+		return sum(page._source_size for page in self._pages.values())
+
+	def add(self, page):
+		'''Add a page or mark it as most recently used
+		@param page: a L{Page} object
+		'''
+		with self._lock:
+			self._pages.pop(page.name, None)
+			self._pages[page.name] = page
+			self._prune()
+
+	def discard(self, name):
+		'''Remove a page from the cache
+		@param name: the page name
+		'''
+		with self._lock:
+			self._pages.pop(name, None)
+
+	def clear(self):
+		'''Remove all pages from the cache'''
+		with self._lock:
+			self._pages.clear()
+
+	def _prune(self):
+		names = list(self._pages) # least recently used first
+		while len(names) > self.max_pages:
+			self._pages.pop(names.pop(0))
+
+		memory = self.memory
+		while memory > self.max_memory and len(names) > 1:
+			memory -= self._pages.pop(names.pop(0))._source_size
+
+
+class ParseTreeCache(object):
+	'''Cache of serialized parse trees for pages. Entries are keyed by
+	page name and the md5 sum of the page source, which is part of the
+	etag of the source file. Therefore an entry is only used when the
+	page source is exactly the same as when it was parsed.
+
+	When the total size of all entries grows beyond C{max_size}, the
+	least recently used entries are dropped.
+
+	Errors in the cache are logged and disable the cache, they are not
+	fatal. Methods can be called from multiple threads.
+
+	@ivar readonly: if C{True} the cache is not modified, neither by
+	adding entries nor by updating the access time of entries. Used in
+	worker processes, so only the main process writes to the cache.
+	'''
+
+	def __init__(self, dbpath, max_size=MAX_CACHE_SIZE):
+		'''Constructor
+		@param dbpath: a file path for the sqlite db, or C{":memory:"}
+		@param max_size: size limit in bytes
+		'''
+		self.dbpath = dbpath
+		self.max_size = max_size
+		self.readonly = False
+		self._lock = threading.Lock()
+		self._pid = None
+		self._db = None
+		self._size = 0
+		self._clock = 0
+		try:
+			self._db_open()
+		except sqlite3.DatabaseError:
+			logger.warning('Overwriting possibly corrupt cache: %s', dbpath)
+			try:
+				if self._db is not None:
+					self._db.close()
+				os.remove(dbpath)
+				self._db_open()
+			except:
+				logger.exception('Could not open parse tree cache')
+				self._db = None
+
+	def _db_open(self):
+		self._pid = os.getpid()
+		self._db = sqlite3.Connection(self.dbpath, check_same_thread=False)
+		self._db.execute('PRAGMA synchronous=OFF')
+		self._db.execute('PRAGMA journal_mode=MEMORY')
+			# Data can be recovered by parsing again, so no need to
+			# wait for disk writes
+
+		try:
+			row = self._db.execute(
+				'SELECT value FROM zim_cache WHERE key = "version"'
+			).fetchone()
+		except sqlite3.OperationalError:
+			row = None
+
+		if row is None or row[0] != CACHE_VERSION:
+			logger.debug('(Re-)Initializing parse tree cache')
+			self._db.executescript('''
+				DROP TABLE IF EXISTS zim_cache;
+				DROP TABLE IF EXISTS parsetrees;
+				CREATE TABLE zim_cache (
+					key TEXT PRIMARY KEY,
+					value TEXT
+				);
+				CREATE TABLE parsetrees (
+					name TEXT PRIMARY KEY,
+					md5 BLOB,
+					atime INTEGER,
+					size INTEGER,
+					meta TEXT,
+					tree BLOB
+				);
+				CREATE INDEX parsetrees_atime ON parsetrees(atime);
+			''')
+			self._db.execute(
+				'INSERT INTO zim_cache VALUES ("version", ?)',
+				(CACHE_VERSION,)
+			)
+			self._db.commit()
+
+		self._size, self._clock = self._db.execute(
+			'SELECT SUM(size), MAX(atime) FROM parsetrees'
+		).fetchone()
+		self._size = self._size or 0
+		self._clock = self._clock or 0
+
+	def _check_pid(self):
+		# A connection can not be shared with a forked process, e.g.
+		# a worker process during export, so open a new one
+		if self._db is not None and self._pid != os.getpid() \
+		and self.dbpath != ':memory:':
+			try:
+				self._db_open()
+			except sqlite3.Error:
+				self._on_error()
+
+	def _on_error(self):
+		logger.exception('Error in parse tree cache, cache disabled')
+		try:
+			self._db.close()
+		except:
+			pass
+		self._db = None
+
+	def get(self, name, md5):
+		'''Get a parse tree from the cache
+		@param name: the page name
+		@param md5: the md5 digest of the page source
+		@returns: a L{ParseTree} or C{None}
+		'''
+		with self._lock:
+			self._check_pid()
+			if self._db is None:
+				return None
+
+			try:
+				row = self._db.execute(
+					'SELECT md5, meta, tree FROM parsetrees WHERE name = ?',
+					(name,)
+				).fetchone()
+				if row is None or str(row[0]) != md5:
+					return None
+
+				if not self.readonly:
+					self._clock += 1
+					self._db.execute(
+						'UPDATE parsetrees SET atime = ? WHERE name = ?',
+						(self._clock, name)
+					)
+					self._db.commit()
+			except sqlite3.Error:
+				self._on_error()
+				return None
+
+		tree = TokenParseTree(marshal.loads(str(row[2])))
+		for key, value in json.loads(row[1]):
+			tree.meta[key] = value
+		return tree
+
+	def set(self, name, md5, tree):
+		'''Store a parse tree in the cache
+		@param name: the page name
+		@param md5: the md5 digest of the page source
+		@param tree: a L{ParseTree}
+		'''
+		if self.readonly:
+			return
+
+		try:
+			data = marshal.dumps(tree.totokens())
+		except ValueError:
+			# attributes that are not basic types, should not happen
+			# for a freshly parsed page
+			logger.debug('Could not serialize parse tree for: %s', name)
+			return
+		meta = json.dumps(tree.meta.items())
+		size = len(data) + len(meta)
+
+		with self._lock:
+			self._check_pid()
+			if self._db is None:
+				return
+
+			try:
+				row = self._db.execute(
+					'SELECT size FROM parsetrees WHERE name = ?', (name,)
+				).fetchone()
+				if row is not None:
+					self._size -= row[0]
+
+				self._clock += 1
+				self._db.execute(
+					'INSERT OR REPLACE INTO '
+					'parsetrees(name, md5, atime, size, meta, tree) '
+					'VALUES (?, ?, ?, ?, ?, ?)',
+					(name, sqlite3.Binary(md5), self._clock, size, meta, sqlite3.Binary(data))
+				)
+				self._size += size
+				if self._size > self.max_size:
+					self._prune()
+				self._db.commit()
+			except sqlite3.Error:
+				self._on_error()
+
+	def _prune(self):
+		# Drop the least recently used entries, make some room to
+		# avoid pruning on every insert
+		target = self.max_size * 0.8
+		drop = []
+		for name, size in self._db.execute(
+			'SELECT name, size FROM parsetrees ORDER BY atime'
+		):
+			if self._size <= target:
+				break
+			drop.append((name,))
+			self._size -= size
+
+		logger.debug('Dropping %i parse trees from cache', len(drop))
+		self._db.executemany('DELETE FROM parsetrees WHERE name = ?', drop)
+
+	def clear(self):
+		'''Remove all entries from the cache'''
+		with self._lock:
+			if self._db is None:
+				return
+
+			try:
+				self._db.execute('DELETE FROM parsetrees')
+				self._db.commit()
+				self._size = 0
+			except sqlite3.Error:
+				self._on_error()
+
+	def close(self):
+		'''Close the cache database'''
+		with self._lock:
+			if self._db is not None:
+				self._db.close()
+				self._db = None
@@ -7,6 +7,8 @@ from __future__ import with_statement
 
 
 import sqlite3
+import thread
+import threading
 import logging
 
 logger = logging.getLogger('zim.notebook.index')
@@ -17,7 +19,8 @@ except ImportError:
 	gobject = None
 
 
-from zim.newfs import LocalFile, File, Folder, FileNotFoundError
+from zim.newfs import LocalFile, LocalFolder, File, Folder, FileNotFoundError
+from zim.newfs.helpers import FolderTreeMonitor
 from zim.signals import SignalEmitter
 
 from zim.notebook.operations import NotebookOperation, NotebookOperationOngoing, ongoing_operation
@@ -27,9 +30,115 @@ from .base import *
 from .pages import *
 from .links import *
 from .tags import *
+from .content import *
+from .parsepool import ParserPool
 
 
-DB_VERSION = '0.7'
+DB_VERSION = '0.9'
+
+MONITOR_FLUSH_DELAY = 500 # ms - collect file monitor events before updating
+
+
+class ThreadLocalConnection(object):
+	'''Wrapper for the index database connection that gives each
+	thread its own C{sqlite3.Connection}. The thread that creates the
+	object uses the main connection, which is also used for all
+	updates of the index. Other threads, like the workers of a threaded
+	web server, get their own connection on first use. These threads
+	should only read from the index; they see changes once they are
+	committed by the main thread.
+
+	For an in-memory database all threads share the main connection,
+	because a new connection would open a new, empty database.
+
+	Connections for other threads are kept open until
+	L{close_thread_connections()} is called, e.g. when the web server
+	shuts down.
+	'''
+
+	def __init__(self, dbpath):
+		'''Constructor
+		@param dbpath: a file path for the sqlite db, or C{":memory:"}
+		'''
+		self.dbpath = dbpath
+		self._shared = dbpath == ':memory:'
+		self._main = self._connect(check_same_thread=not self._shared)
+		self._main_thread = thread.get_ident()
+		self._local = threading.local()
+		self._connections = [] # connections for other threads
+		self._lock = threading.Lock()
+
+	def _connect(self, check_same_thread=True):
+		db = sqlite3.Connection(self.dbpath, check_same_thread=check_same_thread)
+		db.row_factory = sqlite3.Row
+		db.execute('PRAGMA synchronous=OFF;')
+		# Don't wait for disk writes, we can recover from crashes
+		# anyway. Allows us to use commit more frequently.
+		return db
+
+	@property
+	def connection(self):
+		'''The C{sqlite3.Connection} for the current thread'''
+		if self._shared or thread.get_ident() == self._main_thread:
+			return self._main
+
+		try:
+			return self._local.db
+		except AttributeError:
+			logger.debug('New index connection for thread: %s',
+				threading.current_thread().name)
+			db = self._connect(check_same_thread=False)
+				# only used by this thread, but closed by the main thread
+			with self._lock:
+				self._connections.append(db)
+			self._local.db = db
+			return db
+
+	def close_thread_connections(self):
+		'''Close the connections of all threads other than the main
+		thread. Should only be called when these threads are done using
+		the index, e.g. after they have been joined. A thread that uses
+		the index again afterwards gets a new connection.
+		'''
+		with self._lock:
+			connections, self._connections = self._connections, []
+			self._local = threading.local()
+
+		for db in connections:
+			try:
+				db.close()
+			except sqlite3.Error:
+				logger.exception('Could not close index connection')
+
+	def reopen_after_fork(self):
+		'''Open a new main connection, must be called in a child
+		process after a fork before using the index. A sqlite connection
+		can not be used across a fork, so the inherited connections are
+		abandoned. They are not closed, because that could interfere
+		with the connection in the parent process.
+		'''
+		if not self._shared:
+			self._forked = (self._main, self._connections)
+			self._main = self._connect()
+			self._main_thread = thread.get_ident()
+			self._local = threading.local()
+			self._connections = []
+			self._lock = threading.Lock()
+
+	def execute(self, *args):
+		return self.connection.execute(*args)
+
+	def executemany(self, *args):
+		return self.connection.executemany(*args)
+
+	def executescript(self, *args):
+		return self.connection.executescript(*args)
+
+	def commit(self):
+		return self.connection.commit()
+
+	def __getattr__(self, name):
+		return getattr(self.connection, name)
 
 
 class Index(SignalEmitter):
@@ -73,6 +182,10 @@ class Index(SignalEmitter):
 		self._checker = FilesIndexChecker(self._db, self.layout.root)
 		self.background_check = BackgroundCheck(self._checker, None)
 
+		self._file_monitor = None
+		self._monitor_queue = {}
+		self._monitor_timeout = None
+
 	def _update_iter_init(self):
 		self.update_iter = IndexUpdateIter(self._db, self.layout)
 		self.update_iter.connect('commit', self.on_commit)
@@ -81,13 +194,22 @@ class Index(SignalEmitter):
 	def on_commit(self, iter):
 		self.emit('changed')
 
+	def reopen_after_fork(self):
+		'''Open a new database connection, must be called in a child
+		process after a fork, e.g. in a worker process, before using
+		the index. See L{ThreadLocalConnection.reopen_after_fork()}.
+		'''
+		self._db.reopen_after_fork()
+
+	def close_thread_connections(self):
+		'''Close the database connections opened for threads other
+		than the main thread. See
+		L{ThreadLocalConnection.close_thread_connections()}.
+		'''
+		self._db.close_thread_connections()
+
 	def _new_connection(self):
-		db = sqlite3.Connection(self.dbpath)
-		db.row_factory = sqlite3.Row
-		db.execute('PRAGMA synchronous=OFF;')
-		# Don't wait for disk writes, we can recover from crashes
-		# anyway. Allows us to use commit more frequently.
-		return db
+		return ThreadLocalConnection(self.dbpath)
 
 	def _db_check(self):
 		try:
@@ -119,10 +241,11 @@ class Index(SignalEmitter):
 	def _db_init(self):
 		tables = [r[0] for r in self._db.execute(
 			'SELECT name FROM sqlite_master '
-			'WHERE type="table" and name NOT LIKE "sqlite%"'
-		)]
+			'WHERE type="table" and name NOT LIKE "sqlite%" '
+			'ORDER BY sql LIKE "CREATE VIRTUAL%" DESC'
+		)] # Drop virtual tables first, they also drop their own data tables
 		for table in tables:
-			self._db.execute('DROP TABLE %s' % table)
+			self._db.execute('DROP TABLE IF EXISTS %s' % table)
 
 		logger.debug('(Re-)Initializing database for index')
 		self._db.executescript('''
@@ -193,36 +316,119 @@ class Index(SignalEmitter):
 		)
 
 	def start_background_check(self, notebook):
+		if self._file_monitor and self._file_monitor.running:
+			return # changes are picked up by the file monitor
+
+		# Start monitoring first, the full check is still needed to find
+		# changes made while the notebook was not open
+		self.start_file_monitor()
 		self.check_async(notebook, [Path(':')], recursive=True)
 
 	def stop_background_check(self):
 		self.background_check.stop()
+		self.stop_file_monitor()
+
+	def start_file_monitor(self):
+		'''Start monitoring the notebook folder for changes made by
+		other applications. Changed files are updated with
+		L{update_file()}, so no full check is needed to keep the index
+		up to date. Requires the C{gio} library and a local folder.
+		@returns: C{True} when the monitor is running
+		'''
+		if not (gobject and FolderTreeMonitor.is_supported()
+			and isinstance(self.layout.root, LocalFolder)
+		):
+			return False
+
+		if self._file_monitor is None:
+			self._file_monitor = FolderTreeMonitor(self.layout.root)
+			self._file_monitor.connect('changed', self._on_file_monitor_event)
+			self._file_monitor.connect('removed', self._on_file_monitor_event)
+		return self._file_monitor.start()
+
+	def stop_file_monitor(self):
+		'''Stop the file monitor started by L{start_file_monitor()}'''
+		if self._file_monitor:
+			self._file_monitor.stop()
+		if self._monitor_timeout:
+			gobject.source_remove(self._monitor_timeout)
+			self._monitor_timeout = None
+		self._monitor_queue.clear()
+
+	def _on_file_monitor_event(self, monitor, file):
+		# Events come in bursts, e.g. "created" followed by "changed",
+		# or a whole folder being removed, so collect before updating
+		self._monitor_queue[file.path] = file
+		if self._monitor_timeout is None:
+			self._monitor_timeout = gobject.timeout_add(
+				MONITOR_FLUSH_DELAY, self._flush_monitor_queue)
+
+	def _flush_monitor_queue(self):
+		self._monitor_timeout = None
+		queue, self._monitor_queue = self._monitor_queue, {}
+		for path in sorted(queue): # parents before children
+			file = queue[path]
+			try:
+				if self._is_uptodate_file(file):
+					continue # e.g. page was stored by us
+				self.update_file(file)
+			except:
+				logger.exception('Error while updating index for: %s', file)
+		return False # only run once
+
+	def _is_uptodate_file(self, file):
+		if not file.exists():
+			return False
+		row = self._db.execute(
+			'SELECT mtime FROM files WHERE path=?',
+			(file.relpath(self.layout.root),)
+		).fetchone()
+		return row is not None and row[0] == file.mtime()
 
 	def update_file(self, file):
 		if not file.exists():
 			return self.remove_file(file)
-
-		path = file.relpath(self.layout.root)
-		row = self._db.execute('SELECT id FROM files WHERE path=?', (path,)).fetchone()
-
+		else:
+			self.update_files([file])
+
+	def update_files(self, files):
+		'''Update the index for a number of files at once. Like calling
+		L{update_file()} for each file, but all changes are committed
+		in a single transaction and "changed" is emitted only once.
+		@param files: a list of L{File} and L{Folder} objects, files
+		that no longer exist are removed from the index
+		'''
 		filesindexer = self.update_iter.files
 		filesindexer.emit('start-update')
 
-		if row:
-			node_id = row[0]
-			if isinstance(file, File):
-				filesindexer.update_file(node_id, file)
-			elif isinstance(file, Folder):
-				filesindexer.update_folder(node_id, file)
-			else:
-				raise TypeError
-		else:
-			if isinstance(file, File):
-				filesindexer.interactive_add_file(file)
-			elif isinstance(file, Folder):
-				filesindexer.interactive_add_folder(file)
+		for file in files:
+			path = file.relpath(self.layout.root)
+			row = self._db.execute('SELECT id FROM files WHERE path=?', (path,)).fetchone()
+
+			if not file.exists():
+				if row is None:
+					pass
+				elif isinstance(file, File):
+					filesindexer.delete_file(row[0])
+				elif isinstance(file, Folder):
+					filesindexer.delete_folder(row[0])
+				else:
+					raise TypeError
+			elif row:
+				node_id = row[0]
+				if isinstance(file, File):
+					filesindexer.update_file(node_id, file)
+				elif isinstance(file, Folder):
+					filesindexer.update_folder(node_id, file)
+				else:
+					raise TypeError
 			else:
-				raise TypeError
+				if isinstance(file, File):
+					filesindexer.interactive_add_file(file)
+				elif isinstance(file, Folder):
+					filesindexer.interactive_add_folder(file)
+				else:
+					raise TypeError
 
 		filesindexer.emit('finish-update')
 		self._db.commit()
@@ -299,18 +505,49 @@ class IndexUpdateIter(SignalEmitter):
 		self.pages = PagesIndexer(db, layout, self.files)
 		self.links = LinksIndexer(db, self.pages, self.files)
 		self.tags = TagsIndexer(db, self.pages, self.files)
+		self.content = ContentIndexer(db, self.pages)
 
-	def __call__(self):
-		return self
+	def __call__(self, bulk=None):
+		'''Returns an iterator for the update
+		@param bulk: if C{True} the update uses bulk mode, see
+		L{FilesIndexer.update_iter()}, if C{None} bulk mode is used
+		when the index is still empty
+		'''
+		return self._update_iter(bulk)
 
 	def __iter__(self):
-		for i in self.files.update_iter():
+		return self._update_iter(None)
+
+	def _update_iter(self, bulk):
+		for i in self._files_update_iter(bulk):
 			yield
 		self.emit('commit')
 
-	def update(self):
+	def _files_update_iter(self, bulk=None):
+		if bulk is None:
+			# First time indexing, index is not usable before it is
+			# complete anyway
+			bulk = self.files.is_empty()
+
+		if bulk and ParserPool.is_supported():
+			return self._files_update_iter_with_pool()
+		else:
+			return self.files.update_iter(bulk=bulk)
+
+	def _files_update_iter_with_pool(self):
+		# Parse pages in worker processes, the pages indexer
+		# picks up the results when it handles the file
+		self.pages.parser_pool = ParserPool(self.db, self.layout)
+		try:
+			for i in self.files.update_iter(bulk=True):
+				yield
+		finally:
+			self.pages.parser_pool.close()
+			self.pages.parser_pool = None
+
+	def update(self, bulk=None):
 		'''Convenience method to do a full update at once'''
-		for i in self.files.update_iter():
+		for i in self._files_update_iter(bulk):
 			pass
 		self.emit('commit')
 
@@ -325,7 +562,7 @@ class IndexUpdateIter(SignalEmitter):
 		for out_of_date in checker.check_iter():
 			yield
 			if out_of_date:
-				for i in self.files.update_iter():
+				for i in self._files_update_iter():
 					yield
 		self.emit('commit')
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2009-2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+from __future__ import with_statement
+
+import sqlite3
+import logging
+
+logger = logging.getLogger('zim.notebook.index')
+
+
+from .base import IndexerBase, IndexView
+from .pages import PageIndexRecord
+
+
+# The full text index uses the "unicode61" tokenizer because it does
+# case folding for all of unicode, the "simple" tokenizer only folds
+# ASCII. Diacritics are kept and "_" is a word character to stay as
+# close as possible to the "\w" definition used by the search regexes.
+# If the sqlite library does not support this, the table is not created
+# and search falls back to reading all pages.
+
+FULLTEXT_TABLE = 'fulltext'
+
+_CREATE_FULLTEXT_TABLE = '''
+	CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts4(
+		content,
+		tokenize=unicode61 "remove_diacritics=0" "tokenchars=_"
+	);
+''' % FULLTEXT_TABLE
+
+
+def has_fulltext_table(db):
+	'''Returns C{True} if the full text table exists in the database'''
+	row = db.execute(
+		'SELECT name FROM sqlite_master WHERE type="table" and name=?',
+		(FULLTEXT_TABLE,)
+	).fetchone()
+	return row is not None
+
+
+class ContentIndexer(IndexerBase):
+	'''Indexer for the "fulltext" table that keeps the text of all
+	pages in a sqlite "fts4" table. The table uses the page id as
+	"docid", so results can be joined with the "pages" table.
+	'''
+
+	__signals__ = {}
+
+	def __init__(self, db, pagesindexer):
+		IndexerBase.__init__(self, db)
+		try:
+			self.db.execute(_CREATE_FULLTEXT_TABLE)
+		except sqlite3.OperationalError:
+			logger.info('Full text index not supported by sqlite - content search will be slow')
+		else:
+			self.connectto_all(pagesindexer, (
+				'page-changed', 'page-row-deleted'
+			))
+
+	def on_page_changed(self, o, row, doc):
+		self.db.execute(
+			'DELETE FROM %s WHERE docid=?' % FULLTEXT_TABLE,
+			(row['id'],)
+		)
+		if row['source_file'] is not None:
+			# Also index empty pages, the table doubles as the list
+			# of pages that have content
+			self.db.execute(
+				'INSERT INTO %s(docid, content) VALUES (?, ?)' % FULLTEXT_TABLE,
+				(row['id'], u'\n'.join(doc.iter_text()))
+			)
+
+	def on_page_row_deleted(self, o, row):
+		self.db.execute(
+			'DELETE FROM %s WHERE docid=?' % FULLTEXT_TABLE,
+			(row['id'],)
+		)
+
+
+class ContentView(IndexView):
+	'''Index view that exposes the full text index of page contents'''
+
+	@property
+	def available(self):
+		'''C{True} when the full text index is supported and can be
+		queried with L{match()}
+		'''
+		return has_fulltext_table(self.db)
+
+	def list_pages(self):
+		'''Generator for all pages in the full text index
+		@returns: yields L{PageIndexRecord} objects
+		'''
+		for row in self.db.execute(
+			'SELECT pages.* FROM %s '
+			'INNER JOIN pages ON pages.id = %s.docid '
+			'ORDER BY pages.name' % (FULLTEXT_TABLE, FULLTEXT_TABLE)
+		):
+			yield PageIndexRecord(row)
+
+	def match(self, query):
+		'''Generator for pages matching a full text query
+		@param query: a query in the sqlite "fts4" query syntax,
+		e.g. C{'"foo"'} for a word or C{'"foo*"'} for a prefix
+		@returns: yields 2-tuples of a L{PageIndexRecord} and the number
+		of matching tokens in the page
+		'''
+		for row in self.db.execute(
+			'SELECT pages.*, offsets(%s) AS offsets FROM %s '
+			'INNER JOIN pages ON pages.id = %s.docid '
+			'WHERE %s MATCH ? '
+			'ORDER BY pages.name' % ((FULLTEXT_TABLE,) * 4),
+			(query,)
+		):
+			# offsets() gives 4 integers per matching token
+			yield PageIndexRecord(row), len(row['offsets'].split()) // 4
@@ -1,6 +1,7 @@
 
 
 import os
+import time
 import logging
 
 logger = logging.getLogger('zim.notebook.index')
@@ -22,6 +23,10 @@ STATUS_NEED_DELETION = 3
 TYPE_FOLDER = 1
 TYPE_FILE = 2
 
+# Commit intervals for bulk update mode
+BULK_COMMIT_N_FILES = 1000 # number of files
+BULK_COMMIT_INTERVAL = 0.5 # seconds
+
 from zim.newfs import File, Folder
 from zim.signals import SignalEmitter
 
@@ -57,6 +62,7 @@ class FilesIndexer(SignalEmitter):
 	def __init__(self, db, folder):
 		self.db = db
 		self.folder = folder
+		self._done = None # ids updated or deleted in a bulk update pass
 
 		self.db.executescript('''
 		CREATE TABLE IF NOT EXISTS files(
@@ -69,6 +75,8 @@ class FilesIndexer(SignalEmitter):
 
 			index_status INTEGER DEFAULT 3
 		);
+		CREATE INDEX IF NOT EXISTS files_parent ON files(parent);
+		CREATE INDEX IF NOT EXISTS files_index_status ON files(index_status);
 		''')
 		row = self.db.execute('SELECT * FROM files WHERE id == 1').fetchone()
 		if row is None:
@@ -79,10 +87,26 @@ class FilesIndexer(SignalEmitter):
 			)
 			assert c.lastrowid == 1 # ensure we start empty
 
-	def update_iter(self):
-		'''Generator function for the actual update'''
+	def is_empty(self):
+		'''Returns C{True} if nothing has been indexed yet'''
+		row = self.db.execute(
+			'SELECT id FROM files WHERE id > 1 LIMIT 1'
+		).fetchone()
+		return row is None
+
+	def update_iter(self, bulk=False):
+		'''Generator function for the actual update
+		@param bulk: if C{True} use bulk mode, which processes the
+		queue of pending files in passes and commits in batches. This
+		is intended for (re-)indexing the whole notebook, where the
+		index is not used before the update is complete.
+		'''
 		self.emit('start-update')
-		for i in self._update_iter_inner():
+		if bulk:
+			inner = self._bulk_update_iter_inner()
+		else:
+			inner = self._update_iter_inner()
+		for i in inner:
 			yield
 		self.emit('finish-update')
 
@@ -104,29 +128,75 @@ class FilesIndexer(SignalEmitter):
 			else:
 				break
 
-			try:
-				if node_type == TYPE_FOLDER:
-					folder = self.folder.folder(path)
-					if folder.exists():
-						self.update_folder(node_id, folder)
-					else:
-						self.delete_folder(node_id)
-				else:
-					file = self.folder.file(path)
-					if file.exists():
-						self.update_file(node_id, file)
-					else:
-						self.delete_file(node_id)
-			except:
-				logger.exception('Error while indexing: %s', path)
-				self.db.execute( # avoid looping
-					'UPDATE files SET index_status = ? WHERE id = ?',
-					(STATUS_UPTODATE, node_id)
-				)
-
+			self._update_node(node_id, path, node_type)
 			self.db.commit()
 			yield
 
+	def _bulk_update_iter_inner(self):
+		# Each pass takes all pending rows with a single query, instead
+		# of a query per file. Folders sort before files, so sub-folders
+		# found in a pass are picked up by the next pass. Updating a
+		# folder can update or delete rows later in the same pass, these
+		# are recorded in "_done" and skipped. Commit in batches of files
+		# or time, whichever comes first.
+		n_updated = 0
+		last_commit = time.time()
+		try:
+			while True:
+				rows = self.db.execute(
+					'SELECT id, path, node_type FROM files'
+					' WHERE index_status = ?'
+					' ORDER BY node_type, id',
+					(STATUS_NEED_UPDATE,)
+				).fetchall()
+				if not rows:
+					break
+
+				self._done = done = set()
+				for node_id, path, node_type in rows:
+					if node_id in done:
+						continue # dropped or updated earlier in this pass
+
+					self._update_node(node_id, path, node_type)
+
+					n_updated += 1
+					if n_updated >= BULK_COMMIT_N_FILES \
+					or time.time() - last_commit > BULK_COMMIT_INTERVAL:
+						self.db.commit()
+						n_updated = 0
+						last_commit = time.time()
+
+					yield
+		finally:
+			self._done = None
+
+		self.db.commit()
+
+	def _set_done(self, ids):
+		if self._done is not None:
+			self._done.update(ids)
+
+	def _update_node(self, node_id, path, node_type):
+		try:
+			if node_type == TYPE_FOLDER:
+				folder = self.folder.folder(path)
+				if folder.exists():
+					self.update_folder(node_id, folder)
+				else:
+					self.delete_folder(node_id)
+			else:
+				file = self.folder.file(path)
+				if file.exists():
+					self.update_file(node_id, file)
+				else:
+					self.delete_file(node_id)
+		except:
+			logger.exception('Error while indexing: %s', path)
+			self.db.execute( # avoid looping
+				'UPDATE files SET index_status = ? WHERE id = ?',
+				(STATUS_UPTODATE, node_id)
+			)
+
 	def interactive_add_file(self, file):
 		assert isinstance(file, File) and file.exists()
 		parent_id = self._add_parent(file.parent())
@@ -204,36 +274,46 @@ class FilesIndexer(SignalEmitter):
 			children[childpath] = (child_id, mtime)
 
 		mtime = folder.mtime() # get mtime before getting contents
+		uptodate = []
+		needupdate = []
+		new_files = []
+		new_folders = []
 		for child in folder:
 			path = child.relpath(self.folder)
 			if path in children:
 				child_id, child_mtime = children[path]
 				if child.mtime() == child_mtime:
-					self.set_node_uptodate(child_id, child_mtime)
+					uptodate.append((STATUS_UPTODATE, child_mtime, child_id))
 				else:
-					self.db.execute(
-						'UPDATE files SET index_status = ? WHERE id = ?',
-						(STATUS_NEED_UPDATE, child_id)
-					)
+					needupdate.append((STATUS_NEED_UPDATE, child_id))
+			elif isinstance(child, File):
+				new_files.append((path, TYPE_FILE, STATUS_NEED_UPDATE, node_id))
 			else:
-				# new child
-				node_type = TYPE_FILE if isinstance(child, File) else TYPE_FOLDER
-				if node_type == TYPE_FILE:
-					self.db.execute(
-						'INSERT INTO files(path, node_type, index_status, parent)'
-						' VALUES (?, ?, ?, ?)',
-						(path, node_type, STATUS_NEED_UPDATE, node_id),
-					)
-					row = self.db.execute(
-						'SELECT * FROM files WHERE path=?', (path,)
-					).fetchone()
+				new_folders.append((path, TYPE_FOLDER, STATUS_NEED_UPDATE, node_id))
+
+		self.db.executemany(
+			'UPDATE files SET index_status = ?, mtime = ? WHERE id = ?',
+			uptodate
+		)
+		self._set_done(r[2] for r in uptodate)
+		self.db.executemany(
+			'UPDATE files SET index_status = ? WHERE id = ?',
+			needupdate
+		)
+		self.db.executemany(
+			'INSERT INTO files(path, node_type, index_status, parent)'
+			' VALUES (?, ?, ?, ?)',
+			new_files + new_folders
+		)
+		if new_files:
+			new_paths = set(r[0] for r in new_files)
+			for row in self.db.execute(
+				'SELECT * FROM files WHERE parent = ? and node_type = ?'
+				' ORDER BY id',
+				(node_id, TYPE_FILE)
+			).fetchall():
+				if row['path'] in new_paths:
 					self.emit('file-row-inserted', row)
-				else:
-					self.db.execute(
-						'INSERT INTO files(path, node_type, index_status, parent)'
-						' VALUES (?, ?, ?, ?)',
-						(path, node_type, STATUS_NEED_UPDATE, node_id),
-					)
 
 		# Clean up nodes not found in listing
 		for child_id, child_type in self.db.execute(
@@ -260,12 +340,14 @@ class FilesIndexer(SignalEmitter):
 			'UPDATE files SET index_status = ?, mtime = ? WHERE id = ?',
 			(STATUS_UPTODATE, mtime, node_id)
 		)
+		self._set_done((node_id,))
 
 	def delete_file(self, node_id):
 		row = self.db.execute('SELECT * FROM files WHERE id=?', (node_id,)).fetchone()
 		logger.debug('Drop file: %s', row['path'])
 		self.emit('file-row-deleted', row)
 		self.db.execute('DELETE FROM files WHERE id == ?', (node_id,))
+		self._set_done((node_id,))
 
 	def delete_folder(self, node_id):
 		for child_id, child_type in self.db.execute(
@@ -280,6 +362,7 @@ class FilesIndexer(SignalEmitter):
 		row = self.db.execute('SELECT * FROM files WHERE id=?', (node_id,)).fetchone()
 		logger.debug('Drop folder: %s', row['path'])
 		self.db.execute('DELETE FROM files WHERE id == ?', (node_id,))
+		self._set_done((node_id,))
 
 
 class FilesIndexChecker(object):
@@ -4,18 +4,24 @@
 
 from __future__ import with_statement
 
+import sqlite3
 import logging
+import threading
+import collections
+
+from array import array
 
 logger = logging.getLogger('zim.notebook.index')
 
 
 from zim.utils import natural_sort_key
+from zim.signals import ConnectorMixin
 from zim.notebook.page import Path, HRef, \
 	HREF_REL_ABSOLUTE, HREF_REL_FLOATING, HREF_REL_RELATIVE
 
 
-from .base import IndexerBase, IndexView
-from .pages import PagesViewInternal, ROOT_ID
+from .base import IndexerBase, IndexView, IndexNotFoundError
+from .pages import PagesViewInternal, PageIndexRecord, ROOT_ID
 
 
 LINK_DIR_FORWARD = 1 #: Constant for forward links
@@ -42,6 +48,77 @@ LINK_DIR_BOTH = 3 #: Constant for links in any direction
 # re-calculate all links on every page index to ensure the outcome.)
 
 
+# The neighbourhood of a page is queried with a recursive "WITH" clause,
+# which is not supported by sqlite < 3.8.3, for older versions the
+# neighbourhood is expanded in python instead.
+#
+# The "reach" table has all pages that can be reached within "depth"
+# steps, the "nodes" table has the shortest distance for each page,
+# capped by "limit". Links from the placeholder hack are excluded.
+
+_HAS_RECURSIVE_WITH = sqlite3.sqlite_version_info >= (3, 8, 3)
+
+_neighbourhood_step = {
+	LINK_DIR_FORWARD:
+		'SELECT links.target, reach.depth + 1 FROM reach '
+		'JOIN links ON links.source = reach.id ',
+	LINK_DIR_BACKWARD:
+		'SELECT links.source, reach.depth + 1 FROM reach '
+		'JOIN links ON links.target = reach.id ',
+	LINK_DIR_BOTH:
+		'SELECT CASE WHEN links.source = reach.id '
+		'THEN links.target ELSE links.source END, reach.depth + 1 FROM reach '
+		'JOIN links ON (links.source = reach.id OR links.target = reach.id) ',
+}
+
+_neighbourhood_sql = \
+	'WITH RECURSIVE reach(id, depth) AS (' \
+		'VALUES(:page_id, 0) UNION %s' \
+		'WHERE reach.depth < :depth AND links.source <> :root' \
+	'), nodes(id, depth) AS (' \
+		'SELECT reach.id, MIN(reach.depth) FROM reach ' \
+		'JOIN pages ON pages.id = reach.id GROUP BY reach.id ' \
+		'ORDER BY MIN(reach.depth), pages.sortkey, pages.name LIMIT :limit' \
+	') '
+
+_neighbourhood_links_forward = \
+	'SELECT links.source, links.target FROM nodes ' \
+	'JOIN links ON links.source = nodes.id ' \
+	'WHERE nodes.depth < :depth AND links.target IN (SELECT id FROM nodes) '
+
+_neighbourhood_links_backward = \
+	'SELECT links.source, links.target FROM nodes ' \
+	'JOIN links ON links.target = nodes.id ' \
+	'WHERE nodes.depth < :depth AND links.source IN (SELECT id FROM nodes) ' \
+	'AND links.source <> :root '
+
+_neighbourhood_links = {
+	LINK_DIR_FORWARD: _neighbourhood_links_forward,
+	LINK_DIR_BACKWARD: _neighbourhood_links_backward,
+	LINK_DIR_BOTH: _neighbourhood_links_forward + 'UNION ' + _neighbourhood_links_backward,
+}
+
+
+# Queries for the links of a page and all its children. The "section"
+# table has the ids of all pages in the section. Only used for a
+# single direction, for LINK_DIR_BOTH links within the section would
+# be counted once instead of once for each end.
+
+_section_sql = \
+	'WITH RECURSIVE section(id) AS (' \
+		'VALUES(:page_id) UNION ALL ' \
+		'SELECT pages.id FROM pages JOIN section ON pages.parent = section.id' \
+	') '
+
+_section_join = {
+	LINK_DIR_FORWARD:
+		'FROM section JOIN links ON links.source = section.id ',
+	LINK_DIR_BACKWARD:
+		'FROM section JOIN links ON links.target = section.id '
+		'WHERE links.source <> :root ',
+}
+
+
 
 class IndexLink(object):
 	'''Class used to represent links between two pages
@@ -76,7 +153,7 @@ class LinksIndexer(IndexerBase):
 			'finish-update'
 		)
 
-		self.db.execute('''
+		self.db.executescript('''
 			CREATE TABLE IF NOT EXISTS links (
 				source INTEGER REFERENCES pages(id),
 				target INTEGER REFERENCES pages(id),
@@ -93,6 +170,9 @@ class LinksIndexer(IndexerBase):
 
 				CONSTRAINT uc_LinkOnce UNIQUE (source, rel, names)
 			);
+			CREATE INDEX IF NOT EXISTS links_target ON links(target);
+			CREATE INDEX IF NOT EXISTS links_needscheck ON links(needscheck);
+			CREATE INDEX IF NOT EXISTS links_anchorkey ON links(anchorkey);
 		''')
 
 	def on_page_changed(self, o, row, doc):
@@ -118,10 +198,11 @@ class LinksIndexer(IndexerBase):
 	def on_page_row_inserted(self, o, row):
 		# Placeholders for pages of the same name need to be
 		# recalculated, flag links to be checked with same anchorkey.
-		self.db.execute( # TODO turn query into a JOIN
+		self.db.execute(
 			'UPDATE links SET needscheck=1 '
-			'WHERE rel=? and anchorkey=? and target in ( '
-			'	SELECT id FROM pages WHERE is_link_placeholder=1 '
+			'WHERE rel=? and anchorkey=? and EXISTS ( '
+			'	SELECT id FROM pages '
+			'	WHERE pages.id=links.target and is_link_placeholder=1 '
 			')',
 			(HREF_REL_FLOATING, row['sortkey'])
 		)
@@ -271,7 +352,21 @@ class LinksView(IndexView):
 		return self._list_links_section(page_id, pagename, direction)
 
 	def _list_links_section(self, page_id, pagename, direction):
-		# Can be optimized with WITH clause, but not supported sqlite < 3.8.4
+		if _HAS_RECURSIVE_WITH and direction in _section_join:
+			c = self.db.execute(
+				_section_sql +
+				'SELECT DISTINCT links.source, links.target ' +
+				_section_join[direction] +
+				'ORDER BY 1, 2',
+				{'page_id': page_id, 'root': ROOT_ID}
+			)
+			records = {page_id: pagename}
+			for source, target in c.fetchall():
+				for id in (source, target):
+					if id not in records:
+						records[id] = self._pages.get_pagename(id)
+				yield IndexLink(records[source], records[target])
+			return
 
 		for link in self._list_links(page_id, pagename, direction):
 			yield link
@@ -281,13 +376,142 @@ class LinksView(IndexView):
 				yield link
 
 	def n_list_links_section(self, pagename, direction=LINK_DIR_FORWARD):
-		# Can be optimized with WITH clause, but not supported sqlite < 3.8.4
 		page_id = self._pages.get_page_id(pagename)
+		if _HAS_RECURSIVE_WITH and direction in _section_join:
+			c = self.db.execute(
+				_section_sql + 'SELECT count(*) ' + _section_join[direction],
+				{'page_id': page_id, 'root': ROOT_ID}
+			)
+			return c.fetchone()[0]
+
 		n = self._n_list_links(page_id, direction)
 		for child in self._pages.walk(page_id):
 			n += self._n_list_links(child.id, direction)
 		return n
 
+	def list_neighbourhood(self, pagename, depth=1, direction=LINK_DIR_BOTH, max_pages=None):
+		'''List pages in the neighbourhood of a page, these are the
+		pages that can be reached by following at most C{depth} links
+
+		@param pagename: the L{Path} for the page at the center
+		@param depth: the maximum number of links to follow
+		@param direction: the link direction to follow, see
+		L{list_links()}
+		@param max_pages: maximum number of pages to return, pages
+		closest to C{pagename} go first. If C{None} there is no maximum.
+		@returns: a list of 2-tuples of a L{PageIndexRecord} and the
+		distance to C{pagename}, sorted by distance. The first item is
+		C{pagename} itself with distance 0.
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		page_id = self._pages.get_page_id(pagename) # can raise IndexNotFoundError
+		return self._list_neighbourhood(page_id, depth, direction, max_pages)
+
+	def _list_neighbourhood(self, page_id, depth, direction, max_pages):
+		if not _HAS_RECURSIVE_WITH:
+			return self._list_neighbourhood_fallback(page_id, depth, direction, max_pages)
+
+		c = self.db.execute(
+			_neighbourhood_sql % _neighbourhood_step[direction] +
+			'SELECT pages.*, nodes.depth AS distance FROM nodes '
+			'JOIN pages ON pages.id = nodes.id '
+			'ORDER BY nodes.depth, pages.sortkey, pages.name',
+			self._neighbourhood_params(page_id, depth, max_pages)
+		)
+		return [(PageIndexRecord(row), row['distance']) for row in c]
+
+	def list_links_neighbourhood(self, pagename, depth=1, direction=LINK_DIR_BOTH, max_pages=None):
+		'''Generator listing links in the neighbourhood of a page,
+		these are the links that are followed to find the pages listed
+		by L{list_neighbourhood()} for the same arguments. So both the
+		source and the target of each link are in that list.
+
+		For example C{depth=1} gives the links from and to C{pagename},
+		while C{depth=2} also gives the links of pages that link to
+		C{pagename} or are linked from it.
+
+		@param pagename: the L{Path} for the page at the center
+		@param depth: the maximum number of links to follow
+		@param direction: the link direction to follow, see
+		L{list_links()}
+		@param max_pages: maximum number of pages in the neighbourhood
+		@returns: yields L{IndexLink} objects
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		page_id = self._pages.get_page_id(pagename) # can raise IndexNotFoundError
+		nodes = self._list_neighbourhood(page_id, depth, direction, max_pages)
+		if _HAS_RECURSIVE_WITH:
+			c = self.db.execute(
+				_neighbourhood_sql % _neighbourhood_step[direction] +
+				_neighbourhood_links[direction] +
+				'ORDER BY 1, 2',
+				self._neighbourhood_params(page_id, depth, max_pages)
+			)
+		else:
+			c = self._list_links_neighbourhood_fallback(nodes, depth, direction)
+
+		records = dict((record.id, record) for record, distance in nodes)
+		for source, target in c:
+			yield IndexLink(records[source], records[target])
+
+	@staticmethod
+	def _neighbourhood_params(page_id, depth, max_pages):
+		return {
+			'page_id': page_id,
+			'depth': depth,
+			'root': ROOT_ID,
+			'limit': max_pages if max_pages is not None else -1,
+		}
+
+	def _list_link_ids(self, page_id, direction):
+		# Like _list_links() but returns (source, target) ids only
+		if direction == LINK_DIR_FORWARD:
+			sql = 'SELECT source, target FROM links WHERE source = ?'
+			params = (page_id,)
+		elif direction == LINK_DIR_BOTH:
+			sql = 'SELECT source, target FROM links WHERE source = ? or target = ?'
+			params = (page_id, page_id)
+		else:
+			sql = 'SELECT source, target FROM links WHERE target = ?'
+			params = (page_id,)
+
+		return [
+			(row['source'], row['target'])
+				for row in self.db.execute(sql, params)
+					if row['source'] != ROOT_ID
+		]
+
+	def _list_neighbourhood_fallback(self, page_id, depth, direction, max_pages):
+		# Breadth first expansion, used when recursive queries are
+		# not supported
+		distance = {page_id: 0}
+		level = [page_id]
+		for d in range(1, depth + 1):
+			next = []
+			for id in level:
+				for source, target in self._list_link_ids(id, direction):
+					other = source if target == id else target
+					if not other in distance:
+						distance[other] = d
+						next.append(other)
+			level = next
+
+		nodes = [(self._pages.get_pagename(id), d) for id, d in distance.items()]
+		nodes.sort(key=lambda n: (n[1], n[0]._row['sortkey'], n[0].name))
+		if max_pages is not None:
+			nodes = nodes[:max_pages]
+		return nodes
+
+	def _list_links_neighbourhood_fallback(self, nodes, depth, direction):
+		distance = dict((record.id, d) for record, d in nodes)
+		links = set()
+		for id, d in distance.items():
+			if d < depth:
+				for source, target in self._list_link_ids(id, direction):
+					if source in distance and target in distance:
+						links.add((source, target))
+		return sorted(links)
+
 	def list_floating_links(self, basename):
 		anchorkey = natural_sort_key(basename)
 		for row in self.db.execute(
@@ -298,3 +522,203 @@ class LinksView(IndexView):
 			target = self._pages.get_pagename(row['target'])
 			source = self._pages.get_pagename(row['source'])
 			yield IndexLink(source, target)
+
+
+class _LinkGraphSnapshot(object):
+	# Links in "compressed sparse row" format. Pages are numbered by
+	# node, the targets of node "i" are
+	# "out_targets[out_offsets[i]:out_offsets[i+1]]" and likewise the
+	# sources linking to node "i" are in "in_sources". Objects are not
+	# modified after construction, so they can be shared by threads.
+
+	def __init__(self, db):
+		self.names = []
+		self.nodes = {}
+		ids = {}
+		for row in db.execute(
+			'SELECT id, name FROM pages WHERE id <> ? ORDER BY id', (ROOT_ID,)
+		):
+			ids[row[0]] = len(self.names)
+			self.nodes[row[1]] = len(self.names)
+			self.names.append(row[1])
+
+		# Nodes are numbered in order of page id, so the links come
+		# sorted by source node
+		n = len(self.names)
+		self.out_offsets = array('i', [0]) * (n + 1)
+		self.out_targets = array('i')
+		in_count = array('i', [0]) * (n + 1)
+		for source, target in db.execute(
+			'SELECT DISTINCT source, target FROM links WHERE source <> ? '
+			'ORDER BY source, target', (ROOT_ID,)
+		):
+			source, target = ids[source], ids[target]
+			self.out_offsets[source + 1] += 1
+			self.out_targets.append(target)
+			in_count[target + 1] += 1
+
+		for i in range(n):
+			self.out_offsets[i + 1] += self.out_offsets[i]
+			in_count[i + 1] += in_count[i]
+
+		self.in_offsets = array('i', in_count)
+		self.in_sources = array('i', [0]) * len(self.out_targets)
+		for source in range(n):
+			for j in range(self.out_offsets[source], self.out_offsets[source + 1]):
+				target = self.out_targets[j]
+				self.in_sources[in_count[target]] = source
+				in_count[target] += 1
+
+	def neighbours(self, node, direction):
+		if direction == LINK_DIR_FORWARD:
+			return self.out_targets[self.out_offsets[node]:self.out_offsets[node + 1]]
+		elif direction == LINK_DIR_BACKWARD:
+			return self.in_sources[self.in_offsets[node]:self.in_offsets[node + 1]]
+		else:
+			return self.out_targets[self.out_offsets[node]:self.out_offsets[node + 1]] \
+				+ self.in_sources[self.in_offsets[node]:self.in_offsets[node + 1]]
+
+
+class LinkGraph(IndexView, ConnectorMixin):
+	'''Compact in-memory snapshot of the links between pages, intended
+	for analytics over the whole link graph, like finding orphaned
+	pages or parts of the notebook that are not connected. Where
+	L{LinksView} queries the index for each page, this class loads all
+	links once in compact arrays, after that queries do not touch the
+	database.
+
+	Each distinct pair of source and target page counts as a single
+	link. Links used for the placeholder of the current page are
+	ignored.
+
+	When constructed with L{new_from_index()} the snapshot is dropped
+	when the index changes and loaded again on first use after that.
+	Call L{teardown()} to disconnect from the index. When constructed
+	with a database connection, call L{flush()} to drop the snapshot.
+	'''
+
+	@classmethod
+	def new_from_index(cls, index):
+		graph = cls(index._db)
+		graph.connectto(index, 'changed', lambda o: graph.flush())
+		return graph
+
+	def __init__(self, db):
+		IndexView.__init__(self, db)
+		self._snapshot = None
+		self._lock = threading.Lock()
+
+	def teardown(self):
+		'''Disconnect from the index and drop the snapshot'''
+		self.disconnect_all()
+		self.flush()
+
+	def flush(self):
+		'''Drop the snapshot, it will be loaded again on first use'''
+		self._snapshot = None
+
+	def _get_snapshot(self):
+		with self._lock:
+			if self._snapshot is None:
+				self._snapshot = _LinkGraphSnapshot(self.db)
+			return self._snapshot
+
+	def _get_node(self, snapshot, path):
+		try:
+			return snapshot.nodes[path.name]
+		except KeyError:
+			raise IndexNotFoundError('Page not found in index: %s' % path.name)
+
+	def n_pages(self):
+		'''Returns the number of pages in the graph'''
+		return len(self._get_snapshot().names)
+
+	def n_links(self):
+		'''Returns the number of links in the graph'''
+		return len(self._get_snapshot().out_targets)
+
+	def out_degree(self, path):
+		'''Returns the number of pages linked from C{path}
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		snapshot = self._get_snapshot()
+		node = self._get_node(snapshot, path)
+		return snapshot.out_offsets[node + 1] - snapshot.out_offsets[node]
+
+	def in_degree(self, path):
+		'''Returns the number of pages linking to C{path}
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		snapshot = self._get_snapshot()
+		node = self._get_node(snapshot, path)
+		return snapshot.in_offsets[node + 1] - snapshot.in_offsets[node]
+
+	def walk(self, path, direction=LINK_DIR_FORWARD, depth=None):
+		'''Generator for a breadth first walk of the graph
+
+		@param path: the L{Path} to start from
+		@param direction: the link direction to follow, see
+		L{LinksView.list_links()}
+		@param depth: the maximum number of links to follow, or
+		C{None} for no maximum
+		@returns: yields 2-tuples of a L{Path} and the distance to
+		C{path}, starting with C{path} itself with distance 0
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		snapshot = self._get_snapshot()
+		for node, distance in self._walk(snapshot, self._get_node(snapshot, path), direction, depth):
+			yield Path(snapshot.names[node]), distance
+
+	def _walk(self, snapshot, start, direction, depth):
+		seen = set([start])
+		queue = collections.deque([(start, 0)])
+		while queue:
+			node, distance = queue.popleft()
+			yield node, distance
+			if depth is None or distance < depth:
+				for other in snapshot.neighbours(node, direction):
+					if not other in seen:
+						seen.add(other)
+						queue.append((other, distance + 1))
+
+	def is_reachable(self, source, target, direction=LINK_DIR_FORWARD):
+		'''Check whether a page can be reached by following links
+
+		@param source: the L{Path} to start from
+		@param target: the L{Path} to find
+		@param direction: the link direction to follow, see
+		L{LinksView.list_links()}
+		@returns: C{True} if C{target} can be reached from C{source}
+		@raises IndexNotFoundError: if C{source} or C{target} is not
+		found in the index
+		'''
+		snapshot = self._get_snapshot()
+		start = self._get_node(snapshot, source)
+		end = self._get_node(snapshot, target)
+		for node, distance in self._walk(snapshot, start, direction, None):
+			if node == end:
+				return True
+		else:
+			return False
+
+	def connected_components(self):
+		'''Find groups of pages that are linked together, regardless
+		of link direction. Pages without any links form a group by
+		themselves.
+		@returns: a list of lists of L{Path} objects, sorted by size,
+		largest group first
+		'''
+		snapshot = self._get_snapshot()
+		seen = set()
+		components = []
+		for start in range(len(snapshot.names)):
+			if start in seen:
+				continue
+			component = []
+			for node, distance in self._walk(snapshot, start, LINK_DIR_BOTH, None):
+				seen.add(node)
+				component.append(node)
+			components.append(sorted(snapshot.names[n] for n in component))
+
+		components.sort(key=lambda c: (-len(c), c[0]))
+		return [[Path(name) for name in c] for c in components]
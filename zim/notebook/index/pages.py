@@ -61,6 +61,7 @@ class PagesIndexer(IndexerBase):
 	def __init__(self, db, layout, filesindexer):
 		IndexerBase.__init__(self, db)
 		self.layout = layout
+		self.parser_pool = None # set by IndexUpdateIter for bulk updates
 		self.connectto_all(filesindexer, (
 			'file-row-inserted', 'file-row-changed', 'file-row-deleted'
 		))
@@ -78,7 +79,9 @@ class PagesIndexer(IndexerBase):
 				source_file INTEGER REFERENCES files(id),
 				is_link_placeholder BOOLEAN DEFAULT 0
 			);
-			CREATE UNIQUE INDEX IF NOT EXISTS pages_name ON pages(name)
+			CREATE UNIQUE INDEX IF NOT EXISTS pages_name ON pages(name);
+			CREATE INDEX IF NOT EXISTS pages_parent ON pages(parent, sortkey);
+			CREATE INDEX IF NOT EXISTS pages_sortkey ON pages(sortkey);
 		''')
 		row = self.db.execute('SELECT * FROM pages WHERE id == 1').fetchone()
 		if row is None:
@@ -130,9 +133,13 @@ class PagesIndexer(IndexerBase):
 
 		if row['source_file'] == filerow['id']:
 			file = self.layout.root.file(filerow['path'])
-			format = self.layout.get_format(file)
 			mtime = file.mtime()
-			tree = format.Parser().parse(file.read())
+			tree = None
+			if self.parser_pool is not None:
+				tree = self.parser_pool.get_parsetree(file)
+			if tree is None:
+				format = self.layout.get_format(file)
+				tree = format.Parser().parse(file.read())
 			self.update_page(pagename, mtime, tree)
 		else:
 			pass # some conflict file changed
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2009-2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''Pool of worker processes that read and parse pages in parallel
+during a bulk index update.
+
+Parsing the page source is by far the most expensive step of indexing,
+while writing the results to the database is cheap. The L{ParserPool}
+reads and parses the pages that are waiting for an update in worker
+processes and hands the results back to the L{PagesIndexer}, which
+remains the single writer and applies the results in the same order
+as before.
+
+The same workers are used by L{prefetch_parsetrees()} to fill the
+parse tree cache before a bulk operation reads many pages, like
+updating links after moving a page.
+'''
+
+from __future__ import with_statement
+
+import logging
+
+logger = logging.getLogger('zim.notebook.index')
+
+try:
+	import multiprocessing
+except ImportError: #pragma: no cover
+	multiprocessing = None
+
+from zim.formats import TokenParseTree
+from zim.notebook.layout import FILE_TYPE_PAGE_SOURCE
+
+from .files import STATUS_NEED_UPDATE, TYPE_FILE
+
+
+# Do not bother starting processes for a handful of pages
+MIN_PAGES_FOR_POOL = 20
+
+# Number of pages handed to a worker at once
+CHUNKSIZE = 10
+
+
+_worker_layout = None # set in the worker processes
+
+
+def _init_worker(layout):
+	global _worker_layout
+	_worker_layout = layout
+
+
+def _parse_page(path):
+	# Runs in the worker process - returns the mtime and the parse
+	# tree as a list of tokens, or None on error. Errors are logged again when the
+	# main process re-tries to parse the page.
+	try:
+		file = _worker_layout.root.file(path)
+		format = _worker_layout.get_format(file)
+		mtime = file.mtime()
+		tree = format.Parser().parse(file.read())
+		return path, mtime, tree.totokens()
+	except Exception:
+		return path, None, None
+
+
+def _parse_page_source(item):
+	# Runs in the worker process - returns the md5 of the page source,
+	# the parse tree as a list of tokens and the tree meta data, or
+	# None on error. Errors are logged again when the main process
+	# reads the page.
+	name, path = item
+	try:
+		file = _worker_layout.root.file(path)
+		format = _worker_layout.get_format(file)
+		text, etag = file.read_with_etag()
+		tree = format.Parser().parse(text)
+		return name, etag[1], tree.totokens(), tree.meta.items()
+	except Exception:
+		return name, None, None, None
+
+
+def prefetch_parsetrees(layout, pages, cache, processes=None):
+	'''Parse pages in worker processes and add the parse trees to a
+	cache, so reading these pages afterwards does not need to parse
+	them. Does nothing when parallel parsing is not supported or when
+	there are less than C{MIN_PAGES_FOR_POOL} pages.
+	@param layout: a L{NotebookLayout}
+	@param pages: a list of L{Path} objects
+	@param cache: a L{ParseTreeCache}
+	@param processes: the number of worker processes, defaults
+	to the number of CPUs
+	@returns: the number of parse trees added to the cache
+	'''
+	if len(pages) < MIN_PAGES_FOR_POOL or not ParserPool.is_supported():
+		return 0
+
+	items = []
+	for path in pages:
+		file, folder = layout.map_page(path)
+		items.append((path.name, file.relpath(layout.root)))
+
+	logger.debug('Starting pool for parsing %i pages', len(items))
+	try:
+		pool = multiprocessing.Pool(processes, _init_worker, (layout,))
+	except:
+		logger.exception('Could not start worker processes')
+		return 0
+
+	n = 0
+	try:
+		results = pool.imap_unordered(_parse_page_source, items, CHUNKSIZE)
+		for name, md5, tokens, meta in results:
+			if tokens is not None:
+				tree = TokenParseTree(tokens)
+				for key, value in meta:
+					tree.meta[key] = value
+				cache.set(name, md5, tree)
+				n += 1
+	finally:
+		pool.terminate()
+		pool.join()
+
+	return n
+
+
+class ParserPool(object):
+	'''Pool of worker processes to read and parse pages
+
+	Pages are submitted in batches: on the first request for a page,
+	all page sources that are flagged for update in the "files" table
+	are handed to the workers. Results come back in the same order
+	as the files are processed by the L{FilesIndexer}.
+
+	@ivar hits: number of parse trees returned from the pool
+	@ivar misses: number of requests where the caller needs to parse
+	the page itself
+	'''
+
+	def __init__(self, db, layout, processes=None):
+		'''Constructor
+		@param db: the index database connection
+		@param layout: a L{NotebookLayout}
+		@param processes: the number of worker processes, defaults
+		to the number of CPUs
+		'''
+		self.db = db
+		self.layout = layout
+		self.processes = processes
+		self._pool = None
+		self._iters = []
+		self._submitted = set()
+		self._results = {}
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def is_supported():
+		'''Returns C{True} when parallel parsing can be used'''
+		if multiprocessing is None:
+			return False
+		try:
+			return multiprocessing.cpu_count() > 1
+		except NotImplementedError:
+			return False
+
+	def get_parsetree(self, file):
+		'''Get the parse tree for a page source file
+		@param file: a L{File} object
+		@returns: a L{ParseTree} or C{None} if the file was not parsed
+		by the pool, in that case the caller should parse it
+		'''
+		tree = self._get_parsetree(file)
+		if tree is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return tree
+
+	def _get_parsetree(self, file):
+		path = file.relpath(self.layout.root)
+		if path not in self._submitted:
+			self._submit_pending(path)
+			if path not in self._submitted:
+				return None
+
+		while path not in self._results:
+			try:
+				mypath, mtime, tokens = self._iters[0].next()
+			except StopIteration:
+				self._iters.pop(0)
+				if not self._iters:
+					return None
+			else:
+				self._results[mypath] = (mtime, tokens)
+
+		self._submitted.discard(path)
+		mtime, tokens = self._results.pop(path)
+		if tokens is None or mtime != file.mtime():
+			return None # error, or file changed in between
+		else:
+			return TokenParseTree(tokens)
+
+	def _submit_pending(self, first):
+		# The requested file is no longer flagged for update at this
+		# point, so it is added explicitly
+		def needs_submit(path):
+			return path not in self._submitted \
+				and self.layout.map_filepath(path)[1] == FILE_TYPE_PAGE_SOURCE
+
+		paths = [first] if needs_submit(first) else []
+		for row in self.db.execute(
+			'SELECT path FROM files WHERE index_status = ? AND node_type = ? '
+			'ORDER BY id',
+			(STATUS_NEED_UPDATE, TYPE_FILE)
+		):
+			path = row[0]
+			if path != first and needs_submit(path):
+				paths.append(path)
+
+		if len(paths) < MIN_PAGES_FOR_POOL and self._pool is None:
+			return
+
+		if self._pool is None:
+			logger.debug('Starting pool for parsing pages')
+			try:
+				self._pool = multiprocessing.Pool(
+					self.processes, _init_worker, (self.layout,))
+			except:
+				logger.exception('Could not start worker processes')
+				self._submitted.update(paths) # results will be None
+				self._iters.append(iter([(p, None, None) for p in paths]))
+				return
+
+		self._submitted.update(paths)
+		self._iters.append(self._pool.imap(_parse_page, paths, CHUNKSIZE))
+
+	def close(self):
+		'''Stop the worker processes'''
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool.join()
+			self._pool = None
+		self._iters = []
+		self._submitted.clear()
+		self._results.clear()
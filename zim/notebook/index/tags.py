@@ -78,6 +78,8 @@ class TagsIndexer(IndexerBase):
 
 				CONSTRAINT uc_TagSourceOnce UNIQUE (source, tag)
 			);
+			CREATE INDEX IF NOT EXISTS tags_sortkey ON tags(sortkey);
+			CREATE INDEX IF NOT EXISTS tagsources_tag ON tagsources(tag);
 		''')
 
 	def on_page_changed(self, pagesindexer, pagerow, doc):
@@ -216,7 +218,7 @@ class TagsView(IndexView):
 			'   HAVING count(tag) = ? '
 			' ) '
 			'GROUP BY tags.id '
-			'ORDER BY count(*) DESC' % tag_ids, (len(tags),)
+			'ORDER BY count(*) DESC, tags.sortkey, tags.name' % tag_ids, (len(tags),)
 		):
 			yield IndexTag(*row)
 
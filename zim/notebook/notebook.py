@@ -28,10 +28,16 @@ from zim.signals import ConnectorMixin, SignalEmitter, SIGNAL_NORMAL
 
 from .operations import notebook_state, NOOP, SimpleAsyncOperation, ongoing_operation
 from .page import Path, Page, HRef, HREF_REL_ABSOLUTE, HREF_REL_FLOATING
+from .cache import PageLRUCache, ParseTreeCache
 from .index import IndexNotFoundError, LINK_DIR_BACKWARD
+from .index.parsepool import prefetch_parsetrees
 
 DATA_FORMAT_VERSION = (0, 4)
 
+#: Number of pages stored together in a single index transaction when
+#: updating links for a moved page
+STORE_BATCH_SIZE = 50
+
 
 class NotebookConfig(INIConfigFile):
 	'''Wrapper for the X{notebook.zim} file'''
@@ -183,6 +189,14 @@ class Notebook(ConnectorMixin, SignalEmitter):
 	(the C{X{notebook.zim}} config file in the notebook folder)
 	@ivar profile: The name of the profile used by the notebook or C{None}
 	@ivar index: The L{Index} object used by the notebook
+	@ivar parsetree_cache: The L{ParseTreeCache} object used by the
+	notebook or C{None}
+	@ivar page_cache: The L{PageLRUCache} object used by L{get_page()},
+	its limits can be changed to tune memory usage
+
+	Page objects are shared by all users of the notebook and are not
+	thread safe. Other threads than the main thread should only use
+	L{get_page_copy()} and not modify the pages they get.
 	'''
 
 	# define signals we want to use - (closure type, return type and arg types)
@@ -246,18 +260,20 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		layout = FilesLayout(folder, endofline)
 		cache_dir.touch() # must exist for index to work
 		index = Index(cache_dir.file('index.db').path, layout)
+		parsetree_cache = ParseTreeCache(cache_dir.file('parsetrees.db').path)
 
-		nb = klass(dir, cache_dir, config, folder, layout, index)
+		nb = klass(dir, cache_dir, config, folder, layout, index, parsetree_cache)
 		_NOTEBOOK_CACHE[dir.uri] = nb
 		return nb
 
-	def __init__(self, dir, cache_dir, config, folder, layout, index):
+	def __init__(self, dir, cache_dir, config, folder, layout, index, parsetree_cache=None):
 		self.dir = dir # TODO remove
 		self.folder = folder
 		self.cache_dir = cache_dir
 		self.config = config
 		self.layout = layout
 		self.index = index
+		self.parsetree_cache = parsetree_cache
 		self._operation_check = NOOP
 
 		self.readonly = not _iswritable(dir) if dir else None # XXX
@@ -269,6 +285,8 @@ class Notebook(ConnectorMixin, SignalEmitter):
 				'template': 'Default'
 			})
 		self._page_cache = weakref.WeakValueDictionary()
+		self._page_lock = threading.RLock() # protects _page_cache
+		self.page_cache = PageLRUCache()
 
 		self.name = None
 		self.icon = None
@@ -289,8 +307,15 @@ class Notebook(ConnectorMixin, SignalEmitter):
 				self._page_cache[row['name']].haschildren = False
 				self.emit('page-info-changed', self._page_cache[row['name']])
 
-		self.index.update_iter.pages.connect('page-row-changed', on_page_row_changed)
-		self.index.update_iter.pages.connect('page-row-deleted', on_page_row_deleted)
+		def connect_to_updateiter(update_iter):
+			update_iter.pages.connect('page-row-changed', on_page_row_changed)
+			update_iter.pages.connect('page-row-deleted', on_page_row_deleted)
+
+		connect_to_updateiter(self.index.update_iter)
+		self.index.connect('new-update-iter',
+			lambda o, update_iter: connect_to_updateiter(update_iter))
+			# Re-connect when the index is flushed, cached pages need
+			# to stay in sync
 
 		self.do_properties_changed()
 
@@ -401,16 +426,23 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		# As a special case, using an invalid page as the argument should
 		# return a valid page object.
 		assert isinstance(path, Path)
+		with self._page_lock:
+			return self._get_page(path)
+
+	def _get_page(self, path):
 		if path.name in self._page_cache \
 		and self._page_cache[path.name].valid:
 			page = self._page_cache[path.name]
 			assert isinstance(page, Page)
 			page._check_source_etag()
+			self.page_cache.hits += 1
+			self.page_cache.add(page)
 			return page
 		else:
+			self.page_cache.misses += 1
 			file, folder = self.layout.map_page(path)
 			folder = self.layout.get_attachments_folder(path)
-			page = Page(path, False, file, folder)
+			page = Page(path, False, file, folder, self.parsetree_cache)
 			try:
 				indexpath = self.pages.lookup_by_pagename(path)
 			except IndexNotFoundError:
@@ -424,8 +456,19 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 			# TODO - set haschildren if page maps to a store namespace
 			self._page_cache[path.name] = page
+			self.page_cache.add(page)
 			return page
 
+	def get_page_copy(self, path):
+		'''Like L{get_page()} but returns a read-only copy of the page,
+		see L{Page.copy()}. Use this method to get pages in a thread
+		other than the main thread, e.g. in the web server.
+		@param path: a L{Path} object
+		@returns: a L{Page} object
+		'''
+		with self._page_lock:
+			return self.get_page(path).copy()
+
 	def get_new_page(self, path):
 		'''Like get_page() but guarantees the page does not yet exist
 		by adding a number to the name to make it unique.
@@ -459,15 +502,17 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 		@param path: a L{Path} object
 		'''
-		names = [path.name]
-		ns = path.name + ':'
-		names.extend(k for k in self._page_cache.keys() if k.startswith(ns))
-		for name in names:
-			if name in self._page_cache:
-				page = self._page_cache[name]
-				assert not page.modified, 'BUG: Flushing page with unsaved changes'
-				page.valid = False
-				del self._page_cache[name]
+		with self._page_lock:
+			names = [path.name]
+			ns = path.name + ':'
+			names.extend(k for k in self._page_cache.keys() if k.startswith(ns))
+			for name in names:
+				if name in self._page_cache:
+					page = self._page_cache[name]
+					assert not page.modified, 'BUG: Flushing page with unsaved changes'
+					page.valid = False
+					del self._page_cache[name]
+				self.page_cache.discard(name)
 
 	def get_home_page(self):
 		'''Returns a L{Page} object for the home page'''
@@ -490,6 +535,26 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		page.modified = False
 		self.emit('stored-page', page)
 
+	def _store_pages(self, pages):
+		# Like store_page() for a batch of pages, but the index is
+		# updated for all pages at once in a single transaction
+		files = []
+		try:
+			for page in pages:
+				assert page.valid, 'BUG: page object no longer valid'
+				logger.debug('Store page: %s', page)
+				self.emit('store-page', page)
+				page._store()
+				file, folder = self.layout.map_page(page)
+				files.append(file)
+		finally:
+			if files:
+				self.index.update_files(files)
+
+		for page in pages:
+			page.modified = False
+			self.emit('stored-page', page)
+
 	@notebook_state
 	def store_page_async(self, page, parsetree):
 		assert page.valid, 'BUG: page object no longer valid'
@@ -641,31 +706,64 @@ class Notebook(ConnectorMixin, SignalEmitter):
 			self.index.file_moved(old, new)
 
 
+	def _prefetch_parsetrees(self, paths):
+		# Parse the pages for a bulk update in parallel, pages that
+		# are in memory already are skipped
+		if self.parsetree_cache is not None:
+			paths = [p for p in paths if p.name not in self._page_cache]
+			prefetch_parsetrees(self.layout, paths, self.parsetree_cache)
+
 	def _update_links_in_moved_page(self, oldtarget, newtarget):
 		# Find (floating) links that originate from the moved page
 		# check if they would resolve different from the old location
+		sources = []
 		seen = set()
-		for link in list(self.links.list_links_section(newtarget)):
+		for link in self.links.list_links_section(newtarget):
 			if link.source.name not in seen \
 			and not (
 				link.target == newtarget
 				or link.target.ischild(newtarget)
 			):
-				if link.source == newtarget:
-					oldpath = oldtarget
-				else:
-					oldpath = oldtarget + link.source.relname(newtarget)
-
-				yield link.source
-				self._update_moved_page(link.source, oldpath, newtarget, oldtarget)
+				sources.append(link.source)
 				seen.add(link.source.name)
 
+		def update(source):
+			if source == newtarget:
+				oldpath = oldtarget
+			else:
+				oldpath = oldtarget + source.relname(newtarget)
+			return self._update_moved_page(source, oldpath, newtarget, oldtarget)
+
+		for p in self._update_pages_iter(sources, update):
+			yield p
+
+	def _update_pages_iter(self, paths, update):
+		# Calls update(path) for each path, which returns a modified
+		# page or None. Yields each path before it is updated. Modified
+		# pages are stored in batches of STORE_BATCH_SIZE, pages that
+		# are updated already are also stored when the iteration is
+		# stopped or raises an error.
+		self._prefetch_parsetrees(paths)
+		pages = []
+		try:
+			for path in paths:
+				yield path
+				page = update(path)
+				if page is not None:
+					pages.append(page)
+					if len(pages) >= STORE_BATCH_SIZE:
+						batch, pages = pages, []
+						self._store_pages(batch)
+		finally:
+			self._store_pages(pages)
+
 	def _update_moved_page(self, path, oldpath, newroot, oldroot):
+		# Returns the modified page, the caller should store it
 		logger.debug('Updating links in page moved from %s to %s', oldpath, path)
 		page = self.get_page(path)
 		tree = page.get_parsetree()
 		if not tree:
-			return 0
+			return None
 
 		def replacefunc(elt):
 			text = elt.attrib['href']
@@ -691,7 +789,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 		tree.replace(zim.formats.LINK, replacefunc)
 		page.set_parsetree(tree)
-		self.store_page(page)
+		return page
 
 	def _update_links_to_moved_page(self, oldtarget, newtarget):
 		# 1. Check remaining placeholders, update pages causing them
@@ -701,33 +799,44 @@ class Notebook(ConnectorMixin, SignalEmitter):
 		except IndexNotFoundError:
 			pass
 		else:
-			for link in list(self.links.list_links_section(oldtarget, LINK_DIR_BACKWARD)):
+			sources = []
+			for link in self.links.list_links_section(oldtarget, LINK_DIR_BACKWARD):
 				if link.source.name not in seen:
-					yield link.source
-					self._move_links_in_page(link.source, oldtarget, newtarget)
+					sources.append(link.source)
 					seen.add(link.source.name)
 
+			for p in self._move_links_in_pages(sources, oldtarget, newtarget):
+				yield p
+
 		# 2. Check for links that have anchor of same name as the moved page
 		# and originate from a (grand)child of the parent of the moved page
 		# and no longer resolve to the moved page
 		parent = oldtarget.parent
-		for link in list(self.links.list_floating_links(oldtarget.basename)):
+		sources = []
+		for link in self.links.list_floating_links(oldtarget.basename):
 			if link.source.name not in seen \
 			and link.source.ischild(parent) \
 			and not (
 				link.target == newtarget
 				or link.target.ischild(newtarget)
 			):
-				yield link.source
-				self._move_links_in_page(link.source, oldtarget, newtarget)
+				sources.append(link.source)
 				seen.add(link.source.name)
 
+		for p in self._move_links_in_pages(sources, oldtarget, newtarget):
+			yield p
+
+	def _move_links_in_pages(self, paths, oldtarget, newtarget):
+		update = lambda path: self._move_links_in_page(path, oldtarget, newtarget)
+		return self._update_pages_iter(paths, update)
+
 	def _move_links_in_page(self, path, oldtarget, newtarget):
+		# Returns the modified page, the caller should store it
 		logger.debug('Updating page %s to move link from %s to %s', path, oldtarget, newtarget)
 		page = self.get_page(path)
 		tree = page.get_parsetree()
 		if not tree:
-			return 0
+			return None
 
 		def replacefunc(elt):
 			text = elt.attrib['href']
@@ -766,7 +875,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 		tree.replace(zim.formats.LINK, replacefunc)
 		page.set_parsetree(tree)
-		self.store_page(page)
+		return page
 
 	def _update_link_tag(self, elt, source, target, oldhref):
 		if oldhref.rel == HREF_REL_ABSOLUTE: # prefer to keep absolute links
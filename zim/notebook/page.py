@@ -423,7 +423,7 @@ class Page(Path, SignalEmitter):
 		'page-changed': (SIGNAL_NORMAL, None, (bool,))
 	}
 
-	def __init__(self, path, haschildren, file, folder):
+	def __init__(self, path, haschildren, file, folder, parsetree_cache=None):
 		assert isinstance(path, Path)
 		self.name = path.name
 		self.haschildren = haschildren
@@ -437,10 +437,12 @@ class Page(Path, SignalEmitter):
 
 		self._readonly = None
 		self._last_etag = None
+		self._source_size = 0
 		self.format = zim.formats.get_format('wiki') # TODO make configurable
 		self.source = SourceFile(file.path) # XXX
 		self.source_file = file
 		self.attachments_folder = folder
+		self._parsetree_cache = parsetree_cache
 
 	@property
 	def readonly(self):
@@ -515,10 +517,31 @@ class Page(Path, SignalEmitter):
 			self._last_etag = None
 			self._meta = None
 			self._parsetree = None
+			self._source_size = 0
 			self.emit('page-changed', True)
 		else:
 			pass # no check
 
+	def copy(self):
+		'''Get a read-only copy of this page
+
+		The copy has its own state, so it can be used in another thread
+		while this object is changed, e.g. by L{_check_source_etag()}.
+		It shares the parse tree with this page, which therefore must
+		not be modified. The copy is not known to the notebook and
+		can not be stored.
+
+		@returns: a new L{Page} object
+		'''
+		page = Page(self, self.haschildren, self.source_file,
+			self.attachments_folder, self._parsetree_cache)
+		page._readonly = True
+		page._parsetree = self._parsetree
+		page._meta = self._meta
+		page._last_etag = self._last_etag
+		page._source_size = self._source_size
+		return page
+
 	def exists(self):
 		'''C{True} when the page has either content or children'''
 		return self.haschildren or self.hascontent
@@ -558,8 +581,17 @@ class Page(Path, SignalEmitter):
 			except zim.newfs.FileNotFoundError:
 				return None
 			else:
-				parser = self.format.Parser()
-				self._parsetree = parser.parse(text)
+				self._source_size = len(text)
+				md5 = self._last_etag[1]
+				if self._parsetree_cache:
+					self._parsetree = self._parsetree_cache.get(self.name, md5)
+
+				if self._parsetree is None:
+					parser = self.format.Parser()
+					self._parsetree = parser.parse(text)
+					if self._parsetree_cache:
+						self._parsetree_cache.set(self.name, md5, self._parsetree)
+
 				self._meta = self._parsetree.meta
 				assert self._meta is not None
 				return self._parsetree
@@ -577,6 +609,7 @@ class Page(Path, SignalEmitter):
 		assert self.valid, 'BUG: page object became invalid'
 
 		if self.readonly:
+			from .notebook import PageReadOnlyError # avoid circular import
 			raise PageReadOnlyError(self)
 
 		if self._ui_object:
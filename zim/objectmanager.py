@@ -105,9 +105,10 @@ class _ObjectManager(object):
 		'''
 		for name in zim.plugins.PluginManager.list_installed_plugins(): # XXX
 			try:
-				klass = zim.plugins.PluginManager.get_plugin_class(name) # XXX
-				types = klass.plugin_info.get('object_types')
+				info = zim.plugins.PluginManager.get_plugin_info(name)
+				types = info.get('object_types')
 				if types and type in types:
+					klass = zim.plugins.PluginManager.get_plugin_class(name) # XXX
 					activatable = klass.check_dependencies_ok()
 					win_ext = self.window_extensions[type] if type in self.window_extensions else None
 					return (name, klass.plugin_info['name'], activatable, klass, win_ext)
@@ -353,6 +353,12 @@ class Parser(object):
 	The function should take a L{Builder} object as first argument,
 	followed by one or more parameters for matched groups in the
 	regular expression.
+	@ivar anchor: optional regex pattern as string that matches all
+	positions where one of the rules can start to match, or C{None}.
+	When set, the rules are only tried at these positions instead of at
+	every position in the text. This is much faster when e.g. all rules
+	need to match at the start of a line. The anchor should never miss
+	a position where a rule matches, else the results will differ.
 	'''
 
 	def __init__(self, *rules):
@@ -363,7 +369,9 @@ class Parser(object):
 		'''
 		self.rules = [] #: sub rules
 		self.process_unmatched = self._process_unmatched
+		self.anchor = None
 		self._re = None
+		self._anchor_re = None
 
 		for rule in rules:
 			if isinstance(rule, Parser):
@@ -406,10 +414,12 @@ class Parser(object):
 			])
 			#~ print 'PATTERN:\n', pattern.replace(')|(', ')\t|\n('), '\n...'
 			self._re = re.compile(pattern, re.U | re.M | re.X)
+			if self.anchor:
+				self._anchor_re = re.compile(self.anchor, re.U | re.M | re.X)
 
 		iter = 0
 		end = len(text)
-		for match in self._re.finditer(text):
+		for match in self._finditer(text):
 			mstart, mend = match.span()
 			if mstart > iter:
 				try:
@@ -440,6 +450,28 @@ class Parser(object):
 
 	parse = __call__
 
+	def _finditer(self, text):
+		if self._anchor_re is None:
+			return self._re.finditer(text)
+		else:
+			return self._finditer_anchored(text)
+
+	def _finditer_anchored(self, text):
+		# Same result as finditer, but only tries to match at positions
+		# matched by the anchor
+		search = self._anchor_re.search
+		match = self._re.match
+		a = search(text)
+		while a:
+			start = a.start()
+			m = match(text, start)
+			if m:
+				yield m
+				pos = m.end() if m.end() > start else start + 1
+			else:
+				pos = start + 1
+			a = search(text, pos)
+
 	@staticmethod
 	def _raise_exception(error, text, start, end, builder, rule=None):
 		# Add parser state, line count etc. to error, then re-raise
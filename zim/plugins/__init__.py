@@ -64,6 +64,11 @@ Also defined here is the L{PluginManager} class. This class is the
 interface towards the rest of the application to load/unload plugins and
 to let plugins extend specific application objects.
 
+To keep startup fast, plugins are not imported until they are needed.
+The L{PluginManifest} caches the plugin info and the extension points
+of each plugin, so the plugin manager can delay loading a plugin until
+an object is extended that the plugin has an extension for.
+
 
 To allow plugins to be installed locally, the
 C{$XDG_DATA_HOME/zim/plugins} and all C{$XDG_DATA_DIRS/zim/plugins}
@@ -77,9 +82,11 @@ import gobject
 import types
 import os
 import sys
+import imp
 import logging
 import inspect
 import collections
+import threading
 
 import zim.fs
 from zim.fs import Dir
@@ -88,7 +95,8 @@ from zim.signals import SignalEmitter, ConnectorMixin, SIGNAL_AFTER, SignalHandl
 from zim.actions import action, toggle_action, get_gtk_actiongroup
 from zim.utils import classproperty, get_module, lookup_subclass, WeakSet
 
-from zim.config import data_dirs, VirtualConfigManager, XDG_DATA_HOME
+from zim.config import data_dirs, VirtualConfigManager, XDG_DATA_HOME, json
+from zim.profiler import profile_section
 
 
 logger = logging.getLogger('zim.plugins')
@@ -116,6 +124,8 @@ __path__.append(__path__.pop(0)) # reshuffle real module path to the end
 
 PLUGIN_FOLDER = XDG_DATA_HOME.subdir('zim/plugins')
 
+PLUGIN_MANIFEST_VERSION = 1 #: Version of the manifest format
+
 
 class PluginManager(ConnectorMixin, collections.Mapping):
 	'''Manager that maintains a set of active plugins
@@ -131,6 +141,12 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 
 	This object behaves as a dictionary with plugin object names as
 	keys and plugin objects as value
+
+	Plugins that are enabled in the preferences, but that only define
+	extensions, are not loaded until an object is extended that they
+	have an extension for, or until they are looked up in the manager.
+	Until then these plugins are "pending", but they are part of the
+	dictionary like loaded plugins.
 	'''
 
 	def __init__(self, config=None):
@@ -150,6 +166,7 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 		self.general_preferences.setdefault('plugins', [])
 
 		self._plugins = {}
+		self._pending = {}
 		self._extendables = WeakSet()
 
 		self._load_plugins()
@@ -158,24 +175,49 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 			self.on_preferences_changed)
 
 	def __getitem__(self, name):
+		if name in self._pending:
+			self.load_plugin(name)
 		return self._plugins[name]
 
+	def __contains__(self, name):
+		return name in self._plugins or name in self._pending
+
 	def __iter__(self):
-		return iter(sorted(self._plugins.keys()))
+		return iter(sorted(set(self._plugins.keys()) | set(self._pending.keys())))
 			# sort to make operation predictable - easier debugging
 
 	def __len__(self):
-		return len(self._plugins)
+		return len(self._plugins) + len(self._pending)
 
 	def _load_plugins(self):
-		'''Load plugins based on config'''
+		'''Load plugins based on config, plugins that can be loaded
+		lazily according to the L{PluginManifest} are only marked as
+		pending
+		'''
+		manifest = get_plugin_manifest()
 		for name in sorted(self.general_preferences['plugins']):
 			try:
-				self.load_plugin(name)
+				entry = manifest.get(name)
+				if entry['lazy']:
+					logger.debug('Delay loading plugin: %s', name)
+					self._pending[name] = frozenset(entry['extends'])
+				else:
+					self.load_plugin(name)
 			except:
 				logger.exception('Exception while loading plugin: %s', name)
 				self.general_preferences['plugins'].remove(name)
 
+	def _load_pending(self, name):
+		# Load pending plugins that have an extension for objects of
+		# class "name"
+		for plugin in sorted(self._pending):
+			if name in self._pending[plugin]:
+				try:
+					self.load_plugin(plugin)
+				except:
+					logger.exception('Exception while loading plugin: %s', plugin)
+					self.remove_plugin(plugin)
+
 	@classmethod
 	def list_installed_plugins(klass):
 		'''Lists plugin names for all installed plugins
@@ -186,14 +228,17 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 		# sub-modules of the this package once this module is loaded.
 		plugins = set() # THIS LINE IS REPLACED BY SETUP.PY - DON'T CHANGE IT
 		for dir in __path__:
-			dir = Dir(dir)
-			for candidate in dir.list(): # returns [] if dir does not exist
+			try:
+				names = os.listdir(dir)
+			except OSError:
+				continue # dir does not exist
+
+			for candidate in names:
 				if candidate.startswith('_') or candidate == 'base':
 					continue
 				elif candidate.endswith('.py'):
 					plugins.add(candidate[:-3])
-				elif zim.fs.isdir(dir.path + '/' + candidate) \
-				and os.path.exists(dir.path + '/' + candidate + '/__init__.py'):
+				elif os.path.exists(os.path.join(dir, candidate, '__init__.py')):
 					plugins.add(candidate)
 				else:
 					pass
@@ -211,9 +256,20 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 		mod = get_module(modname)
 		return lookup_subclass(mod, PluginClass)
 
+	@classmethod
+	def get_plugin_info(klass, name):
+		'''Get the plugin info for a given name without loading the
+		plugin, uses the L{PluginManifest}
+
+		@param name: the plugin name (e.g. "calendar")
+		@returns: the C{plugin_info} dict of the plugin class
+		@raises ImportError: if the plugin does not exist
+		'''
+		return get_plugin_manifest().get(name)['info']
+
 	@SignalHandler
 	def on_preferences_changed(self, o):
-		current = set(self._plugins.keys())
+		current = set(self._plugins.keys()) | set(self._pending.keys())
 		new = set(self.general_preferences['plugins'])
 
 		for name in current - new:
@@ -244,20 +300,24 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 		if name in self._plugins:
 			return self._plugins[name]
 
+		self._pending.pop(name, None)
+
 		logger.debug('Loading plugin: %s', name)
-		klass = self.get_plugin_class(name)
-		if not klass.check_dependencies_ok():
-			raise AssertionError('Dependencies failed for plugin %s' % name)
+		with profile_section('plugin %s (import)' % name):
+			klass = self.get_plugin_class(name)
+			if not klass.check_dependencies_ok():
+				raise AssertionError('Dependencies failed for plugin %s' % name)
 
-		plugin = klass(self.config)
-		self.connectto(plugin, 'extension-point-changed')
-		self._plugins[name] = plugin
+		with profile_section('plugin %s (init)' % name):
+			plugin = klass(self.config)
+			self.connectto(plugin, 'extension-point-changed')
+			self._plugins[name] = plugin
 
-		for obj in self._extendables:
-			try:
-				plugin.extend(obj)
-			except:
-				logger.exception('Exception in plugin: %s', name)
+			for obj in self._extendables:
+				try:
+					plugin.extend(obj)
+				except:
+					logger.exception('Exception in plugin: %s', name)
 
 		if not name in self.general_preferences['plugins']:
 			with self.on_preferences_changed.blocked():
@@ -277,6 +337,7 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 				self.general_preferences['plugins'].remove(name)
 				self.general_preferences.changed()
 
+		self._pending.pop(name, None)
 		try:
 			plugin = self._plugins.pop(name)
 			self.disconnect_from(plugin)
@@ -302,6 +363,7 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 		@param obj: arbitrary object that can be extended by plugins
 		'''
 		if not obj in self._extendables:
+			self._load_pending(obj.__class__.__name__)
 			self._foreach(lambda p: p.extend(obj))
 			self._extendables.add(obj)
 
@@ -314,6 +376,127 @@ class PluginManager(ConnectorMixin, collections.Mapping):
 					logger.exception('Exception in plugin: %s', name)
 
 
+def _gettext_language():
+	# Environment parameters used by gettext to determine the language,
+	# the plugin info is translated, so the manifest depends on them
+	return [os.environ.get(k) for k in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG')]
+
+
+class PluginManifest(object):
+	'''Cache with meta data of installed plugins
+
+	Getting the plugin info or the extension points of a plugin requires
+	importing the plugin module, which is slow for plugins that e.g.
+	import gtk widgets. The manifest keeps this data in a json file in
+	the cache folder, so it only needs to be collected again when the
+	plugin module changed.
+
+	For each plugin the manifest records a dict with:
+		- C{info}: the C{plugin_info} dict of the plugin class
+		- C{extends}: a list with the class names of the objects
+		  extended by the plugin
+		- C{lazy}: C{True} if loading the plugin can be delayed until
+		  one of these objects is extended. This is not the case when
+		  the plugin class defines a constructor, because it can e.g.
+		  set extension classes dynamically.
+
+	Methods can be called from multiple threads.
+	'''
+
+	def __init__(self, file):
+		'''Constructor
+		@param file: a L{File} object for the manifest
+		'''
+		self.file = file
+		self._lock = threading.Lock()
+		self._plugins = {}
+
+		if file.exists():
+			try:
+				data = json.loads(file.read())
+				if data.get('version') == PLUGIN_MANIFEST_VERSION \
+				and data.get('zim_version') == zim.__version__ \
+				and data.get('language') == _gettext_language():
+					self._plugins = data['plugins']
+			except:
+				logger.exception('Could not read plugin manifest: %s', file)
+
+	def get(self, name):
+		'''Get the manifest entry for a plugin, the plugin is imported
+		if the entry is missing or out of date
+		@param name: the plugin name
+		@returns: a dict with the keys "info", "extends" and "lazy"
+		@raises ImportError: if the plugin does not exist
+		'''
+		key = self._get_key(name)
+		with self._lock:
+			entry = self._plugins.get(name)
+			if entry is not None and entry['key'] == key:
+				return entry
+
+		entry = self._build_entry(name, key)
+		with self._lock:
+			self._plugins[name] = entry
+			self._write()
+		return entry
+
+	@staticmethod
+	def _get_key(name):
+		# Locate the plugin module without importing it, the key is
+		# the path and the mtime of the source - for packages the
+		# latest mtime of the source files in the package folder
+		file, path, description = imp.find_module(name, __path__)
+		if file is not None:
+			file.close()
+
+		if description[2] == imp.PKG_DIRECTORY:
+			mtime = max(
+				os.stat(os.path.join(path, n)).st_mtime
+					for n in os.listdir(path) if n.endswith('.py')
+			)
+		else:
+			mtime = os.stat(path).st_mtime
+		return [path, mtime]
+
+	@staticmethod
+	def _build_entry(name, key):
+		klass = PluginManager.get_plugin_class(name)
+		extends = set(e for e, k in klass.discover_extensions_classes())
+		lazy = klass.__init__.im_func is PluginClass.__init__.im_func
+		entry = {
+			'key': key,
+			'info': klass.plugin_info,
+			'extends': sorted(extends),
+			'lazy': lazy,
+		}
+		return json.loads(json.dumps(entry)) # same types as when loaded
+
+	def _write(self):
+		try:
+			self.file.write(json.dumps({
+				'version': PLUGIN_MANIFEST_VERSION,
+				'zim_version': zim.__version__,
+				'language': _gettext_language(),
+				'plugins': self._plugins,
+			}, sort_keys=True))
+		except:
+			logger.exception('Could not write plugin manifest: %s', self.file)
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_plugin_manifest():
+	'''Returns the L{PluginManifest} shared by all plugin managers'''
+	global _manifest
+	with _manifest_lock:
+		if _manifest is None:
+			from zim.config import XDG_CACHE_HOME
+			_manifest = PluginManifest(XDG_CACHE_HOME.subdir('zim').file('plugins.json'))
+		return _manifest
+
+
 class PluginClass(ConnectorMixin, SignalEmitter):
 	'''Base class for plugins objects.
 
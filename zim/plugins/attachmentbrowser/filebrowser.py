@@ -83,6 +83,7 @@ class FileBrowserIconView(gtk.IconView):
 		self.icon_size = None
 		self.folder = None
 		self._thumbnailer = ThumbnailQueue()
+		self._thumbmanager = ThumbnailManager()
 		self._idle_event_id = None
 		self._monitor = None
 		self._mtime = None
@@ -187,14 +188,21 @@ class FileBrowserIconView(gtk.IconView):
 
 			pixbuf, mtime = cache.pop(file.basename, (None, None))
 			if show_thumbs and file.isimage():
-				if not pixbuf:
-					pixbuf = my_get_mime_icon(file) # temporary icon
-					mtime = None
-
 				if icon_size_changed:
-					self._thumbnailer.queue_thumbnail_request(file, self.icon_size)
-				else:
-					self._thumbnailer.queue_thumbnail_request(file, self.icon_size, mtime)
+					pixbuf, mtime = None, None
+
+				if mtime is None or mtime != file.mtime():
+					# Show existing thumbnails at once, only go
+					# through the queue for new or outdated ones
+					thumbfile, thumb = \
+						self._thumbmanager.get_indexed_thumbnail(file, self.icon_size)
+					if thumb:
+						pixbuf, mtime = thumb, file.mtime()
+					else:
+						if not pixbuf:
+							pixbuf = my_get_mime_icon(file) # temporary icon
+						mtime = None
+						self._thumbnailer.queue_thumbnail_request(file, self.icon_size)
 			elif pixbuf is None or icon_size_changed:
 				pixbuf = my_get_mime_icon(file)
 				mtime = None
@@ -37,16 +37,27 @@
 # The ThumbnailManager implements the rest of the spec
 #
 # File.uri is already encoded, don't do anything else here
+#
+# In addition to the spec we keep a ThumbnailIndex of thumbnails that
+# are known to be valid, keyed by uri and mtime of the original file.
+# This allows showing existing thumbnails without decoding each
+# thumbnail first to check the mtime attribute.
 
 from __future__ import with_statement
 
 
 import os
+import atexit
 import hashlib
-import time
+import sqlite3
 import threading
 import Queue
 
+try:
+	import multiprocessing
+except ImportError: #pragma: no cover
+	multiprocessing = None
+
 import gtk
 
 import logging
@@ -76,6 +87,18 @@ LOCAL_THUMB_STORAGE_FAIL = LocalFolder(LOCAL_THUMB_STORAGE_FAIL.path)
 THUMB_SIZE_NORMAL = 128
 THUMB_SIZE_LARGE = 256
 
+THUMB_INDEX_FILE = XDG_CACHE_HOME.subdir('zim').file('thumbnails.db').path
+
+#: Timeout in seconds for creating a thumbnail in a worker process
+THUMB_PROCESS_TIMEOUT = 30
+
+
+def _default_workers():
+	try:
+		return min(multiprocessing.cpu_count(), 4)
+	except (AttributeError, NotImplementedError):
+		return 2
+
 
 class ThumbnailCreatorFailure(ValueError):
 	pass
@@ -92,7 +115,8 @@ def pixbufThumbnailCreator(file, thumbfile, thumbsize):
 		# .svg causes segfaults on windows, even if svg support enabled 
 		raise ThumbnailCreatorFailure
 
-	tmpfile = thumbfile.parent().file('zim-thumb.new~')
+	tmpfile = thumbfile.parent().file(thumbfile.basename + '.zim-new~')
+		# unique per thumbnail, multiple workers can be creating thumbnails
 	options = { # no unicode allowed in options!
 		'tEXt::Thumb::URI': str(file.uri),
 		'tEXt::Thumb::MTime': str(int(file.mtime())),
@@ -108,21 +132,95 @@ def pixbufThumbnailCreator(file, thumbfile, thumbsize):
 		return pixbuf
 
 
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+	# Pool of worker processes shared by all queues, returns None if
+	# not supported. Requires fork, else the workers would need to
+	# import gtk again.
+	global _process_pool
+	with _process_pool_lock:
+		if _process_pool is None:
+			_process_pool = False
+			if multiprocessing is not None and hasattr(os, 'fork'):
+				try:
+					_process_pool = multiprocessing.Pool(_default_workers())
+				except:
+					logger.exception('Could not start worker processes for thumbnails')
+				else:
+					atexit.register(_close_process_pool)
+		return _process_pool or None
+
+
+def _close_process_pool():
+	global _process_pool
+	with _process_pool_lock:
+		if _process_pool:
+			_process_pool.terminate()
+			_process_pool.join()
+		_process_pool = None
+
+
+def _create_thumbnail_in_process(path, thumbpath, thumbsize):
+	# Runs in the worker process, the pixbuf can not be returned, so
+	# the caller needs to load it from the thumbnail file
+	pixbufThumbnailCreator(LocalFile(path), LocalFile(thumbpath), thumbsize)
+
+
+def processThumbnailCreator(file, thumbfile, thumbsize):
+	'''Thumbnailer implementation that runs L{pixbufThumbnailCreator}
+	in a worker process, so multiple images can be decoded in parallel.
+	Falls back to running in the current process if worker processes
+	are not supported.
+	@returns: C{None}, the caller should load the thumbnail file
+	@raises ThumbnailCreatorFailure: if creation fails or does not
+	finish within C{THUMB_PROCESS_TIMEOUT} seconds, e.g. because the
+	decoder crashed the worker process
+	'''
+	pool = _get_process_pool()
+	if pool is None:
+		return pixbufThumbnailCreator(file, thumbfile, thumbsize)
+	else:
+		result = pool.apply_async(_create_thumbnail_in_process,
+			(file.path, thumbfile.path, thumbsize))
+		try:
+			result.get(THUMB_PROCESS_TIMEOUT)
+		except multiprocessing.TimeoutError:
+			logger.warning('Timeout while creating thumbnail for: %s', file)
+			raise ThumbnailCreatorFailure
+		return None
+
+
 class ThumbnailQueue(object):
 
 	'''Wrapper for L{ThumbnailManager} that does that actual thumbnailing
-	in a separate thread and manages the requests and the results with
-	queues.
+	in a pool of worker threads and manages the requests and the results
+	with queues. For the default thumbnail creator the images are
+	decoded in worker processes, see L{processThumbnailCreator()}.
+
+	Worker threads are started by L{start()} and stop when the input
+	queue is empty.
 	'''
 
-	def __init__(self, thumbnailcreator=pixbufThumbnailCreator):
-		self._thread = None
+	def __init__(self, thumbnailcreator=pixbufThumbnailCreator, workers=None):
+		'''Constructor
+		@param thumbnailcreator: function to create thumbnails
+		@param workers: number of worker threads, defaults to the
+		number of CPUs with a maximum of 4
+		'''
+		self._use_processes = thumbnailcreator is pixbufThumbnailCreator
+		if self._use_processes:
+			thumbnailcreator = processThumbnailCreator
+		self.workers = workers or _default_workers()
+		self._threads = []
 		self._in_queue = Queue.Queue()
 		self._out_queue = Queue.Queue()
 		self._thumbmanager = ThumbnailManager(thumbnailcreator)
 		self._count = 0
 		self._count_lock = threading.Lock()
-		self._running = threading.Event()
+		self._generation = 0 # incremented by clear_queue()
 
 	def queue_empty(self):
 		'''Returns C{True} when both input and output queue are empty'''
@@ -140,61 +238,82 @@ class ThumbnailQueue(object):
 		'''
 		with self._count_lock:
 			self._count += 1
-			self._in_queue.put_nowait((file, size, mtime))
+			self._in_queue.put_nowait((self._generation, file, size, mtime))
 
 	def start(self):
-		if not (self._thread and self._thread.is_alive()):
-			self._running.set()
-			self._thread = threading.Thread(
-				name=self.__class__.__name__,
-				target=self._thread_main,
-			)
-			self._thread.setDaemon(True)
-			self._thread.start()
+		'''Start worker threads to process the queue'''
+		if self._use_processes:
+			_get_process_pool() # start in main thread, before our threads
 
-	def _thread_main(self):
-		# Loop executed in the thread
-		import time
-		try:
-			while self._running.is_set():
-				time.sleep(0.1) # give other threads a change as well
-				file, size, mtime = self._in_queue.get_nowait()
-				self._in_queue.task_done()
+		with self._count_lock:
+			while len(self._threads) < self.workers:
+				thread = threading.Thread(
+					name=self.__class__.__name__,
+					target=self._thread_main,
+				)
+				thread.setDaemon(True)
+				self._threads.append(thread)
+				thread.start()
 
+	def _thread_main(self):
+		# Loop executed in the worker threads, checks for an empty
+		# queue while locked, so no request can be added without
+		# start() seeing this thread stopped
+		while True:
+			with self._count_lock:
 				try:
-					if mtime and file.mtime() == mtime:
-						self._count -= 1 # skip
-					else:
-						mtime = file.mtime()
-						thumbfile, pixbuf = self._thumbmanager.get_thumbnail(file, size)
-						if thumbfile and pixbuf:
-							self._out_queue.put_nowait((file, size, thumbfile, pixbuf, mtime))
-						else:
-							self._count -= 1 # skip
-				except:
-					logger.exception('Exception in thumbnail queue')
-					self._count -= 1 # drop
-		except Queue.Empty:
-			pass
-		finally:
-			self._running.clear()
+					generation, file, size, mtime = self._in_queue.get_nowait()
+					self._in_queue.task_done()
+				except Queue.Empty:
+					self._threads.remove(threading.current_thread())
+					return
+
+				if generation != self._generation:
+					continue # cleared
+
+			result = None
+			try:
+				if mtime and file.mtime() == mtime:
+					pass # skip
+				else:
+					mtime = file.mtime()
+					thumbfile, pixbuf = self._thumbmanager.get_thumbnail(file, size)
+					if thumbfile and pixbuf:
+						result = (generation, file, size, thumbfile, pixbuf, mtime)
+			except:
+				logger.exception('Exception in thumbnail queue')
+
+			with self._count_lock:
+				if generation != self._generation:
+					pass # cleared while we were working, count is reset
+				elif result:
+					self._out_queue.put_nowait(result)
+				else:
+					self._count -= 1 # skip or drop
 
 	def get_ready_thumbnail(self, block=False):
 		'''Check output queue for a thumbnail that is ready
 		@returns: a 5-tuple C{(file, size, thumbfile, pixbuf, mtime)} or 5 times
 		C{None} when nothing is ready and C{block} is C{False}.
 		'''
+		try:
+			result = self._out_queue.get(block=block)
+			self._out_queue.task_done()
+		except Queue.Empty:
+			return (None, None, None, None, None)
+
 		with self._count_lock:
-			try:
-				file, size, thumbfile, pixbuf, mtime = self._out_queue.get(block=block)
-				self._out_queue.task_done()
-				assert self._count > 0
-				self._count -= 1
-				return file, size, thumbfile, pixbuf, mtime
-			except Queue.Empty:
-				return (None, None, None, None, None)
+			if result[0] != self._generation:
+				return (None, None, None, None, None) # cleared
+
+			assert self._count > 0
+			self._count -= 1
+			return result[1:]
 
 	def clear_queue(self):
+		'''Drop all requests and results, requests that are being
+		processed by the workers are dropped when they are done
+		'''
 		def _clear_queue(queue):
 				try:
 					while True:
@@ -204,16 +323,114 @@ class ThumbnailQueue(object):
 					pass
 
 		with self._count_lock: # nothing in or out while locked!
-			self._running.clear() # stop thread from competing with us
+			self._generation += 1
 			_clear_queue(self._in_queue)
+			_clear_queue(self._out_queue)
+			self._count = 0
 
-			if self._thread and self._thread.is_alive():
-				self._thread.join()
-				self._thread = None
 
-			_clear_queue(self._out_queue)
+class ThumbnailIndex(object):
+	'''Index of thumbnails that are known to be valid. For each
+	original file it records the mtime of the file when the thumbnail
+	was created or checked. The index is kept in memory and on disk
+	in a sqlite database, so it survives restarts.
 
-			self._count = 0
+	Errors in the database are logged and disable the on disk part,
+	they are not fatal. Methods can be called from multiple threads.
+	'''
+
+	def __init__(self, dbpath):
+		'''Constructor
+		@param dbpath: a file path for the sqlite db, or C{":memory:"}
+		'''
+		self.dbpath = dbpath
+		self._lock = threading.Lock()
+		self._entries = {} # (uri, large) -> mtime
+		self._db = None
+		try:
+			if dbpath != ':memory:':
+				LocalFile(dbpath).parent().touch()
+			self._db = sqlite3.Connection(dbpath, check_same_thread=False)
+			self._db.execute('PRAGMA synchronous=OFF')
+			self._db.execute(
+				'CREATE TABLE IF NOT EXISTS thumbnails ('
+				'uri TEXT, large INTEGER, mtime INTEGER, '
+				'PRIMARY KEY (uri, large))'
+			)
+			for uri, large, mtime in self._db.execute(
+				'SELECT uri, large, mtime FROM thumbnails'
+			):
+				self._entries[(uri, large)] = mtime
+		except:
+			logger.exception('Could not open thumbnail index: %s', dbpath)
+			self._db = None
+
+	@staticmethod
+	def _key(file, size):
+		return (unicode(file.uri), int(size > THUMB_SIZE_NORMAL))
+
+	def _execute(self, *args):
+		# Write to db, must be called while locked
+		if self._db is None:
+			return
+		try:
+			self._db.execute(*args)
+			self._db.commit()
+		except sqlite3.Error:
+			logger.exception('Error in thumbnail index, index not saved')
+			self._db.close()
+			self._db = None
+
+	def is_valid(self, file, size, mtime):
+		'''Check whether a thumbnail is known to be valid
+		@param file: the original file
+		@param size: the thumbnail size in pixels
+		@param mtime: the current mtime of the original file
+		@returns: C{True} if a thumbnail was recorded for this mtime
+		'''
+		return self._entries.get(self._key(file, size)) == int(mtime)
+
+	def add(self, file, size, mtime):
+		'''Record a valid thumbnail
+		@param file: the original file
+		@param size: the thumbnail size in pixels
+		@param mtime: the mtime of the original file
+		'''
+		key = self._key(file, size)
+		mtime = int(mtime)
+		with self._lock:
+			if self._entries.get(key) != mtime:
+				self._entries[key] = mtime
+				self._execute(
+					'INSERT OR REPLACE INTO thumbnails(uri, large, mtime) '
+					'VALUES (?, ?, ?)', key + (mtime,)
+				)
+
+	def remove(self, file):
+		'''Remove the records for all thumbnail sizes of a file
+		@param file: the original file
+		'''
+		uri = unicode(file.uri)
+		with self._lock:
+			if (uri, 0) in self._entries or (uri, 1) in self._entries:
+				self._entries.pop((uri, 0), None)
+				self._entries.pop((uri, 1), None)
+				self._execute('DELETE FROM thumbnails WHERE uri = ?', (uri,))
+
+
+_thumbnail_index = None
+_thumbnail_index_lock = threading.Lock()
+
+
+def get_thumbnail_index():
+	'''Get the L{ThumbnailIndex} object shared by all thumbnail
+	managers in this process
+	'''
+	global _thumbnail_index
+	with _thumbnail_index_lock:
+		if _thumbnail_index is None:
+			_thumbnail_index = ThumbnailIndex(THUMB_INDEX_FILE)
+		return _thumbnail_index
 
 
 class ThumbnailManager(object):
@@ -221,8 +438,14 @@ class ThumbnailManager(object):
 	the C{freedesktop.org} spec.
 	'''
 
-	def __init__(self, thumbnailcreator=pixbufThumbnailCreator):
+	def __init__(self, thumbnailcreator=pixbufThumbnailCreator, index=None):
+		'''Constructor
+		@param thumbnailcreator: function to create thumbnails
+		@param index: a L{ThumbnailIndex}, defaults to the index
+		returned by L{get_thumbnail_index()}
+		'''
 		self._thumbnailcreator = thumbnailcreator
+		self.index = index or get_thumbnail_index()
 
 	def get_thumbnail_file(self, file, size):
 		'''Get L{File} object for thumbnail
@@ -258,6 +481,7 @@ class ThumbnailManager(object):
 			pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(thumbfile.encodedpath, size, size)
 			mtime = pixbuf.get_option('tEXt::Thumb::MTime')
 			if mtime and int(mtime) == int(file.mtime()):
+				self.index.add(file, size, mtime)
 				return thumbfile, pixbuf
 			else:
 				pass # according to spec recreate when option is missing
@@ -270,6 +494,29 @@ class ThumbnailManager(object):
 		else:
 			return None, None
 
+	def get_indexed_thumbnail(self, file, size):
+		'''Get a thumbnail if it is known to be valid from the
+		L{ThumbnailIndex}. This is cheaper than L{get_thumbnail()}
+		and can be used to show thumbnails without delay, but returns
+		nothing for thumbnails that are not in the index yet.
+		@param file: the file to be thumbnailed as L{File} object
+		@param size: pixel size for thumbnail image as integer
+		@returns: a 2-tuple of the thumbnail file and a pixbuf object
+		or 2 times C{None}
+		'''
+		if not isinstance(file, LocalFile) \
+		or not self.index.is_valid(file, size, file.mtime()):
+			return None, None
+
+		thumbfile = self.get_thumbnail_file(file, size)
+		try:
+			pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(thumbfile.encodedpath, size, size)
+		except:
+			# e.g. the thumbnail was removed by another application
+			return None, None
+		else:
+			return thumbfile, pixbuf
+
 	def create_thumbnail(self, file, size):
 		'''(Re-)create a thumbnail without any checking whether the
 		old one is still valid.
@@ -285,8 +532,10 @@ class ThumbnailManager(object):
 		thumbsize = THUMB_SIZE_NORMAL if size <= THUMB_SIZE_NORMAL else THUMB_SIZE_LARGE
 
 		thumbfile.parent().touch(mode=0o700)
+		mtime = file.mtime()
 		pixbuf = self._thumbnailcreator(file, thumbfile, thumbsize)
 		os.chmod(thumbfile.encodedpath, 0o600)
+		self.index.add(file, size, mtime)
 
 		if not pixbuf:
 			pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(thumbfile.encodedpath, size, size)
@@ -303,6 +552,7 @@ class ThumbnailManager(object):
 		file is removed or updated.
 		@param file: the original file
 		'''
+		self.index.remove(file)
 		for size in (THUMB_SIZE_NORMAL, THUMB_SIZE_LARGE):
 			thumbfile = self.get_thumbnail_file(file, size)
 			try:
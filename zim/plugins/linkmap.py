@@ -50,24 +50,11 @@ class LinkMap(object):
 			for link in self.notebook.links.list_links(page):
 				yield link
 
-	def _links(self, path, depth, seen=None):
-		if seen is None:
-			seen = set()
-
-		for link in self.notebook.links.list_links(path, direction=LINK_DIR_BOTH):
-			key = (link.source.name, link.target.name)
-
-			if not key in seen:
-				yield link
-				seen.add(key)
-
-				if link.source == path:
-					other = link.target
-				else:
-					other = link.source
-				if depth > 0:
-					for link in self._links(other, depth - 1, seen):
-						yield link
+	def _links(self, path, depth):
+		# Links of all pages within "depth" steps of path, so the
+		# neighbourhood includes the pages they link to
+		return self.notebook.links.list_links_neighbourhood(
+			path, depth + 1, direction=LINK_DIR_BOTH)
 
 	def get_linkmap(self, format=None):
 		dotcode = self.get_dotcode()
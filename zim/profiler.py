@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''Startup profiler, used for the C{--profile-startup} commandline option
+
+The L{StartupProfiler} measures the time spent importing each module
+and the time spent in named sections of code, like loading a plugin.
+Imports are measured by wrapping the builtin C{__import__} function,
+so only modules imported after the profiler was started are reported.
+Therefore C{zim.py} starts the profiler before importing the application
+modules when the option is given.
+
+Code that wants to report a section uses L{profile_section()}, which
+does nothing when no profiler is active.
+'''
+
+from __future__ import with_statement
+
+import __builtin__
+import sys
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+_profiler = None
+
+
+def start_profiler(start_time=None):
+	'''Start profiling, does nothing if a profiler is active already
+	@param start_time: optional timestamp for the start of the process,
+	defaults to the current time
+	@returns: the active L{StartupProfiler}
+	'''
+	global _profiler
+	if _profiler is None:
+		_profiler = StartupProfiler(start_time)
+		_profiler.start()
+	return _profiler
+
+
+def stop_profiler():
+	'''Stop profiling
+	@returns: the L{StartupProfiler} that was active or C{None}
+	'''
+	global _profiler
+	profiler, _profiler = _profiler, None
+	if profiler is not None:
+		profiler.stop()
+	return profiler
+
+
+def get_profiler():
+	'''Returns the active L{StartupProfiler} or C{None}'''
+	return _profiler
+
+
+@contextmanager
+def profile_section(label):
+	'''Context manager to measure the time of a section of code
+	@param label: the label for the section in the report, sections
+	with the same label are added up
+	'''
+	profiler = _profiler
+	if profiler is None:
+		yield
+	else:
+		t = time.time()
+		try:
+			yield
+		finally:
+			profiler.add_section(label, time.time() - t)
+
+
+class StartupProfiler(object):
+	'''Profiler for imports and sections of code
+
+	Only imports in the thread that started the profiler are measured,
+	imports in other threads are passed through.
+
+	@ivar start_time: timestamp for the start of the profile
+	@ivar modules: dict mapping module names to a 2-tuple of the total
+	time and the time excluding nested imports
+	@ivar sections: dict mapping section labels to the total time
+	'''
+
+	def __init__(self, start_time=None):
+		self.start_time = start_time or time.time()
+		self.modules = {}
+		self.sections = {}
+		self._thread = None
+		self._import = None
+		self._stack = []
+
+	def start(self):
+		'''Install the import hook'''
+		self._thread = threading.current_thread()
+		self._import = __builtin__.__import__
+		__builtin__.__import__ = self._timed_import
+
+	def stop(self):
+		'''Remove the import hook'''
+		if __builtin__.__import__ == self._timed_import:
+			__builtin__.__import__ = self._import
+
+	def add_section(self, label, seconds):
+		'''Add time to a section
+		@param label: the section label
+		@param seconds: the time spent
+		'''
+		self.sections[label] = self.sections.get(label, 0) + seconds
+
+	def _timed_import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+		if threading.current_thread() is not self._thread:
+			return self._import(name, globals, locals, fromlist, level)
+
+		relname = self._relative_name(name, globals, level)
+		known = (name in sys.modules, relname in sys.modules)
+		self._stack.append(0)
+		t = time.time()
+		try:
+			return self._import(name, globals, locals, fromlist, level)
+		finally:
+			total = time.time() - t
+			nested = self._stack.pop()
+			if self._stack:
+				self._stack[-1] += total
+
+			# Only record imports that actually loaded the module,
+			# implicit relative imports leave a None in sys.modules
+			# when they fall back to an absolute import
+			if relname and sys.modules.get(relname) is not None:
+				if not known[1]:
+					self.modules[relname] = (total, total - nested)
+			elif not known[0] and name in sys.modules:
+				self.modules[name] = (total, total - nested)
+
+	def _relative_name(self, name, globals, level):
+		# Full module name in case this is a relative import
+		if level != 0 and globals and '__name__' in globals:
+			package = globals['__name__']
+			if not '__path__' in globals:
+				package = package.rpartition('.')[0]
+			if level > 1:
+				package = package.rsplit('.', level - 1)[0]
+			if package:
+				return package + '.' + name if name else package
+		return None
+
+	def report(self, stream=None):
+		'''Print a report of the timings
+		@param stream: file object to write to, defaults to C{sys.stderr}
+		'''
+		stream = stream or sys.stderr
+		print >>stream, 'Startup profile, total time %.3fs' % (time.time() - self.start_time)
+
+		if self.sections:
+			print >>stream, '\nSections:'
+			for label, seconds in sorted(self.sections.items(), key=lambda i: -i[1]):
+				print >>stream, '  %-40s %8.3fs' % (label, seconds)
+
+		if self.modules:
+			print >>stream, '\nImports:%s %9s %9s' % (' ' * 33, 'self', 'total')
+			for name, times in sorted(self.modules.items(), key=lambda i: -i[1][1]):
+				print >>stream, '  %-40s %8.3fs %8.3fs' % (name, times[1], times[0])
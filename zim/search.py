@@ -24,9 +24,13 @@ Supported keywords:
 	- C{ContentOrName}: the default, like Name: *X* or Content: X
 	- C{Tag}: look for a single tag
 
-For the Content field we need to request the actual page contents,
-all other fields we get from the index and are more efficient to
-query.
+For the Content field we use the full text index when available, for
+wildcards and phrases this only gives a pre-selection and we need to
+request the actual page contents to confirm a match. All other fields
+we get from the index and are more efficient to query. The
+L{QueryPlanner} translates these fields into SQL queries on the index
+and estimates how many pages they match, so the most selective terms
+in a group can be processed first.
 
 For link keywords only a '*' at the right side is allowed
 For the name keyword a '*' is allowed on both sides
@@ -44,13 +48,17 @@ For content '*' can occur on both sides, but does not match whitespace
 # below it.
 
 
+from __future__ import with_statement
+
 import re
+import threading
 import logging
 
 from zim.parsing import split_quoted_strings, unescape_quoted_string, Re
-from zim.notebook import Path, \
-	PageNotFoundError, IndexNotFoundError, \
-	LINK_DIR_BACKWARD, LINK_DIR_FORWARD
+from zim.newfs import FileNotFoundError
+from zim.utils.threading import FunctionThread
+from zim.notebook import Path, PageNotFoundError
+from zim.notebook.index import ContentView, PagesView, IndexView, ROOT_ID
 
 
 logger = logging.getLogger('zim.search')
@@ -79,6 +87,30 @@ keyword_re = Re('(' + '|'.join(KEYWORDS) + '):(.*)', re.I)
 operators_re = Re(r'^(\|\||\&\&|\+|\-)')
 tag_re = Re(r'^\@(\w+)$', re.U)
 
+_fulltext_word_re = re.compile(r'\w+', re.U)
+_fulltext_prefix_re = re.compile(r'^\w+\*$', re.U)
+
+# Non-ascii characters that match an ascii character with re.I | re.U,
+# the LIKE operator in sqlite does not know this, so page names with
+# these characters are always candidates for a name match
+_like_special_glob = u'*[\u0130\u212a]*'
+
+
+def _like_escape(string):
+	# Escape a string for a LIKE pattern with "ESCAPE '\'". Since LIKE
+	# only does case folding for ascii, other characters are replaced
+	# by the "_" wildcard
+	chars = []
+	for c in string:
+		if c in u'\\%_':
+			chars.append(u'\\' + c)
+		elif ord(c) > 127:
+			chars.append(u'_')
+		else:
+			chars.append(c)
+	return u''.join(chars)
+
+
 class QueryTerm(object):
 	'''Wrapper for a single term in a query. Consists of a keyword,
 	a string and a flag for inverse (NOT operator).
@@ -210,6 +242,156 @@ class Query(object):
 			return None
 
 
+class QueryPlanner(IndexView):
+	'''Index view that translates search terms for the name, namespace,
+	tag and link keywords into SQL queries on the index.
+
+	For name keywords the query uses the C{LIKE} operator, which selects
+	a super set of the pages matched by the regular expressions used by
+	L{SearchSelection}. So results still need to be checked against the
+	regex. Tag and link keywords give an exact result.
+	'''
+
+	NAME_KEYWORDS = ('name', 'namespace', 'section', 'contentorname')
+	INDEX_KEYWORDS = NAME_KEYWORDS + ('linksfrom', 'linksto', 'tag')
+
+	def __init__(self, db):
+		IndexView.__init__(self, db)
+		self._pages = PagesView(db)
+
+	def n_all_pages(self):
+		'''Returns the total number of pages in the index'''
+		c, = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()
+		return c - 1 # don't count ROOT
+
+	def list_all_pages(self):
+		'''Returns a set of L{Path} objects for all pages in the index'''
+		return set(
+			Path(row[0]) for row in self.db.execute(
+				'SELECT name FROM pages WHERE id<>?', (ROOT_ID,))
+		)
+
+	def list_pages(self, term):
+		'''Get the pages that match a search term, ignoring the
+		C{inverse} flag of the term
+		@param term: a L{QueryTerm} with one of the keywords in
+		C{INDEX_KEYWORDS}
+		@returns: a set of L{Path} objects, for name keywords this is a
+		super set of the pages that match
+		'''
+		sql, args = self._select(term, 'DISTINCT pages.name')
+		if sql is None:
+			return set()
+		else:
+			return set(Path(row[0]) for row in self.db.execute(sql, args))
+
+	def estimate(self, term):
+		'''Estimate the number of pages that match a search term
+		@param term: a L{QueryTerm} with one of the keywords in
+		C{INDEX_KEYWORDS}
+		@returns: an integer, for name keywords this is an upper limit
+		'''
+		sql, args = self._select(term, 'COUNT(DISTINCT pages.name)')
+		if sql is None:
+			n = 0
+		else:
+			n, = self.db.execute(sql, args).fetchone()
+
+		if term.inverse:
+			return self.n_all_pages() - n
+		else:
+			return n
+
+	def _select(self, term, columns):
+		# Returns SQL and arguments to select pages for a term, or
+		# (None, None) if no page can match
+		if term.keyword in self.NAME_KEYWORDS:
+			patterns = self._like_patterns(term)
+			return (
+				'SELECT %s FROM pages WHERE pages.id<>? AND (%s OR pages.name GLOB ?)'
+					% (columns, ' OR '.join(["pages.name LIKE ? ESCAPE '\\'"] * len(patterns))),
+				[ROOT_ID] + patterns + [_like_special_glob]
+			)
+		elif term.keyword == 'tag':
+			tag = term.string.strip('*').lstrip('@') # XXX
+			return (
+				'SELECT %s FROM tagsources '
+				'INNER JOIN tags ON tagsources.tag=tags.id '
+				'INNER JOIN pages ON tagsources.source=pages.id '
+				'WHERE tags.name=?' % columns,
+				(tag,)
+			)
+		elif term.keyword in ('linksfrom', 'linksto'):
+			if term.string.endswith('*'):
+				recurs = True
+				string = term.string.rstrip('*')
+			else:
+				recurs = False
+				string = term.string
+
+			try:
+				path = self._pages.lookup_from_user_input(string)
+			except ValueError:
+				return None, None
+
+			if recurs:
+				# Page itself and all pages below it
+				where = '(page.name=? OR (page.name>? AND page.name<?))'
+				args = (path.name, path.name + ':', path.name + ';')
+			else:
+				where = 'page.name=?'
+				args = (path.name,)
+
+			if term.keyword == 'linksfrom':
+				return (
+					'SELECT %s FROM links '
+					'INNER JOIN pages AS page ON links.source=page.id '
+					'INNER JOIN pages ON links.target=pages.id '
+					'WHERE %s' % (columns, where),
+					args
+				)
+			else:
+				return (
+					'SELECT %s FROM links '
+					'INNER JOIN pages AS page ON links.target=page.id '
+					'INNER JOIN pages ON links.source=pages.id '
+					'WHERE links.source<>? AND %s' % (columns, where),
+					(ROOT_ID,) + args
+				)
+		else:
+			raise AssertionError('BUG: unknown keyword: %s' % term.keyword)
+
+	@staticmethod
+	def _like_patterns(term):
+		# Like SearchSelection._name_regex() and _namespace_regex()
+		# but for LIKE
+		string = term.string
+		if not isinstance(string, unicode):
+			string = string.decode('UTF-8')
+
+		if term.keyword in ('namespace', 'section'):
+			namespace = _like_escape(string.strip('*:'))
+			return [namespace, namespace + u':%']
+
+		if term.keyword == 'contentorname':
+			string = u'*' + string.strip('*') + u'*'
+
+		if string.startswith('*'):
+			prefix = u'%'
+			string = string.lstrip('*')
+		else:
+			prefix = u''
+			string = string.lstrip(':')
+
+		if string.endswith('*'):
+			postfix = u'%'
+			string = string.rstrip('*')
+		else:
+			postfix = u''
+
+		return [prefix + _like_escape(string) + postfix]
+
+
 class PageSelection(set):
 	'''This class is just a container of path objects'''
 
@@ -228,6 +410,9 @@ class SearchSelection(PageSelection):
 		self.cancelled = False
 		self.query = None
 		self.scores = {}
+		self._content = None
+		self._content_names_cache = None
+		self._planner = None
 
 	def search(self, query, selection=None, callback=None):
 		'''Populate this SearchSelection with results for a query.
@@ -246,27 +431,119 @@ class SearchSelection(PageSelection):
 
 		If the callback returns C{False} the search is cancelled.
 		'''
+		self._reset(query)
+		self.update(self._process_group(query.root, selection, callback))
+		self._cleanup_scores()
+
+	def iter_search(self, query, selection=None, limit=None, offset=0, callback=None):
+		'''Generator that searches for a query and yields results as
+		soon as they are found. Like L{search()} this method flushes any
+		previous results in this set, and the set is updated while the
+		search progresses. When C{limit} results have been yielded the
+		search is stopped, so the set only contains the partial results.
+
+		Results are yielded in the order they are found, scores in
+		C{scores} are only final when the search is completed. Use
+		L{search()} followed by L{ranked()} to get results ordered by
+		score.
+
+		@param query: a L{Query} object
+		@param selection: a prior selection to search within, will result in a sub-set
+		@param limit: maximum number of results to yield, or C{None}
+		@param offset: number of results to skip before yielding
+		@param callback: a function to call in between steps in the
+		search, like for L{search()}. If it returns C{False} the search
+		is cancelled.
+		@returns: yields L{Path} objects
+		'''
+		self._reset(query)
+		if limit is not None and limit < 1:
+			return
+
+		i = 0
+		for results, path, done in self._iter_group(query.root, selection):
+			if callback and not done and not callback(results, path):
+				self.cancelled = True
+				break
+			elif results is None or len(results) == len(self):
+				continue # nothing new
+			elif path is not None and len(results) == len(self) + 1 \
+			and Path(path.name) in results:
+				new = [Path(path.name)] # common case for content search
+			else:
+				new = sorted(results - self, key=lambda p: p.name)
+
+			for newpath in new:
+				self.add(newpath)
+				i += 1
+				if i > offset:
+					yield newpath
+					if limit is not None and i >= offset + limit:
+						self.cancelled = True # no need to look further
+						self._cleanup_scores()
+						return
+
+		self._cleanup_scores()
+
+	def ranked(self, limit=None, offset=0):
+		'''Get the results ordered by score, best matches first.
+		Results with the same score are ordered by name.
+		@param limit: maximum number of results, or C{None}
+		@param offset: number of results to skip
+		@returns: a list of L{Path} objects
+		'''
+		paths = sorted(self, key=lambda p: (-self.scores.get(p, 0), p.name))
+		if limit is None:
+			return paths[offset:]
+		else:
+			return paths[offset:offset+limit]
+
+	def _reset(self, query):
 		# Clear state
 		self.cancelled = False
 		self.query = query
 		self.clear()
 		self.scores = {}
+		self._content_names_cache = None
+		if self._planner is None:
+			self._planner = QueryPlanner.new_from_index(self.notebook.index)
 
-		# Actual search
-		self.update(self._process_group(query.root, selection, callback))
-
-		# Clean up results
+	def _cleanup_scores(self):
 		scored = set(self.scores.keys())
 		for path in scored - self:
 			self.scores.pop(path)
 
 	def _process_group(self, group, scope=None, callback=None):
+		# Runs _iter_group() for a QueryGroup and calls the callback
+		# function for each intermediate step. Returns the results for
+		# the group, or the last transmitted results when the search
+		# is cancelled.
+		last = None
+		for results, path, done in self._iter_group(group, scope):
+			if done:
+				return results
+			elif results is not None:
+				last = results
+
+			if callback and not callback(results, path):
+				self.cancelled = True
+				break
+
+		return last or set()
+
+	def _iter_group(self, group, scope=None):
 		# This method processes all search terms in a QueryGroup
 		# it is recursive for nested QueryGroup objects and calls
-		# _process_from_index and _process_content to handle
+		# _process_from_index and _iter_content to handle
 		# QueryTerms in the group. It takes care of combining the
-		# results from various terms and calling the callback
-		# function when possible
+		# results from various terms.
+		#
+		# Yields 3-tuples of the results so far, the last searched
+		# path (or None) and a boolean whether the group is done. The
+		# results are None when they can not be transmitted yet, e.g.
+		# for AND before the last term is processed. Results that are
+		# transmitted only grow in later steps. The last item yielded
+		# has the final results for the group.
 
 		# Special case to optimize for simple OR query to give callback results
 		if len(group) == 1 and isinstance(group[0], QueryGroup):
@@ -290,73 +567,70 @@ class SearchSelection(PageSelection):
 		# Decide what operator to use
 		if group.operator == OPERATOR_AND:
 			op_func = self._and_operator
+			# Most selective terms first, each next term only
+			# needs to look at the results so far
+			if len(indexterms) > 1:
+				indexterms.sort(key=self._planner.estimate)
 		else:
 			op_func = self._or_operator
 
-		# First process index terms - no callback in between - this is fast
+		# First process index terms - no intermediate results - this is fast
 		results = None
 		for term in indexterms:
 			results, scope = op_func(results, scope,
 				self._process_from_index(term, scope))
+			if group.operator == OPERATOR_AND and not results:
+				yield set(), None, True # no need to look further
+				return
 
-		if callback:
-			if group.operator == OPERATOR_AND:
-				cont = callback(None, None) # do not transmit results yet
-			else:
-				cont = callback(results, None)
-
-			if not cont:
-				self.cancelled = True
-				return results or set()
-
-		# Next we process subgroups - recursing - callback after each group
-		def callbackwrapper(results, path):
-			# Don't update results from subgroup match, but do allow cancel
-			if callback:
-				return callback(None, path)
-			else:
-				return True
+		if group.operator == OPERATOR_AND:
+			yield None, None, False # do not transmit results yet
+		else:
+			yield results, None, False
 
+		# Next we process subgroups - recursing
 		for term in subgroups:
-			results, scope = op_func(results, scope,
-				self._process_group(term, scope, callbackwrapper))
+			subresults = set()
+			for subresults, path, done in self._iter_group(term, scope):
+				if not done:
+					# Don't transmit results from subgroup match
+					yield None, path, False
 
-			if callback:
-				if group.operator == OPERATOR_AND:
-					cont = callback(None, None) # do not transmit results yet
-				else:
-					cont = callback(results, None)
+			results, scope = op_func(results, scope, subresults)
+			if group.operator == OPERATOR_AND and not results:
+				yield set(), None, True # no need to look further
+				return
 
-				if not cont:
-					self.cancelled = True
-					return results or set()
+			if group.operator == OPERATOR_AND:
+				yield None, None, False # do not transmit results yet
+			else:
+				yield results, None, False
 
 		# Optimization of the contentorname items to quickly show results for name
 		for term in contentterms:
 			if scope and id(scope) == id(results):
 				scope = scope.copy()
-			myscope = scope # local copy here, need to pass full scope to _process_content
+			myscope = scope # local copy here, need to pass full scope to _iter_content
 			if term.keyword == 'contentorname':
 				results, myscope = op_func(results, myscope,
 					self._process_from_index(term, myscope, scoring=10))
 
-		if callback and (
-			group.operator == OPERATOR_OR or
-			all(term.keyword == 'contentorname' for term in contentterms)
-		):
-			cont = callback(results, None)
-			if not cont:
-				self.cancelled = True
-				return results or set()
+		if group.operator == OPERATOR_OR \
+		or all(term.keyword == 'contentorname' for term in contentterms):
+			yield results, None, False
 
 		# Now do the content terms all at once per page - slow or very slow
 		if contentterms:
-			results = self._process_content(
-				contentterms, results, scope, group.operator, callback)
+			if results is None:
+				results = SearchSelection(None)
 
-		# And return our results as summed by the operator
-		return results or set()
+			for path in self._iter_content(
+				contentterms, results, scope, group.operator
+			):
+				yield results, path, False
 
+		# And return our results as summed by the operator
+		yield results or set(), None, True
 
 	@staticmethod
 	def _and_operator(results, scope, newresults):
@@ -393,14 +667,15 @@ class SearchSelection(PageSelection):
 			if scope:
 				generator = iter(scope)
 			else:
-				generator = self.notebook.pages.walk()
+				# Pre-selection from index, needs check with regex
+				generator = self._planner.list_pages(term)
 
 			if term.keyword in ('namespace', 'section'):
 				regex = self._namespace_regex(term.string)
 			elif term.keyword == 'contentorname':
 				# More lax matching for default case
 				regex = self._name_regex('*' + term.string.strip('*') + '*')
-				term.name_regex = regex # needed in _process_content
+				term.name_regex = regex # needed in _iter_content
 			else:
 				regex = self._name_regex(term.string)
 
@@ -409,48 +684,8 @@ class SearchSelection(PageSelection):
 				if regex.match(path.name):
 					myresults.add(path)
 
-		elif term.keyword in ('linksfrom', 'linksto'):
-			if term.keyword == 'linksfrom':
-				dir = LINK_DIR_FORWARD
-			else:
-				dir = LINK_DIR_BACKWARD
-
-			if term.string.endswith('*'):
-				recurs = True
-				string = term.string.rstrip('*')
-			else:
-				recurs = False
-				string = term.string
-
-			try:
-				path = self.notebook.pages.lookup_from_user_input(string)
-			except ValueError:
-				pass
-			else:
-
-				try:
-					if recurs:
-						links = self.notebook.links.list_links_section(path, dir)
-					else:
-						links = self.notebook.links.list_links(path, dir)
-				except IndexNotFoundError:
-					pass
-				else:
-
-					if dir == LINK_DIR_FORWARD:
-						for link in links:
-							myresults.add(link.target)
-					else:
-						for link in links:
-							myresults.add(link.source)
-
-		elif term.keyword == 'tag':
-			tag = term.string.strip('*') # XXX
-			try:
-				for path in self.notebook.tags.list_pages(tag):
-					myresults.add(path)
-			except IndexNotFoundError:
-				pass
+		elif term.keyword in ('linksfrom', 'linksto', 'tag'):
+			myresults.update(self._planner.list_pages(term))
 		else:
 			assert False, 'BUG: unknown keyword: %s' % term.keyword
 
@@ -461,10 +696,7 @@ class SearchSelection(PageSelection):
 		# Inverse selection
 		if term.inverse:
 			if not scope:
-				# initialize scope with whole notebook :S
-				scope = set()
-				for p in self.notebook.pages.walk():
-					scope.add(p)
+				scope = self._planner.list_all_pages()
 			inverse = scope - myresults
 			myresults.clear()
 			myresults.update(inverse)
@@ -474,10 +706,11 @@ class SearchSelection(PageSelection):
 
 		return myresults
 
-	def _process_content(self, terms, results, scope, operator, callback=None):
+	def _iter_content(self, terms, results, scope, operator):
 		# Process terms for content, process many at once in order to
 		# only open the page once and allow for a linear behavior of the
-		# callback function. (We could also have relied on page objects
+		# callback function. Matches are added to 'results', yields each
+		# path after it is searched. (We could also have relied on page objects
 		# caching the parsetree, but then there is no way to support a
 		# useful callback method.)
 		# Note that this rationale is for flat searches, once sub-groups
@@ -488,41 +721,52 @@ class SearchSelection(PageSelection):
 		# contentorname optimization
 		# For OR 'results' is whatever was found so far while 'scope' can be larger
 		# we extend the results with any matches from scope
+		#
+		# If the full text index is available it is used to narrow down
+		# the pages to check. Pages are only opened when a term can not
+		# be answered from the full text index alone, e.g. wildcards.
 		for term in terms:
 			term.content_regex = self._content_regex(term.string)
 			# term.name_regex already defined in _process_from_index
+			term.content_hits, term.content_exact = self._content_hits(term.string)
 
-		if scope:
-			def page_generator():
-				for path in scope:
-					try:
-						yield self.notebook.get_page(path)
-					except PageNotFoundError:
-						pass
-			generator = page_generator()
+		candidates = self._content_candidates(terms, operator)
+		if candidates is not None:
+			if scope:
+				generator = [p for p in candidates if p in scope]
+			else:
+				generator = candidates
+		elif scope:
+			generator = scope
 		else:
-			generator = map(self.notebook.get_page, self.notebook.pages.walk())
+			generator = self.notebook.pages.walk()
 
-		if results is None:
-			results = SearchSelection(None)
+		# Candidates from the full text index all have content, else we
+		# need to open the page to check
+		need_tree = candidates is None \
+			or not all(term.content_exact for term in terms)
 
-		for page in generator:
-			#~ print '!! Search content', page
-			try:
-				tree = page.get_parsetree()
-			except:
-				logger.exception('Exception while reading: %s', page)
-				continue
+		for path in generator:
+			#~ print '!! Search content', path
+			tree = None
+			if need_tree:
+				try:
+					tree = self._get_parsetree(path)
+				except PageNotFoundError:
+					continue
+				except:
+					logger.exception('Exception while reading: %s', path)
+					continue
 
-			if tree is None:
-				continue # Assume need to have content even for negative query
+				if tree is None:
+					continue # Assume need to have content even for negative query
 
-			path = Path(page.name)
+			path = Path(path.name)
 			if operator == OPERATOR_AND:
 				score = 0
 				for term in terms:
 					#~ print '!! Count AND %s' % term
-					myscore = tree.countre(term.content_regex)
+					myscore = self._count_content(term, path, tree)
 					if term.keyword == 'contentorname' \
 					and term.name_regex.match(path.name):
 						myscore += 1 # effective score going to 11
@@ -539,7 +783,7 @@ class SearchSelection(PageSelection):
 			else: # OPERATOR_OR
 				for term in terms:
 					#~ print '!! Count OR %s' % term
-					score = tree.countre(term.content_regex)
+					score = self._count_content(term, path, tree)
 					if term.keyword == 'contentorname' \
 					and term.name_regex.match(path.name):
 						score += 1 # effective score going to 11
@@ -548,15 +792,104 @@ class SearchSelection(PageSelection):
 						results.add(path)
 						self._count_score(path, score or 1)
 
-			if callback:
-				# Since we are always last in the processing of the
-				# (top-level) group, we can call the callback with all results
-				cont = callback(results, path)
-				if not cont:
-					self.cancelled = True
-					break
+			# Since we are always last in the processing of the
+			# (top-level) group, the results are complete up to here
+			yield path
+
+	def _get_parsetree(self, path):
+		page = self.notebook.get_page(path)
+		return page.get_parsetree()
+
+	def _content_hits(self, string):
+		# Look up a content term in the full text index. Returns a dict
+		# mapping page names to the number of hits (or None if the term
+		# can not be looked up) and a boolean whether the hits exactly
+		# match the regex from _content_regex(). If not exact, the hits
+		# are a super set of the pages that match.
+		query, exact = self._fulltext_query(string)
+		if query is None:
+			return None, False
+
+		if self._content is None:
+			self._content = ContentView.new_from_index(self.notebook.index)
+		if not self._content.available:
+			return None, False
+
+		hits = {}
+		for path, n in self._content.match(query):
+			hits[path.name] = n
+		return hits, exact
+
+	def _content_candidates(self, terms, operator):
+		# Returns the pages to check for content terms as a sorted list
+		# of paths, or None if all pages in scope need to be checked.
+		# For the "contentorname" keyword pages with content that match
+		# the name are candidates as well.
+		def term_names(term):
+			names = set(term.content_hits)
+			if term.keyword == 'contentorname':
+				names.update(
+					n for n in self._content_names() if term.name_regex.match(n))
+			return names
+
+		if operator == OPERATOR_AND:
+			names = None
+			for term in terms:
+				if term.content_hits is not None and not term.inverse:
+					if names is None:
+						names = term_names(term)
+					else:
+						names &= term_names(term)
+		else:
+			if any(t.content_hits is None or t.inverse for t in terms):
+				return None
+			names = set()
+			for term in terms:
+				names.update(term_names(term))
+
+		if names is None:
+			return None
+		else:
+			return [Path(name) for name in sorted(names)]
 
-		return results
+	def _content_names(self):
+		# Cached list of names for all pages in the full text index
+		if self._content_names_cache is None:
+			self._content_names_cache = [p.name for p in self._content.list_pages()]
+		return self._content_names_cache
+
+	@staticmethod
+	def _count_content(term, path, tree):
+		if term.content_exact:
+			return term.content_hits.get(path.name, 0)
+		else:
+			return tree.countre(term.content_regex)
+
+	def _fulltext_query(self, string):
+		# Build a query for the full text index for a content search term.
+		# Returns the query and a boolean whether results match exactly
+		# what _content_regex() would match. Only single words are exact,
+		# for phrases and prefixes the query is used as a pre-selection.
+		# Returns (None, False) if the term can not be expressed as
+		# a full text query.
+		if not isinstance(string, unicode):
+			string = string.decode('UTF-8')
+
+		if any(u'\u4e00' <= c <= u'\u9fff' for c in string):
+			return None, False # chinese does not use whitespace as delimiter
+		elif '*' in string:
+			if _fulltext_prefix_re.match(string):
+				return u'"%s*"' % string.rstrip('*'), False
+			else:
+				return None, False
+		else:
+			words = _fulltext_word_re.findall(string)
+			if not words:
+				return None, False
+			elif len(words) == 1 and words[0] == string:
+				return u'"%s"' % string, True
+			else:
+				return u'"%s"' % ' '.join(words), False
 
 	def _name_regex(self, string, case=False):
 		# Build a regex for matching a glob against a page name
@@ -588,9 +921,9 @@ class SearchSelection(PageSelection):
 		namespace = re.escape(string.strip('*:'))
 		regex = r'^(' + namespace + '$|' + namespace + ':)'
 		if case:
-			return re.compile(regex)
+			return re.compile(regex, re.U)
 		else:
-			return re.compile(regex, re.I)
+			return re.compile(regex, re.U | re.I)
 
 	def _content_regex(self, string, case=False):
 		# Build a regex for a content search term, expands wildcards
@@ -620,3 +953,88 @@ class SearchSelection(PageSelection):
 			return re.compile(regex, re.U)
 		else:
 			return re.compile(regex, re.U | re.I)
+
+
+class _SourceSearchSelection(SearchSelection):
+	# SearchSelection that reads page content directly from the source
+	# files instead of using Page objects. Pages that are open in the
+	# interface can only be accessed from the main thread, so this is
+	# needed for searching in a background thread.
+
+	def _get_parsetree(self, path):
+		layout = self.notebook.layout
+		file, folder = layout.map_page(path)
+		try:
+			text, etag = file.read_with_etag()
+		except FileNotFoundError:
+			return None
+
+		cache = self.notebook.parsetree_cache
+		tree = cache.get(path.name, etag[1]) if cache else None
+		if tree is None:
+			tree = layout.get_format(file).Parser().parse(text)
+			if cache:
+				cache.set(path.name, etag[1], tree)
+		return tree
+
+
+class SearchThread(FunctionThread):
+	'''Thread that runs a search in the background. Results can be
+	collected from another thread with L{pop_results()} while the
+	search is running.
+
+	The thread only reads from the notebook: the index is accessed
+	with a connection for this thread and page content is read from
+	the source files. So content that is modified in the interface
+	but not yet saved is not seen by the search.
+
+	@ivar query: the L{Query} object
+	@ivar selection: a L{SearchSelection} with the results, only
+	complete when the thread is C{done} and not cancelled
+	'''
+
+	def __init__(self, notebook, query, selection=None):
+		'''Constructor
+		@param notebook: a L{Notebook} object
+		@param query: a L{Query} object
+		@param selection: a prior selection to search within
+		'''
+		FunctionThread.__init__(self, self._search, (selection,))
+		self.setDaemon(True)
+		self.query = query
+		self.selection = _SourceSearchSelection(notebook)
+		self._cancelled = threading.Event()
+		self._lock = threading.Lock()
+		self._results = []
+
+	@property
+	def cancelled(self):
+		'''C{True} when L{cancel()} was called'''
+		return self._cancelled.is_set()
+
+	def cancel(self):
+		'''Stop the search, the thread will stop after finishing the
+		current step in the search, usually one page. Results that were
+		found so far are kept.
+		'''
+		self._cancelled.set()
+
+	def pop_results(self):
+		'''Get the results found since the last call
+		@returns: a list of 2-tuples of a L{Path} and the score at the
+		time the path was found, scores can still increase in later
+		steps of the search
+		'''
+		with self._lock:
+			results, self._results = self._results, []
+		return results
+
+	def _search(self, selection):
+		for path in self.selection.iter_search(
+			self.query, selection, callback=self._check_cancelled
+		):
+			with self._lock:
+				self._results.append((path, self.selection.scores.get(path, 0)))
+
+	def _check_cancelled(self, results, path):
+		return not self._cancelled.is_set()
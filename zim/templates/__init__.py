@@ -58,7 +58,9 @@ from zim.signals import SignalEmitter
 
 
 from zim.templates.parser import TemplateParser
-from zim.templates.processor import TemplateProcessor, TemplateContextDict
+from zim.templates.processor import TemplateProcessor, TemplateContextDict, \
+	StreamOutput
+from zim.templates.compiler import get_compiled_template
 from zim.templates.functions import build_template_functions
 
 
@@ -136,6 +138,9 @@ class Template(SignalEmitter):
 	It takes care of parsing a template file and allows evaluating
 	the template with a given set of template parameters.
 
+	Templates are compiled to python code, which is cached, see
+	L{get_compiled_template()}.
+
 	@signal: C{process (output, context)}: emitted by the "process" method
 	'''
 
@@ -155,11 +160,7 @@ class Template(SignalEmitter):
 		@param file: a L{File} object for the template file
 		'''
 		self.filename = file.path
-		try:
-			self.parts = TemplateParser().parse(file.read())
-		except Exception as error:
-			error.parser_file = file
-			raise
+		self.compiled = get_compiled_template(file)
 
 		self.resources_dir = None
 		if '.' in file.basename:
@@ -170,8 +171,8 @@ class Template(SignalEmitter):
 
 	def process(self, output, context):
 		'''Evaluate the template
-		@param output: an object that has an C{append()} method (e.g. a C{list})
-		to receive the output text
+		@param output: an object that has an C{append()} method (e.g. a C{list}
+		or a L{StreamOutput}) to receive the output text
 		@param context: a C{dict} with a set of template parameters.
 		This dict is copied to prevent changes to the original dict when
 		processing the template
@@ -182,5 +183,4 @@ class Template(SignalEmitter):
 		self.emit('process', output, context)
 
 	def do_process(self, output, context):
-		processor = TemplateProcessor(self.parts)
-		processor.process(output, context)
+		self.compiled.process(output, context)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
+
+'''This module contains the compiler that turns a parsed template into
+python code. This is an alternative to the L{TemplateProcessor} which
+walks the parse tree each time the template is executed.
+
+The L{TemplateCompiler} generates python source for the template
+control flow and expressions, where parameter lookup and function
+calls go through the same checks as L{Expression} objects. So the
+compiled template is just as restricted as the template processor,
+it only skips the overhead of interpreting the parse tree.
+
+The resulting code object can be serialized with C{marshal}, which
+allows caching compiled templates on disk, see L{get_compiled_template()}.
+'''
+
+from __future__ import with_statement
+
+import sys
+import marshal
+import hashlib
+import operator
+import collections
+import threading
+import logging
+
+logger = logging.getLogger('zim.templates')
+
+import zim
+
+from zim.utils import MovingWindowIter
+from zim.newfs import LocalFile
+
+from zim.templates.parser import TemplateParser
+from zim.templates.processor import TemplateContextDict, \
+	TemplateLoopState, set_parameter
+from zim.templates.expression import \
+	ExpressionLiteral, ExpressionParameter, ExpressionList, \
+	ExpressionOperator, ExpressionUnaryOperator, ExpressionFunctionCall, \
+	lookup_parameter
+
+
+#: Version of the compiled code, cache is dropped when it does not match
+COMPILER_VERSION = '%s-%s-1' % (zim.__version__, sys.version.split()[0])
+
+
+_operators = {
+	operator.eq: '==',
+	operator.ne: '!=',
+	operator.gt: '>',
+	operator.ge: '>=',
+	operator.lt: '<',
+	operator.le: '<=',
+	operator.and_: '&',
+	operator.or_: '|',
+}
+
+
+def _loop(context, items, parts, name):
+	# Generator used for the "FOR" loop in compiled code, sets the loop
+	# variable and the "loop" parameter for each iteration
+	if not isinstance(items, collections.Iterable):
+		raise TypeError('Can not iterate over: %s' % items)
+	elif not isinstance(items, collections.Sized):
+		# cast to list to ensure we have a len()
+		items = list(items)
+
+	outer = context.get('loop')
+	if isinstance(outer, TemplateLoopState):
+		loop = TemplateLoopState(len(items), outer)
+	else:
+		loop = TemplateLoopState(len(items), None)
+	context['loop'] = loop
+
+	myiter = MovingWindowIter(items)
+	for i, window in enumerate(myiter):
+		loop._update(i, myiter)
+		set_parameter(context, parts, name, window[1])
+		yield
+
+	context['loop'] = outer
+
+
+def _lookup_parent(context, parts):
+	# Get the object that should contain the function named by parts
+	if len(parts) > 1:
+		return lookup_parameter(context, parts[:-1])
+	else:
+		return context
+
+
+#: Namespace for executing compiled templates, code only has access to
+#: these functions
+_runtime = {
+	'__builtins__': {'unicode': unicode, 'AssertionError': AssertionError},
+	'_lookup': lookup_parameter,
+	'_lookup_parent': _lookup_parent,
+	'_function': ExpressionFunctionCall.lookup_function,
+	'_set': set_parameter,
+	'_loop': _loop,
+}
+
+
+class TemplateCompiler(object):
+	'''Compiler that turns the parts of a parsed template in python
+	code. The code defines a function C{main(output, context)} for the
+	template and a function for each block.
+	'''
+
+	def compile(self, parts, filename='<template>'):
+		'''Compile a template
+		@param parts: A list of L{SimpleTreeElement}s as produced by
+		L{TemplateParser.parse()}
+		@param filename: the file name used in tracebacks
+		@returns: a python code object
+		'''
+		main = None
+		blocks = []
+		for item in parts:
+			if item.tag == 'TEMPLATE':
+				main = item
+			elif item.tag == 'BLOCK':
+				blocks.append(item)
+			else:
+				raise AssertionError('Unknown tag: %s' % item.tag)
+
+		if main is None:
+			raise AssertionError('Missing main part of template')
+
+		self._lines = []
+		self._blocks = {}
+		for i, item in enumerate(blocks):
+			self._blocks[item.get('name')] = '_block%i' % i
+
+		self._function('main', main)
+		for item in blocks:
+			self._function(self._blocks[item.get('name')], item)
+
+		source = '\n'.join(self._lines) + '\n'
+		self._lines = None
+		return compile(source, filename, 'exec')
+
+	def _function(self, name, elements):
+		self._lines.append('def %s(output, context):' % name)
+		self._lines.append('\t_append = output.append')
+		self._statements(elements, 1)
+
+	def _emit(self, indent, line):
+		self._lines.append('\t' * indent + line)
+
+	def _statements(self, elements, indent):
+		n = len(elements)
+		i = 0
+		while i < n:
+			element = elements[i]
+			i += 1
+			if isinstance(element, basestring):
+				self._emit(indent, '_append(%r)' % element)
+			elif element.tag == 'GET':
+				self._emit(indent, '_append(unicode(%s))' % self._expr(element.attrib['expr']))
+			elif element.tag == 'SET':
+				var = element.attrib['var']
+				self._emit(indent, '_set(context, %r, %r, %s)' % (
+					tuple(var.parts), var.name, self._expr(element.attrib['expr'])))
+			elif element.tag in ('IF', 'ELIF'):
+				# Subsequent ELIF / ELSE clauses are part of the same statement
+				self._emit(indent, 'if %s:' % self._expr(element.attrib['expr']))
+				self._block(element, indent + 1)
+				while i < n and not isinstance(elements[i], basestring) \
+				and elements[i].tag in ('ELIF', 'ELSE'):
+					element = elements[i]
+					i += 1
+					if element.tag == 'ELIF':
+						self._emit(indent, 'elif %s:' % self._expr(element.attrib['expr']))
+						self._block(element, indent + 1)
+					else:
+						self._emit(indent, 'else:')
+						self._block(element, indent + 1)
+						break
+			elif element.tag == 'ELSE':
+				self._statements(element, indent)
+			elif element.tag == 'FOR':
+				var = element.attrib['var']
+				self._emit(indent, 'for _ in _loop(context, %s, %r, %r):' % (
+					self._expr(element.attrib['expr']), tuple(var.parts), var.name))
+				self._block(element, indent + 1)
+			elif element.tag == 'INCLUDE':
+				expr = element.attrib['expr']
+				if isinstance(expr, ExpressionParameter):
+					if expr.name in self._blocks:
+						self._emit(indent, '%s(output, context)' % self._blocks[expr.name])
+					else:
+						self._raise(indent, 'No such block defined: %s' % expr.name)
+				else:
+					self._raise(indent, 'TODO also allow files from template resources')
+			else:
+				self._raise(indent, 'Unknown instruction: %s' % element.tag)
+
+	def _block(self, elements, indent):
+		n = len(self._lines)
+		self._statements(elements, indent)
+		if len(self._lines) == n:
+			self._emit(indent, 'pass')
+
+	def _raise(self, indent, msg):
+		# Errors are raised when the template is executed, like the
+		# template processor does
+		self._emit(indent, 'raise AssertionError(%r)' % msg)
+
+	def _expr(self, expr):
+		# Returns python source for an expression
+		if isinstance(expr, ExpressionLiteral):
+			return repr(expr.value)
+		elif isinstance(expr, ExpressionParameter):
+			return '_lookup(context, %r)' % (tuple(expr.parts),)
+		elif isinstance(expr, ExpressionList):
+			return '[%s]' % ', '.join(self._expr(item) for item in expr.items)
+		elif isinstance(expr, ExpressionOperator):
+			return '(%s %s %s)' % (
+				self._expr(expr.lexpr), _operators[expr.operator], self._expr(expr.rexpr))
+		elif isinstance(expr, ExpressionUnaryOperator):
+			assert expr.operator is operator.not_
+			return '(not %s)' % self._expr(expr.rexpr)
+		elif isinstance(expr, ExpressionFunctionCall):
+			param = expr.param
+			return '_function(_lookup_parent(context, %r), %r, %r)(%s)' % (
+				tuple(param.parts), param.key, param.name,
+				', '.join(self._expr(item) for item in expr.args.items))
+		else:
+			raise AssertionError('Unknown expression: %r' % expr)
+
+
+class CompiledTemplate(object):
+	'''Compiled version of a template, can be used instead of a
+	L{TemplateProcessor}. Objects are stateless, so they can be shared
+	between multiple threads.
+	'''
+
+	def __init__(self, code):
+		'''Constructor
+		@param code: a code object as returned by
+		L{TemplateCompiler.compile()}
+		'''
+		namespace = dict(_runtime)
+		exec code in namespace
+		self.code = code
+		self._main = namespace['main']
+
+	@classmethod
+	def new_from_parts(klass, parts, filename='<template>'):
+		'''Compile a template
+		@param parts: A list of L{SimpleTreeElement}s as produced by
+		L{TemplateParser.parse()}
+		@param filename: the file name used in tracebacks
+		@returns: a new L{CompiledTemplate}
+		'''
+		return klass(TemplateCompiler().compile(parts, filename))
+
+	def process(self, output, context):
+		'''Execute the template once
+		@param output: an object to recieve the template output, can be
+		a C{list} and should support at least an C{append()} method to
+		recieve string content
+		@param context: a L{TemplateContextDict} object with the
+		template parameters
+		'''
+		assert isinstance(context, TemplateContextDict)
+		self._main(output, context)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_file(file):
+	from zim.config import XDG_CACHE_HOME
+	path = file.path.encode('utf-8') if isinstance(file.path, unicode) else file.path
+	key = hashlib.md5(path).hexdigest()
+	dir = XDG_CACHE_HOME.subdir(('zim', 'templates'))
+	return LocalFile(dir.file(key + '.bin').path) # XXX convert
+
+
+def get_compiled_template(file):
+	'''Get a compiled template for a template file. Compiled templates
+	are cached both in memory and on disk. The cache is keyed by the
+	file path and checked against the mtime and size of the file, so
+	the template is only parsed and compiled again when it changed.
+	@param file: a L{File} object for the template file
+	@returns: a L{CompiledTemplate}
+	@raises FileNotFoundError: if the file does not exist
+	'''
+	if not file.exists():
+		file.read() # raises FileNotFoundError
+
+	key = (file.mtime(), file.size())
+	with _cache_lock:
+		if file.path in _cache and _cache[file.path][0] == key:
+			return _cache[file.path][1]
+
+	template = _load_from_disk(file, key)
+	if template is None:
+		text = file.read()
+		try:
+			parts = TemplateParser().parse(text)
+		except Exception as error:
+			error.parser_file = file
+			raise
+		template = CompiledTemplate.new_from_parts(parts, file.path)
+		_save_to_disk(file, key, template)
+
+	with _cache_lock:
+		_cache[file.path] = (key, template)
+	return template
+
+
+def _load_from_disk(file, key):
+	cachefile = _cache_file(file)
+	if not cachefile.exists():
+		return None
+
+	try:
+		version, path, mykey, code = marshal.loads(cachefile.read_binary())
+		if version == COMPILER_VERSION and path == file.path \
+		and tuple(mykey) == key:
+			return CompiledTemplate(code)
+	except:
+		logger.exception('Could not load compiled template: %s', cachefile)
+	return None
+
+
+def _save_to_disk(file, key, template):
+	cachefile = _cache_file(file)
+	try:
+		data = marshal.dumps((COMPILER_VERSION, file.path, key, template.code))
+		cachefile.write_binary(data)
+	except:
+		logger.exception('Could not save compiled template: %s', cachefile)
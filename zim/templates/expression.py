@@ -38,12 +38,43 @@ execution in expressions.
 
 
 import collections
-import inspect
+import types
 import logging
 
 logger = logging.getLogger('zim.templates')
 
 
+_code_types = (types.MethodType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def lookup_parameter(context, parts):
+	'''Lookup a parameter value, used by L{ExpressionParameter} and
+	by compiled templates
+	@param context: the context with parameter values
+	@param parts: sequence of names and list indices, e.g.
+	C{("page", "title")} for the parameter "page.title"
+	@returns: the parameter value or C{None} if it does not exist
+	@raises AssertionError: if the value is a function or method
+	'''
+	value = context
+	for i, p in enumerate(parts):
+		try:
+			try:
+				value = value[p]
+			except TypeError:
+				# not indexable, or wrong key type - try getattr
+				value = getattr(value, p)
+		except (IndexError, KeyError, AttributeError):
+			# We got right type, but data is not there
+			logger.warning('No such parameter: %s', '.'.join(map(str, parts[:i + 1])))
+			return None
+
+		if isinstance(value, _code_types):
+			raise AssertionError('Can not access parameter: %s' % '.'.join(map(str, parts)))
+
+	return value
+
+
 class Expression(object):
 	'''Base class for all expressions'''
 
@@ -114,25 +145,7 @@ class ExpressionParameter(Expression):
 				and self.name == other.name
 
 	def __call__(self, context):
-		value = context
-		for i, p in enumerate(self.parts):
-			try:
-				try:
-					value = value[p]
-				except TypeError:
-					# not indexable, or wrong key type - try getattr
-					value = getattr(value, p)
-			except (IndexError, KeyError, AttributeError):
-				# We got right type, but data is not there
-				logger.warning('No such parameter: %s', '.'.join(map(str, self.parts[:i + 1])))
-				return None
-
-			if inspect.ismethod(value) \
-			or inspect.isfunction(value) \
-			or inspect.isbuiltin(value):
-				raise AssertionError('Can not access parameter: %s' % self.name)
-
-		return value
+		return lookup_parameter(context, self.parts)
 
 	@property
 	def parent(self):
@@ -258,36 +271,48 @@ class ExpressionFunctionCall(Expression):
 		return (self.param, self.args) == (other.param, other.args)
 
 	def __call__(self, context):
+		obj = self.param.parent(context)
+		function = self.lookup_function(obj, self.param.key, self.param.name)
+		args = self.args(context)
+		return function(*args)
+
+	@classmethod
+	def lookup_function(klass, obj, key, name):
+		'''Lookup a function, used by L{ExpressionFunctionCall} and by
+		compiled templates
+		@param obj: the parent object of the function
+		@param key: the function name in C{obj}
+		@param name: the full parameter name, used for error messages
+		@returns: an L{ExpressionFunction} object
+		@raises AssertionError: if there is no such function
+		'''
 		## Lookup function:
 		## getitem dict / getattr objects / getattr on wrapper
-		obj = self.param.parent(context)
-		name = self.param.key
 		try:
-			function = obj[name]
+			function = obj[key]
 			if not isinstance(function, ExpressionFunction):
 				raise KeyError
 		except (TypeError, KeyError):
-			if hasattr(obj, name) \
-			and isinstance(getattr(obj, name), ExpressionFunction):
-				function = getattr(obj, name)
+			if hasattr(obj, key) \
+			and isinstance(getattr(obj, key), ExpressionFunction):
+				function = getattr(obj, key)
 			else:
-				wrapper = self.wrap_object(obj)
+				wrapper = klass.wrap_object(obj)
 				if wrapper is not None \
-				and hasattr(wrapper, name) \
-				and isinstance(getattr(wrapper, name), ExpressionFunction):
-					function = getattr(wrapper, name)
+				and hasattr(wrapper, key) \
+				and isinstance(getattr(wrapper, key), ExpressionFunction):
+					function = getattr(wrapper, key)
 				else:
-					raise AssertionError('Not a valid function: %s' % self.param.name)
+					raise AssertionError('Not a valid function: %s' % name)
 
-		## Execute function
 		if not isinstance(function, ExpressionFunction):
 			# Just being paranoid here, but leave it in to block any mistakes in above lookup
-			raise AssertionError('Not a valid function: %s' % self.param.name)
+			raise AssertionError('Not a valid function: %s' % name)
 
-		args = self.args(context)
-		return function(*args)
+		return function
 
-	def wrap_object(self, obj):
+	@staticmethod
+	def wrap_object(obj):
 		'''Find a suitable wrapper that exposes safe methods for
 		a given object
 		'''
@@ -32,6 +32,56 @@ class TemplateContextDict(ExpressionDictObject):
 	) # adding methods for mutuable mapping here
 
 
+def set_parameter(context, parts, name, value):
+	'''Set a parameter value, used by L{TemplateProcessor} and by
+	compiled templates
+	@param context: a L{TemplateContextDict}
+	@param parts: sequence of names, e.g. C{("page", "title")} for
+	the parameter "page.title"
+	@param name: the full parameter name, used for error messages
+	@param value: the new value
+	@raises AssertionError: if the parameter can not be assigned
+	'''
+	# We only allow setting in pre-defined TemplateContextDict's
+	namespace = context
+	for key in parts[:-1]:
+		if namespace \
+		and isinstance(namespace, TemplateContextDict):
+			namespace = namespace.get(key)
+		else:
+			raise AssertionError('Can not assign: %s' % name)
+
+	if namespace is not None \
+	and isinstance(namespace, TemplateContextDict):
+		namespace[parts[-1]] = value
+	else:
+		raise AssertionError('Can not assign: %s' % name)
+
+
+class StreamOutput(object):
+	'''Output object for L{TemplateProcessor.process()} that writes
+	the template output directly to a stream. Use this instead of a
+	list to keep memory use constant when the output is large, e.g.
+	when exporting a whole notebook to a single file.
+	'''
+
+	def __init__(self, stream, endofline='\n'):
+		'''Constructor
+		@param stream: a file-like object with a C{write()} method
+		@param endofline: the line end to use in the output
+		'''
+		self.stream = stream
+		self.endofline = endofline
+
+	def append(self, text):
+		'''Write a piece of output
+		@param text: the output text
+		'''
+		if self.endofline != '\n':
+			text = text.replace('\n', self.endofline)
+		self.stream.write(text)
+
+
 class TemplateProcessor(object):
 	'''The template processor takes a parsed template and "executes" it
 	one or more times.
@@ -73,7 +123,8 @@ class TemplateProcessor(object):
 		'''Execute the template once
 		@param output: an object to recieve the template output, can be
 		a C{list} and should support at least an C{append()} method to
-		recieve string content
+		recieve string content, use a L{StreamOutput} to write the
+		output directly to a file
 		@param context: a L{TemplateContextDict} object with the
 		template parameters
 		'''
@@ -82,20 +133,7 @@ class TemplateProcessor(object):
 
 	@staticmethod
 	def _set(context, var, value):
-		# We only allow setting in pre-defined TemplateContextDict's
-		namespace = context
-		for name in var.parts[:-1]:
-			if namespace \
-			and isinstance(namespace, TemplateContextDict):
-				namespace = namespace.get(name)
-			else:
-				raise AssertionError('Can not assign: %s' % var.name)
-
-		if namespace is not None \
-		and isinstance(namespace, TemplateContextDict):
-			namespace[var.key] = value
-		else:
-			raise AssertionError('Can not assign: %s' % var.name)
+		set_parameter(context, var.parts, var.name, value)
 
 	def __call__(self, output, elements, context):
 		n = len(elements)
@@ -15,26 +15,36 @@ the standalone server.
 '''
 
 # TODO setting for doc_root_url when running in CGI mode
-# TODO support "etg" and "if-none-match' headers at least for icons
 # TODO: redirect server logging to logging module + set default level to -V in server process
 
 
+from __future__ import with_statement
+
 import sys
 import socket
 import logging
+import threading
+import hashlib
+import Queue
 import gobject
 
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
 from functools import partial
 
 from wsgiref.headers import Headers
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
 import urllib
 
 from zim.errors import Error
 from zim.notebook import Notebook, Path, Page, encode_filename, PageNotFoundError
 from zim.fs import File, Dir, FileNotFoundError
+from zim.newfs import LocalFile, LocalFolder
+from zim.newfs import FileNotFoundError as NewFileNotFoundError
 from zim.config import data_file, ConfigManager
 from zim.plugins import PluginManager
 from zim.parsing import url_encode
+from zim.utils import OrderedDict
 
 from zim.export.linker import ExportLinker, StubLayout
 from zim.export.template import ExportTemplateContext
@@ -45,6 +55,16 @@ from zim.formats import get_format
 logger = logging.getLogger('zim.www')
 
 
+#: Default number of rendered pages kept by the L{RenderedPageCache}
+RENDER_CACHE_SIZE = 100
+
+#: Block size used when reading files for a response
+FILE_CHUNK_SIZE = 64 * 1024
+
+#: Max age in seconds for the "Cache-Control" header of template resources
+RESOURCES_MAX_AGE = 3600
+
+
 class WWWError(Error):
 	'''Error with http error code'''
 
@@ -53,6 +73,7 @@ class WWWError(Error):
 		'403': 'Forbidden',
 		'404': 'Not Found',
 		'405': 'Method Not Allowed',
+		'416': 'Requested Range Not Satisfiable',
 		'500': 'Internal Server Error',
 	}
 
@@ -97,6 +118,90 @@ The requested path is not valid
 		WWWError.__init__(self, 'Invalid path', status='403')
 
 
+class RenderedPage(object):
+	'''Cache entry for the L{RenderedPageCache}
+
+	@ivar body: the page content as utf-8 encoded string
+	@ivar etag: the http "ETag" for the content
+	@ivar file: the source file of the page or C{None} for the root
+	index page
+	@ivar mtime: the mtime of the source file or C{None} if it does not
+	exist
+	'''
+
+	__slots__ = ('body', 'etag', 'file', 'mtime')
+
+	def __init__(self, body, file=None, mtime=None):
+		self.body = body
+		self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+		self.file = file
+		self.mtime = mtime
+
+	def is_valid(self):
+		'''Returns C{True} if the source file did not change'''
+		if self.file is None:
+			return True
+
+		mtime = self.file.mtime() if self.file.exists() else None
+		return mtime == self.mtime
+
+
+class RenderedPageCache(object):
+	'''Cache of rendered pages for the L{WWWInterface}, keyed by the
+	url path. Entries for pages are checked against the mtime of the
+	page source. Any change in the index clears the whole cache,
+	because it can affect the links and navigation in any page.
+
+	The least recently used entries are dropped when the cache grows
+	beyond C{max_size}. Methods can be called from multiple threads.
+	'''
+
+	def __init__(self, max_size=RENDER_CACHE_SIZE):
+		'''Constructor
+		@param max_size: maximum number of pages in the cache
+		'''
+		self.max_size = max_size
+		self._pages = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._pages)
+
+	def get(self, path):
+		'''Get a page from the cache
+		@param path: the url path
+		@returns: a L{RenderedPage} or C{None}
+		'''
+		with self._lock:
+			entry = self._pages.pop(path, None)
+			if entry is not None and entry.is_valid():
+				self._pages[path] = entry # move to end
+				return entry
+			else:
+				return None
+
+	def set(self, path, lines, file=None):
+		'''Add a page to the cache
+		@param path: the url path
+		@param lines: the rendered page as list of (unicode) strings
+		@param file: the source file of the page, if any
+		@returns: a L{RenderedPage}
+		'''
+		mtime = file.mtime() if file and file.exists() else None
+		entry = RenderedPage(u''.join(lines).encode('utf-8'), file, mtime)
+		with self._lock:
+			self._pages.pop(path, None)
+			self._pages[path] = entry
+			while len(self._pages) > self.max_size:
+				self._pages.pop(iter(self._pages).next())
+		return entry
+
+	def clear(self):
+		'''Remove all pages from the cache'''
+		with self._lock:
+			self._pages.clear()
+
+
 class WWWInterface(object):
 	'''Class to handle the WWW interface for zim notebooks.
 
@@ -134,6 +239,10 @@ class WWWInterface(object):
 		self.linker_factory = partial(WWWLinker, self.notebook, self.template.resources_dir)
 		self.dumper_factory = get_format('html').Dumper # XXX
 
+		self.render_cache = RenderedPageCache()
+		self.notebook.index.connect('changed',
+			lambda *a: self.render_cache.clear())
+
 		self.plugins = PluginManager(self.config)
 		self.plugins.extend(notebook)
 		self.plugins.extend(self)
@@ -183,24 +292,24 @@ class WWWInterface(object):
 			else:
 				path = urllib.unquote(path)
 
+			rendered = None
+			file = None
 			if path == '/':
 				headers.add_header('Content-Type', 'text/html', charset='utf-8')
-				content = self.render_index()
+				rendered = self.render_cache.get(path)
+				if rendered is None:
+					rendered = self.render_cache.set(path, self.render_index())
 			elif path.startswith('/+docs/'):
 				dir = self.notebook.document_root
 				if not dir:
 					raise WebPageNotFoundError(path)
-				file = dir.file(path[7:])
-				content = [file.raw()]
-					# Will raise FileNotFound when file does not exist
-				headers['Content-Type'] = file.get_mimetype()
+				file = LocalFolder(dir.path).file(path[7:]) # XXX convert
+				status, content = self._serve_file(environ, file, headers)
 			elif path.startswith('/+file/'):
-				file = self.notebook.dir.file(path[7:])
+				file = self.notebook.folder.file(path[7:])
 					# TODO: need abstraction for getting file from top level dir ?
-				content = [file.raw()]
-					# Will raise FileNotFound when file does not exist
-				headers['Content-Type'] = file.get_mimetype()
- 			elif path.startswith('/+resources/'):
+				status, content = self._serve_file(environ, file, headers)
+			elif path.startswith('/+resources/'):
 				if self.template.resources_dir:
 					file = self.template.resources_dir.file(path[12:])
 					if not file.exists():
@@ -209,10 +318,10 @@ class WWWInterface(object):
 					file = data_file('pixmaps/%s' % path[12:])
 
 				if file:
-					content = [file.raw()]
-						# Will raise FileNotFound when file does not exist
-					headers['Content-Type'] = file.get_mimetype()
-	 			else:
+					file = LocalFile(file.path) # XXX convert
+					headers['Cache-Control'] = 'max-age=%i' % RESOURCES_MAX_AGE
+					status, content = self._serve_file(environ, file, headers)
+				else:
 					raise WebPageNotFoundError(path)
 			else:
 				# Must be a page or a namespace (html file or directory path)
@@ -224,26 +333,30 @@ class WWWInterface(object):
 				else:
 					raise WebPageNotFoundError(path)
 
-				path = self.notebook.pages.lookup_from_user_input(pagename)
-				try:
-					page = self.notebook.get_page(path)
-					if page.hascontent:
-						content = self.render_page(page)
-					elif page.haschildren:
-						content = self.render_index(page)
-					else:
+				rendered = self.render_cache.get(path)
+				if rendered is None:
+					urlpath = path
+					path = self.notebook.pages.lookup_from_user_input(pagename)
+					try:
+						page = self.notebook.get_page_copy(path)
+						if page.hascontent:
+							lines = self.render_page(page)
+						elif page.haschildren:
+							lines = self.render_index(page)
+						else:
+							raise WebPageNotFoundError(path)
+					except PageNotFoundError:
 						raise WebPageNotFoundError(path)
-				except PageNotFoundError:
-					raise WebPageNotFoundError(path)
+					rendered = self.render_cache.set(urlpath, lines, page.source_file)
 		except Exception as error:
 			headerlist = []
 			headers = Headers(headerlist)
 			headers.add_header('Content-Type', 'text/plain', charset='utf-8')
-			if isinstance(error, (WWWError, FileNotFoundError)):
-				logger.error(error.msg)
-				if isinstance(error, FileNotFoundError):
+			if isinstance(error, (WWWError, FileNotFoundError, NewFileNotFoundError)):
+				if isinstance(error, (FileNotFoundError, NewFileNotFoundError)):
 					error = WebPageNotFoundError(path)
 					# show url path instead of file path
+				logger.error(error.msg)
 				if error.headers:
 					for key, value in error.headers:
 						headers.add_header(key, value)
@@ -261,14 +374,153 @@ class WWWInterface(object):
 			else:
 				return [string.encode('utf-8') for string in content]
 		else:
+			if file is not None:
+				if status.startswith('304'):
+					headerlist = [(k, v) for k, v in headerlist
+									if k in ('ETag', 'Last-Modified', 'Cache-Control')]
+				start_response(status, headerlist)
+				return content # already encoded
+
+			if rendered is not None:
+				# No "Last-Modified" header, the page also depends on
+				# other pages, like the index and backlinks, so the
+				# mtime of the source file is not reliable. Clients
+				# need to use the "ETag" instead.
+				headers['ETag'] = rendered.etag
+				if self._is_not_modified(environ, rendered.etag, None):
+					headerlist = [(k, v) for k, v in headerlist if k == 'ETag']
+					start_response('304 Not Modified', headerlist)
+					return []
+
+				content = [rendered.body] # already encoded
+
 			start_response('200 OK', headerlist)
 			if environ['REQUEST_METHOD'] == 'HEAD':
 				return []
-			elif 'utf-8' in headers['Content-Type']:
+			elif 'utf-8' in headers['Content-Type'] and rendered is None:
 				return [string.encode('utf-8') for string in content]
 			else:
 				return content
 
+	@staticmethod
+	def _is_not_modified(environ, etag, mtime):
+		# Check conditional request headers, "If-None-Match" takes
+		# precedence over "If-Modified-Since", see RFC 7232
+		if 'HTTP_IF_NONE_MATCH' in environ:
+			etags = [t.strip() for t in environ['HTTP_IF_NONE_MATCH'].split(',')]
+			etags = [t[2:] if t.startswith('W/') else t for t in etags]
+			return '*' in etags or etag in etags
+		elif 'HTTP_IF_MODIFIED_SINCE' in environ and mtime is not None:
+			date = parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+			if date is None:
+				return False # invalid date is ignored
+			try:
+				return int(mtime) <= mktime_tz(date)
+			except (ValueError, OverflowError):
+				return False
+		else:
+			return False
+
+	def _serve_file(self, environ, file, headers):
+		# Prepare the response for a static file, returns the status
+		# and an iterable for the content. The content is read in
+		# chunks while it is send, so large attachments are not loaded
+		# in memory as a whole.
+		if not file.exists():
+			raise NewFileNotFoundError(file)
+
+		size = file.size()
+		mtime = file.mtime()
+		etag = '"%x-%x"' % (int(mtime), size) # no need to hash the content
+		headers['Content-Type'] = file.mimetype()
+		headers['ETag'] = etag
+		headers['Last-Modified'] = formatdate(mtime, usegmt=True)
+		headers['Accept-Ranges'] = 'bytes'
+		if self._is_not_modified(environ, etag, mtime):
+			return '304 Not Modified', []
+
+		byterange = self._parse_range(environ, etag, mtime, size)
+		if byterange is None:
+			status = '200 OK'
+			start, end = 0, size
+		else:
+			status = '206 Partial Content'
+			start, end = byterange
+			headers['Content-Range'] = 'bytes %i-%i/%i' % (start, end - 1, size)
+		headers['Content-Length'] = str(end - start)
+
+		if environ['REQUEST_METHOD'] == 'HEAD':
+			return status, []
+		elif not isinstance(file, LocalFile):
+			return status, [file.read_binary()[start:end]]
+		elif byterange is None and 'wsgi.file_wrapper' in environ:
+			fh = open(file.encodedpath, 'rb')
+			return status, environ['wsgi.file_wrapper'](fh, FILE_CHUNK_SIZE)
+		else:
+			fh = open(file.encodedpath, 'rb')
+			return status, self._iter_file(fh, start, end)
+
+	@staticmethod
+	def _iter_file(fh, start, end):
+		try:
+			fh.seek(start)
+			remaining = end - start
+			while remaining > 0:
+				chunk = fh.read(min(FILE_CHUNK_SIZE, remaining))
+				if not chunk:
+					break # file was truncated in between
+				remaining -= len(chunk)
+				yield chunk
+		finally:
+			fh.close()
+
+	@staticmethod
+	def _parse_range(environ, etag, mtime, size):
+		# Parse the "Range" header, returns a 2-tuple of the start and
+		# end offset or None to serve the whole file. Only a single
+		# byte range is supported, for multiple ranges the whole file
+		# is served, which is allowed by RFC 7233.
+		value = environ.get('HTTP_RANGE')
+		if not value:
+			return None
+
+		if 'HTTP_IF_RANGE' in environ:
+			# Only serve a range if the file did not change
+			ifrange = environ['HTTP_IF_RANGE'].strip()
+			if ifrange.startswith('"') or ifrange.startswith('W/'):
+				if ifrange != etag:
+					return None
+			else:
+				date = parsedate_tz(ifrange)
+				if date is None or mktime_tz(date) != int(mtime):
+					return None
+
+		unit, x, spec = value.partition('=')
+		if unit.strip().lower() != 'bytes' or ',' in spec:
+			return None
+
+		first, x, last = spec.strip().partition('-')
+		try:
+			if first:
+				start = int(first)
+				end = int(last) + 1 if last else size
+				if last and end <= start:
+					return None # invalid range is ignored
+			elif last:
+				start = max(size - int(last), 0)
+				end = size
+				if int(last) == 0:
+					start = size # "-0" is not satisfiable
+			else:
+				return None
+		except ValueError:
+			return None
+
+		if start >= size:
+			raise WWWError('Range not satisfiable', status='416',
+				headers=[('Content-Range', 'bytes */%i' % size)])
+		return start, min(end, size)
+
 	def render_index(self, namespace=None):
 		'''Render an index page
 		@param namespace: the namespace L{Path}
@@ -344,25 +596,124 @@ class WWWLinker(ExportLinker):
 			return file.uri
 
 
+#: Default number of requests that can wait for a worker thread
+DEFAULT_QUEUE_SIZE = 32
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+	'''WSGI server that handles requests in a pool of worker threads,
+	so one slow request does not block all other clients.
+
+	The listening thread puts new connections in a queue, from which
+	they are taken by the workers. When the queue is full, new
+	connections are refused with a "503 Service Unavailable" response.
+
+	The workers share the application object, so it must be thread
+	safe. For the L{WWWInterface} this is the case because:
+	  - each thread gets its own connection to the notebook index,
+	    these are closed again by L{server_close()}
+	  - pages are rendered from read-only copies, see
+	    L{Notebook.get_page_copy()}, and parse trees are only read
+	  - the page, parse tree and rendered page caches are locked
+	'''
+
+	def __init__(self, server_address, handler_class, workers=4, queue_size=DEFAULT_QUEUE_SIZE):
+		'''Constructor
+		@param server_address: 2-tuple of host and port
+		@param handler_class: the request handler class, e.g.
+		C{WSGIRequestHandler}
+		@param workers: the number of worker threads
+		@param queue_size: the maximum number of requests waiting for
+		a worker
+		'''
+		assert workers > 0 and queue_size > 0
+		self.workers = workers
+		self.request_queue_size = queue_size # backlog for listen()
+		self._queue = Queue.Queue(queue_size)
+		self._threads = []
+		WSGIServer.__init__(self, server_address, handler_class)
+
+		for i in range(workers):
+			thread = threading.Thread(
+				target=self._worker_main,
+				name='zim-www-worker-%i' % i,
+			)
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def process_request(self, request, client_address):
+		try:
+			self._queue.put_nowait((request, client_address))
+		except Queue.Full:
+			logger.warning('Request queue full, refusing request from %s', client_address[0])
+			try:
+				request.sendall(
+					'HTTP/1.0 503 Service Unavailable\r\n'
+					'Content-Type: text/plain\r\n'
+					'Retry-After: 1\r\n'
+					'\r\n'
+					'503 Service Unavailable - Server busy\r\n'
+				)
+			except socket.error:
+				pass
+			self.shutdown_request(request)
+
+	def _worker_main(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break # server_close() was called
+
+			request, client_address = item
+			try:
+				self.finish_request(request, client_address)
+			except:
+				self.handle_error(request, client_address)
+			finally:
+				self.shutdown_request(request)
+
+	def server_close(self):
+		WSGIServer.server_close(self)
+		for thread in self._threads:
+			self._queue.put(None)
+		for thread in self._threads:
+			thread.join()
+		self._threads = []
+
+		app = self.get_app()
+		if isinstance(app, WWWInterface):
+			app.notebook.index.close_thread_connections()
+
+
 def main(notebook, port=8080, public=True, **opts):
 	httpd = make_server(notebook, port, public, **opts)
 	logger.info("Serving HTTP on %s port %i...", httpd.server_name, httpd.server_port)
-	httpd.serve_forever()
+	try:
+		httpd.serve_forever()
+	finally:
+		httpd.server_close()
 
 
-def make_server(notebook, port=8080, public=True, **opts):
+def make_server(notebook, port=8080, public=True, workers=1, queue_size=DEFAULT_QUEUE_SIZE, **opts):
 	'''Create a simple http server
 	@param notebook: the notebook location
 	@param port: the http port to serve on
 	@param public: allow connections to the server from other
 	computers - if C{False} can only connect from localhost
+	@param workers: number of worker threads, if more than one
+	requests are handled concurrently by a L{ThreadPoolWSGIServer}
+	@param queue_size: maximum number of requests waiting for a worker
 	@param opts: options for L{WWWInterface.__init__()}
 	@returns: a C{WSGIServer} object
 	'''
 	import wsgiref.simple_server
 	app = WWWInterface(notebook, **opts) # FIXME make opts explicit
-	if public:
-		httpd = wsgiref.simple_server.make_server('', port, app)
+	host = '' if public else 'localhost'
+	if workers > 1:
+		httpd = ThreadPoolWSGIServer(
+			(host, port), WSGIRequestHandler, workers, queue_size)
+		httpd.set_app(app)
 	else:
-		httpd = wsgiref.simple_server.make_server('localhost', port, app)
+		httpd = wsgiref.simple_server.make_server(host, port, app)
 	return httpd